@@ -0,0 +1,160 @@
+###############################################################################
+#
+#  Carelink Client 2 glucose analytics benchmark
+#
+#  Description:
+#
+#    Build times of the web app's pump graph data over 1, 7 and 28 days
+#    of SG readings (288 per day), with NumPy and in pure Python
+#    (carelink_client2_analytics without NumPy):
+#
+#    - old loop: the previous per-item loop over the SG columns plus
+#      stdlib statistics for mean, SD and time in range
+#    - full view: format_pump_graph_data(), every reading and marker
+#    - N-point view: format_pump_graph_data(points=N), LTTB downsampled
+#    - sg_stats: the statistics alone
+#
+#    The series repeat the day in templates/data_graph.json (or --data),
+#    shifted one day back per copy. Times are the best of --repeat runs.
+#
+#  Usage:
+#
+#    python bench/analytics.py [--days 1,7,28] [--points 320] [--repeat 20]
+#
+#    Needs the web app dependencies (flask) and numpy for the numpy
+#    columns (pip install -r requirements.txt).
+#
+#  Changelog:
+#
+#    17/10/2026 - Initial version
+#
+###############################################################################
+
+import os
+import sys
+import copy
+import json
+import time
+import datetime
+import argparse
+import statistics
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import carelink_client2_analytics as analytics
+from carelink_client2_snapshot import Snapshot
+
+
+DEFAULT_DAYS   = "1,7,28"
+DEFAULT_POINTS = 320
+DEFAULT_REPEAT = 20
+TIME_FORMAT    = "%Y-%m-%dT%H:%M:%S"
+
+
+def load_web():
+   spec = importlib.util.spec_from_file_location("minimed_mon_web", os.path.join(ROOT, "minimed-mon-web.py"))
+   module = importlib.util.module_from_spec(spec)
+   spec.loader.exec_module(module)
+   return module
+
+
+###########################################################
+# Data with the fixture's day repeated 'days' times
+###########################################################
+def shift(timestamp, days):
+   t = datetime.datetime.strptime(timestamp[:19], TIME_FORMAT) - datetime.timedelta(days=days)
+   return t.strftime(TIME_FORMAT) + timestamp[19:]
+
+
+def make_data(base, days):
+   data = copy.deepcopy(base)
+   pd = data.get("patientData", data)
+   sgs, markers = [], []
+   for day in range(days - 1, -1, -1):
+      for items, target in ((pd["sgs"], sgs), (pd["markers"], markers)):
+         for item in items:
+            item = copy.deepcopy(item)
+            for name in ("timestamp", "displayTime"):
+               if item.get(name):
+                  item[name] = shift(item[name], day)
+            target.append(item)
+   pd["sgs"], pd["markers"] = sgs, markers
+   return data
+
+
+###########################################################
+# Previous per-item loop and stdlib statistics
+###########################################################
+def old_view(snapshot, low, high):
+   glucose_history = []
+   for t, value in zip(snapshot.sgs.times, snapshot.sgs.values):
+      if value > 0:
+         glucose_history.append({
+            "time": time.strftime("%H:%M", time.gmtime(t)),
+            "value": value
+            })
+   v = [point["value"] for point in glucose_history]
+   n = len(v)
+   return {
+      "glucose_history": glucose_history,
+      "below":           100.0 * sum(1 for x in v if x < low) / n,
+      "above":           100.0 * sum(1 for x in v if x > high) / n,
+      "mean":            statistics.mean(v),
+      "sd":              statistics.pstdev(v)
+      }
+
+
+def best(function, repeat):
+   times = []
+   for i in range(repeat):
+      t = time.perf_counter()
+      function()
+      times.append(time.perf_counter() - t)
+   return min(times) * 1000
+
+
+###########################################################
+# Main
+###########################################################
+def main():
+   parser = argparse.ArgumentParser(description="Glucose analytics and pump graph data build times")
+   parser.add_argument('--days',   '-d', type=str, default=DEFAULT_DAYS, help='Comma separated days of readings (default: %s)' % DEFAULT_DAYS)
+   parser.add_argument('--points', '-p', type=int, default=DEFAULT_POINTS, help='Points of the downsampled view (default: %d)' % DEFAULT_POINTS)
+   parser.add_argument('--repeat', '-r', type=int, default=DEFAULT_REPEAT, help='Runs per measurement (default: %d)' % DEFAULT_REPEAT)
+   parser.add_argument('--data',   type=str, help='CareLink JSON file with one day of data (default: templates/data_graph.json)')
+   args = parser.parse_args()
+
+   try:
+      days = [int(d) for d in args.days.split(",")]
+   except ValueError:
+      parser.error("invalid --days list")
+
+   with open(args.data or os.path.join(ROOT, "templates", "data_graph.json")) as f:
+      base = json.load(f)
+   web = load_web()
+   numpy = analytics.np
+   modes = [("numpy", numpy)] if numpy is not None else []
+   modes.append(("pure", None))
+   if numpy is None:
+      print("numpy is not installed, only pure Python columns")
+
+   low, high = analytics.LOW_LIMIT, analytics.HIGH_LIMIT
+   print("%-5s %7s %10s %-6s %10s %12s %10s" %
+         ("days", "points", "old loop", "", "full view", "%d-pt view" % args.points, "sg_stats"))
+   for n in days:
+      snapshot = Snapshot.from_data(make_data(base, n))
+      old = best(lambda: old_view(snapshot, low, high), args.repeat)
+      for i, (name, module) in enumerate(modes):
+         analytics.np = module
+         full = best(lambda: web.format_pump_graph_data(snapshot), args.repeat)
+         view = best(lambda: web.format_pump_graph_data(snapshot, args.points), args.repeat)
+         stats = best(lambda: analytics.sg_stats(snapshot.sgs.values, low, high), args.repeat)
+         first = (n, len(snapshot.sgs), "%.2f ms" % old) if i == 0 else ("", "", "")
+         print("%-5s %7s %10s %-6s %7.2f ms %9.2f ms %7.2f ms" % (first + (name, full, view, stats)))
+      analytics.np = numpy
+      sys.stdout.flush()
+
+
+if __name__ == "__main__":
+   main()
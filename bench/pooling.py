@@ -0,0 +1,250 @@
+###############################################################################
+#
+#  Carelink Client 2 connection pooling benchmark
+#
+#  Description:
+#
+#    Compares CareLinkClient polls over its pooled keep-alive session with
+#    polls that open a new connection for every request (as a bare
+#    requests.get/post does), against a local HTTPS stand-in of the
+#    Carelink API (discovery, SSO config, user, display message).
+#
+#    The stand-in runs in a separate process and counts accepted TLS
+#    connections, i.e. handshakes. For each mode the benchmark reports
+#    handshakes, mean and p95 latency and client CPU time per poll, and
+#    the handshakes saved per hour at the given poll interval.
+#
+#    Over the network the saving per poll is larger than measured here:
+#    each handshake also costs round trips. Between real polls minutes
+#    apart the upstream may close idle connections, then a pooled poll
+#    still needs a handshake; --idle waits between polls to check a
+#    server's behaviour.
+#
+#  Usage:
+#
+#    python bench/pooling.py [--polls 200] [--interval 300] [--idle 0]
+#
+#    Needs the openssl command to create a temporary self-signed
+#    certificate, or --cert/--key files for 127.0.0.1.
+#
+#  Changelog:
+#
+#    17/10/2026 - Initial version
+#
+###############################################################################
+
+import os
+import sys
+import ssl
+import json
+import time
+import base64
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import carelink_client2
+import carelink_client2_proxy
+
+
+DEFAULT_POLLS = 200
+
+
+def make_jwt(exp):
+   payload = {"exp": exp, "token_details": {"country": "CL", "preferred_username": "patient"}}
+   encoded = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+   return "header." + encoded + ".signature"
+
+
+###########################################################
+# HTTPS stand-in of the Carelink API
+###########################################################
+class StandInHandler(BaseHTTPRequestHandler):
+
+   protocol_version = "HTTP/1.1"
+   # Headers and body are separate writes, avoid delayed ACK stalls
+   disable_nagle_algorithm = True
+
+   def log_message(self, format, *args):
+      pass
+
+   def send_json(self, obj):
+      body = json.dumps(obj).encode()
+      self.send_response(200)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(body)))
+      if self.close_connection:
+         self.send_header("Connection", "close")
+      self.end_headers()
+      self.wfile.write(body)
+
+   def do_GET(self):
+      base = self.server.baseUrl
+      if self.path == "/discover":
+         self.send_json({"supportedCountries": [{"CL": {"region": "EU"}}],
+                         "CP": [{"region": "EU", "SSOConfiguration": base + "/sso",
+                                 "baseUrlCareLink": base + "/carelink", "baseUrlCumulus": base + "/cumulus"}]})
+      elif self.path == "/sso":
+         self.send_json({"system_endpoints": {"token_endpoint_path": "/token"}})
+      elif self.path == "/carelink/users/me":
+         self.send_json({"role": "PATIENT", "firstName": "First", "lastName": "Last"})
+      else:
+         self.send_error(404)
+
+   def do_POST(self):
+      self.rfile.read(int(self.headers.get("Content-Length", 0)))
+      if self.path == "/cumulus/display/message":
+         self.send_json(self.server.data)
+      else:
+         self.send_error(404)
+
+
+class StandInServer(ThreadingHTTPServer):
+
+   daemon_threads = True
+
+   def get_request(self):
+      # TLS handshake happens on accept
+      request = super().get_request()
+      with self.handshakes.get_lock():
+         self.handshakes.value += 1
+      return request
+
+
+def serve(port, cert, key, handshakes, data):
+   server = StandInServer(("127.0.0.1", port), StandInHandler)
+   context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+   context.load_cert_chain(cert, key)
+   server.socket = context.wrap_socket(server.socket, server_side=True)
+   server.baseUrl = "https://127.0.0.1:%d" % port
+   server.handshakes = handshakes
+   server.data = data
+   server.serve_forever()
+
+
+###########################################################
+# Client without connection reuse: every request closes
+# its connection, like a bare requests.get/post
+###########################################################
+class UnpooledCareLinkClient(carelink_client2.CareLinkClient):
+
+   def _new_session(self, pool_connections, pool_maxsize):
+      session = super()._new_session(pool_connections, pool_maxsize)
+      session.headers["Connection"] = "close"
+      return session
+
+
+def free_port():
+   import socket
+   with socket.socket() as s:
+      s.bind(("127.0.0.1", 0))
+      return s.getsockname()[1]
+
+
+def make_certificate(directory):
+   cert = os.path.join(directory, "cert.pem")
+   key = os.path.join(directory, "key.pem")
+   subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                   "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+                   "-keyout", key, "-out", cert],
+                  check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+   return cert, key
+
+
+###########################################################
+# Run polls with one client class, returns measurements
+###########################################################
+def run_polls(clientClass, tokenFile, polls, idle, handshakes):
+   client = clientClass(tokenFile=tokenFile, cacheFile=None, autoRefresh=False)
+   if not client.init():
+      raise Exception("client init failed")
+   start = handshakes.value
+   latencies = []
+   cpu = time.process_time()
+   for i in range(polls):
+      if idle:
+         time.sleep(idle)
+      t = time.perf_counter()
+      if client.getRecentData() is None:
+         raise Exception("poll failed")
+      latencies.append(time.perf_counter() - t)
+   cpu = time.process_time() - cpu
+   count = handshakes.value - start
+   client.close()
+   latencies.sort()
+   return {
+      "handshakes": count / polls,
+      "mean":       sum(latencies) / polls,
+      "p95":        latencies[int(polls * 0.95) - 1],
+      "cpu":        cpu / polls
+      }
+
+
+###########################################################
+# Main
+###########################################################
+def main():
+   parser = argparse.ArgumentParser(description="Pooled vs unpooled CareLinkClient sessions against a local HTTPS stand-in")
+   parser.add_argument('--polls',    '-n', type=int, default=DEFAULT_POLLS, help='Polls per mode (default: %d)' % DEFAULT_POLLS)
+   parser.add_argument('--interval', '-i', type=int, default=carelink_client2_proxy.UPDATE_INTERVAL,
+                       help='Poll interval in seconds for the per hour figures (default: %d)' % carelink_client2_proxy.UPDATE_INTERVAL)
+   parser.add_argument('--idle',     '-w', type=float, default=0, help='Seconds to wait between polls (default: 0)')
+   parser.add_argument('--data',     '-d', type=str, help='JSON file returned as display message (default: templates/data_graph.json)')
+   parser.add_argument('--cert',     type=str, help='Server certificate for 127.0.0.1 (default: temporary)')
+   parser.add_argument('--key',      type=str, help='Server certificate key')
+   args = parser.parse_args()
+   logging.getLogger().setLevel(logging.WARNING)
+
+   root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+   with open(args.data or os.path.join(root, "templates", "data_graph.json")) as f:
+      data = json.load(f)
+
+   tmpdir = tempfile.mkdtemp()
+   server = None
+   try:
+      if args.cert:
+         cert, key = args.cert, args.key or args.cert
+      else:
+         cert, key = make_certificate(tmpdir)
+      tokenFile = os.path.join(tmpdir, "logindata.json")
+      with open(tokenFile, "w") as f:
+         json.dump({"access_token": make_jwt(time.time() + 24 * 3600), "refresh_token": "refresh",
+                    "scope": "profile openid", "client_id": "client", "client_secret": "secret",
+                    "mag-identifier": "mag"}, f)
+
+      port = free_port()
+      baseUrl = "https://127.0.0.1:%d" % port
+      handshakes = multiprocessing.Value("l", 0)
+      server = multiprocessing.Process(target=serve, args=(port, cert, key, handshakes, data), daemon=True)
+      server.start()
+      time.sleep(0.5)
+
+      # Client against the stand-in, trusting its certificate
+      carelink_client2.CARELINK_CONFIG_URL = baseUrl + "/discover"
+      carelink_client2.CareLinkClientBase._sso_token_url = lambda self, sso_config: baseUrl + "/sso/token"
+      os.environ["REQUESTS_CA_BUNDLE"] = cert
+
+      results = {}
+      for name, clientClass in (("unpooled", UnpooledCareLinkClient), ("pooled", carelink_client2.CareLinkClient)):
+         results[name] = r = run_polls(clientClass, tokenFile, args.polls, args.idle, handshakes)
+         print("%-9s %6.2f handshakes/poll  mean %6.2f ms  p95 %6.2f ms  cpu %6.2f ms/poll" %
+               (name, r["handshakes"], r["mean"] * 1000, r["p95"] * 1000, r["cpu"] * 1000))
+
+      perHour = 3600.0 / args.interval
+      saved = results["unpooled"]["handshakes"] - results["pooled"]["handshakes"]
+      print("at one poll every %ds: %.0f handshakes saved per hour, %.1f ms client CPU saved per hour" %
+            (args.interval, saved * perHour,
+             (results["unpooled"]["cpu"] - results["pooled"]["cpu"]) * perHour * 1000))
+   finally:
+      if server is not None:
+         server.terminate()
+      shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+   main()
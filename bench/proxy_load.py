@@ -0,0 +1,171 @@
+###############################################################################
+#
+#  Carelink Client 2 proxy load benchmark
+#
+#  Description:
+#
+#    Load client for the proxy API, compares the default threaded server
+#    with the asyncio keep-alive server (carelink_client2_proxy.py --async)
+#    at several numbers of concurrent clients.
+#
+#    Each client sends GET requests in a loop for the given duration,
+#    reusing its connection while the server keeps it open (HTTP/1.1
+#    keep-alive) and reconnecting otherwise (HTTP/1.0 server). Reports
+#    requests per second, errors, connections opened and latency
+#    percentiles. Uses only the standard library (asyncio streams), so
+#    the client itself is not the bottleneck at 500 connections.
+#
+#  Usage:
+#
+#    Start the proxy in one mode, run the benchmark, repeat with the
+#    other mode (the proxy serves the snapshot saved in
+#    <tokenfile>_snapshot.json until new data is downloaded):
+#
+#      python carelink_client2_proxy.py
+#      python bench/proxy_load.py --label threaded
+#
+#      python carelink_client2_proxy.py --async
+#      python bench/proxy_load.py --label async
+#
+#    Options: --clients 1,50,500 (default), --duration seconds per run,
+#    --gzip to request compressed bodies, URL of the endpoint as last
+#    argument (default http://127.0.0.1:8081/carelink/nohistory).
+#    With 500 clients, raise the open files limit (ulimit -n 4096).
+#
+#  Changelog:
+#
+#    17/10/2026 - Initial version
+#
+###############################################################################
+
+import sys
+import time
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+
+DEFAULT_URL      = "http://127.0.0.1:8081/carelink/nohistory"
+DEFAULT_CLIENTS  = "1,50,500"
+DEFAULT_DURATION = 10
+REQUEST_TIMEOUT  = 10
+ERROR_PAUSE      = 0.05
+
+
+###########################################################
+# Class LoadResult
+###########################################################
+class LoadResult(object):
+
+   def __init__(self):
+      self.requests = 0
+      self.errors = 0
+      self.connections = 0
+      self.bytes = 0
+      self.latencies = []
+
+   def percentile(self, p):
+      if not self.latencies:
+         return 0.0
+      ordered = sorted(self.latencies)
+      return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+
+###########################################################
+# Read one response, returns (body length, keep connection)
+###########################################################
+async def read_response(reader):
+   head = await reader.readuntil(b"\r\n\r\n")
+   lines = head.decode("latin-1").split("\r\n")
+   version, status = lines[0].split(" ")[:2]
+   headers = {}
+   for line in lines[1:]:
+      if ":" in line:
+         name, value = line.split(":", 1)
+         headers[name.strip().lower()] = value.strip()
+   if status[0] not in "23":
+      raise Exception("HTTP status %s" % status)
+
+   keep = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+   if "content-length" in headers:
+      body = await reader.readexactly(int(headers["content-length"]))
+   else:
+      body = await reader.read()
+      keep = False
+   return len(body), keep
+
+
+###########################################################
+# One client: requests in a loop until stop time
+###########################################################
+async def client(host, port, request, stop, result):
+   reader = writer = None
+   while time.time() < stop:
+      t = time.perf_counter()
+      try:
+         if writer is None:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), REQUEST_TIMEOUT)
+            result.connections += 1
+         writer.write(request)
+         size, keep = await asyncio.wait_for(read_response(reader), REQUEST_TIMEOUT)
+      except Exception:
+         result.errors += 1
+         if writer is not None:
+            writer.close()
+         reader = writer = None
+         await asyncio.sleep(ERROR_PAUSE)
+         continue
+      result.latencies.append(time.perf_counter() - t)
+      result.requests += 1
+      result.bytes += size
+      if not keep:
+         writer.close()
+         reader = writer = None
+   if writer is not None:
+      writer.close()
+
+
+async def run(url, clients, duration, gzip):
+   parts = urlsplit(url)
+   path = parts.path or "/"
+   if parts.query:
+      path += "?" + parts.query
+   request = ("GET %s HTTP/1.1\r\nHost: %s\r\n%s\r\n" %
+              (path, parts.netloc, "Accept-Encoding: gzip\r\n" if gzip else "")).encode()
+   result = LoadResult()
+   stop = time.time() + duration
+   await asyncio.gather(*[client(parts.hostname, parts.port or 80, request, stop, result)
+                          for i in range(clients)])
+   return result
+
+
+###########################################################
+# Main
+###########################################################
+def main():
+   parser = argparse.ArgumentParser(description="Load benchmark for the Carelink Client 2 proxy API")
+   parser.add_argument('url', nargs='?', default=DEFAULT_URL, help='Endpoint URL (default: %s)' % DEFAULT_URL)
+   parser.add_argument('--clients',  '-c', type=str, default=DEFAULT_CLIENTS, help='Comma separated concurrent clients per run (default: %s)' % DEFAULT_CLIENTS)
+   parser.add_argument('--duration', '-d', type=float, default=DEFAULT_DURATION, help='Seconds per run (default: %d)' % DEFAULT_DURATION)
+   parser.add_argument('--gzip',     '-z', help='Request gzip compressed bodies', action='store_true')
+   parser.add_argument('--label',    '-l', type=str, default="", help='Label printed in front of each result (e.g. server mode)')
+   args = parser.parse_args()
+
+   try:
+      clients = [int(c) for c in args.clients.split(",")]
+   except ValueError:
+      parser.error("invalid --clients list")
+
+   print("%-10s %7s %10s %7s %7s %9s %9s %9s" %
+         ("label", "clients", "req/s", "errors", "conns", "p50 ms", "p99 ms", "KB/s"))
+   for n in clients:
+      result = asyncio.run(run(args.url, n, args.duration, args.gzip))
+      print("%-10s %7d %10.0f %7d %7d %9.2f %9.2f %9.0f" %
+            (args.label, n, result.requests / args.duration, result.errors, result.connections,
+             result.percentile(50) * 1000, result.percentile(99) * 1000,
+             result.bytes / args.duration / 1024))
+      sys.stdout.flush()
+
+
+if __name__ == "__main__":
+   main()
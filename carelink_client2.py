@@ -17,6 +17,17 @@
 #    11/04/2024 - Check for valid data in API response in _get_data()
 #    19/11/2024 - Update CARELINK_CONFIG_URL
 #    11/02/2025 - Update CARELINK_CONFIG_URL to ver 3.3
+#    17/10/2026 - Use pooled keep-alive HTTP session
+#    17/10/2026 - Cache discovery config and user profile on disk
+#    17/10/2026 - Add AsyncCareLinkClient (asyncio, requires aiohttp)
+#    17/10/2026 - Use per-instance request headers (thread safe)
+#    17/10/2026 - Refresh access token in background ahead of expiry
+#    17/10/2026 - Add TokenStore (atomic writes, cross-process locking)
+#    17/10/2026 - Optional streaming parse of display message
+#    17/10/2026 - Add upstream request and token metrics
+#    17/10/2026 - Limit background token refresh rate
+#    17/10/2026 - Refresh short lived tokens before the validity margin
+#    17/10/2026 - Use TokenStore locking in AsyncCareLinkClient
 #
 #  Copyright 2023-2025, Ondrej Wisniewski
 #
@@ -45,12 +56,20 @@
 # POST /auth/oauth/v2/token
 
 import json
+import asyncio
 import requests
+import carelink_client2_stream
+import carelink_client2_metrics as metrics
+from requests.adapters import HTTPAdapter
 import time
 import base64
 import os
+import random
+import threading
 import logging as log
+from contextlib import contextmanager, asynccontextmanager
 from datetime import datetime, timedelta
+from types import MappingProxyType
 
  
 # Version string
@@ -60,11 +79,39 @@ VERSION = "1.3"
 DEFAULT_FILENAME="data/logindata.json"
 CARELINK_CONFIG_URL = "https://clcloud.minimed.eu/connect/carepartner/v11/discover/android/3.3"
 AUTH_ERROR_CODES = [401,403]
-COMMON_HEADERS = {
+POOL_CONNECTIONS = 4   # number of hosts with a cached connection pool
+POOL_MAXSIZE     = 2   # max kept-alive connections per host
+CACHE_TTL        = 7*24*3600 # max age of cached config and user profile
+CACHE_REVALIDATE = 3600      # revalidate cache in background when older
+ASYNC_POOL_MAXSIZE = 100     # max concurrent connections of async client
+TOKEN_VALID_MARGIN   = 600   # access token used up to this long before expiry
+TOKEN_REFRESH_MARGIN = 900   # refresh access token this long before expiry
+TOKEN_REFRESH_SLACK  = 60    # min background refresh advance over TOKEN_VALID_MARGIN
+TOKEN_REFRESH_JITTER = 120   # random extra advance of background refresh
+TOKEN_REFRESH_FRACTION = 0.25 # max margin + jitter as fraction of token lifetime
+TOKEN_REFRESH_MIN_INTERVAL = 60 # min wait after a refresh (short tokens, clock skew)
+TOKEN_REFRESH_RETRY  = 30    # first retry delay after network error
+COMMON_HEADERS = MappingProxyType({
                   "Accept": "application/json",
                   "Content-Type": "application/json",
                   "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 10; Nexus 5X Build/QQ3A.200805.001)",
-                 }
+                 })
+
+# Metrics
+UPSTREAM_LATENCY = metrics.Histogram("carelink_upstream_request_duration_seconds",
+                                     "Carelink API request latency (until response headers)", ("endpoint",))
+UPSTREAM_RESPONSES = metrics.Counter("carelink_upstream_responses_total",
+                                     "Carelink API responses by status code (error = no response)", ("endpoint", "code"))
+TOKEN_REFRESHES = metrics.Counter("carelink_token_refreshes_total",
+                                  "Access token refreshes", ("result",))
+TOKEN_EXPIRES_IN = metrics.Gauge("carelink_token_expires_in_seconds",
+                                 "Time until the access token in use expires", ("token_file",))
+
+# Advisory file locking (not available on Windows)
+try:
+   import fcntl
+except ImportError:
+   fcntl = None
 
 # Logging config
 FORMAT = "[%(asctime)s:%(levelname)s] %(message)s"
@@ -72,46 +119,66 @@ log.basicConfig(format=FORMAT, datefmt="%Y-%m-%d %H:%M:%S", level=log.INFO)
 
 
 ###########################################################
-# Class CareLinkClient
+# Class TokenStore
+#
+# Token file shared by several processes: writes are atomic
+# (temp file, fsync, rename), refreshes are serialized with
+# an advisory lock and tokens rotated by another process 
+# are detected by the file stamp
 ###########################################################
-class CareLinkClient(object):
-   
-   def __init__(self, tokenFile=DEFAULT_FILENAME):
-      
-      self.__version = VERSION
-      
-      # Authorization
-      self.__tokenFile = tokenFile
-      self.__tokenData = None
-      self.__accessTokenPayload = None
-      
-      # API config
-      self.__config = None
-      
-      # User info
-      self.__username = None
-      self.__user = None
-      self.__patient = None 
-      self.__country = None
-      
-      # API status
-      self.__last_api_status = None
-      
+class TokenStore(object):
+
+   def __init__(self, filename):
+      self.filename = filename
+      self.lockname = filename + ".lock"
+      self.__stamp = None
+
    ###########################################################
-   # Class internal functions
+   # Get file stamp (changes on every rewrite)
    ###########################################################
-   
+   def _get_stamp(self):
+      try:
+         st = os.stat(self.filename)
+      except OSError:
+         return None
+      return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+   ###########################################################
+   # Hold exclusive lock across processes
+   ###########################################################
+   @contextmanager
+   def lock(self):
+      if fcntl is None:
+         yield
+         return
+      with open(self.lockname, "a") as f:
+         fcntl.flock(f, fcntl.LOCK_EX)
+         try:
+            yield
+         finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+   ###########################################################
+   # Check if file was rewritten since last read or write
+   ###########################################################
+   def changed(self):
+      return self._get_stamp() != self.__stamp
+
    ###########################################################
    # Read token file
    ###########################################################
-   def _read_token_file(self, filename):
+   def read(self):
       log.info("_read_token_file()")
       token_data = None
-      if os.path.isfile(filename):
+      if os.path.isfile(self.filename):
+         stamp = self._get_stamp()
          try:
-            token_data = json.loads(open(filename, "r").read())
-         except json.JSONDecodeError:
-            log.error("ERROR: failed parsing token file %s" % filename)
+            with open(self.filename, "r") as f:
+               token_data = json.load(f)
+         except (OSError, json.JSONDecodeError):
+            log.error("ERROR: failed parsing token file %s" % self.filename)
+         else:
+            self.__stamp = stamp
 
          if token_data is not None:
             required_fields = ["access_token", "refresh_token", "scope", "client_id", "client_secret", "mag-identifier"]
@@ -119,25 +186,124 @@ class CareLinkClient(object):
                if f not in token_data:
                   log.error("ERROR: field %s is missing from token file" % f)
       else:
-         log.error("ERROR: token file %s not found" % filename)
+         log.error("ERROR: token file %s not found" % self.filename)
       return token_data
 
    ###########################################################
    # Write token file
    ###########################################################
-   def _write_token_file(self, obj, filename):
+   def write(self, obj):
       log.info("_write_token_file()")
-      with open(filename, 'w') as f:
+      dirname = os.path.dirname(os.path.abspath(self.filename))
+      tmpname = "%s.%d.tmp" % (self.filename, os.getpid())
+      with open(tmpname, "w") as f:
          json.dump(obj, f, indent=4)
+         f.flush()
+         os.fsync(f.fileno())
+      try:
+         os.replace(tmpname, self.filename)
+      except OSError:
+         # Rename not possible (e.g. file is a bind mount), rewrite in place
+         os.remove(tmpname)
+         with open(self.filename, "w") as f:
+            json.dump(obj, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+      else:
+         try:
+            fd = os.open(dirname, os.O_RDONLY)
+            try:
+               os.fsync(fd)
+            finally:
+               os.close(fd)
+         except OSError:
+            pass
+      self.__stamp = self._get_stamp()
+
+
+###########################################################
+# Class CareLinkClientBase
+#
+# Token, cache and request helpers shared by the sync and
+# async clients (no network access)
+###########################################################
+class CareLinkClientBase(object):
 
    ###########################################################
-   # Get Carelink API config
+   # Read token file
    ###########################################################
-   def _get_config(self, discovery_url, country):
-      log.info("_get_config()")
-      resp = requests.get(discovery_url)
-      log.debug("   status: %d" % resp.status_code)
-      data = resp.json()
+   def _read_token_file(self, filename):
+      return TokenStore(filename).read()
+
+   ###########################################################
+   # Write token file
+   ###########################################################
+   def _write_token_file(self, obj, filename):
+      TokenStore(filename).write(obj)
+
+   ###########################################################
+   # Read config and user profile cache file
+   ###########################################################
+   def _read_cache_file(self, filename, username, country):
+      log.info("_read_cache_file()")
+      if filename is None or not os.path.isfile(filename):
+         return None
+      try:
+         with open(filename, "r") as f:
+            cache = json.load(f)
+         age = time.time() - cache["timestamp"]
+         if cache["username"] != username or cache["country"] != country:
+            log.info("   cache belongs to different user")
+            return None
+         if age < 0 or age > CACHE_TTL:
+            log.info("   cache has expired")
+            return None
+         cache["config"]["token_url"]
+         cache["user"]["role"]
+      except (OSError, ValueError, KeyError, TypeError):
+         log.error("ERROR: failed parsing cache file %s" % filename)
+         return None
+      log.info("   using cached config (age %ds)" % age)
+      return cache
+
+   ###########################################################
+   # Write config and user profile cache file
+   ###########################################################
+   def _write_cache_file(self, filename, username, country, config, user, patient):
+      log.info("_write_cache_file()")
+      if filename is None:
+         return
+      cache = {
+         "timestamp": time.time(),
+         "username":  username,
+         "country":   country,
+         "config":    config,
+         "user":      user,
+         "patient":   patient
+         }
+      tmpname = filename + ".tmp"
+      try:
+         with open(tmpname, "w") as f:
+            json.dump(cache, f, indent=4)
+         os.replace(tmpname, filename)
+      except OSError as e:
+         log.error("ERROR: failed writing cache file %s (%s)" % (filename, e))
+
+   ###########################################################
+   # Delete cache file
+   ###########################################################
+   def _invalidate_cache_file(self, filename):
+      if filename is not None and os.path.isfile(filename):
+         log.info("_invalidate_cache_file()")
+         try:
+            os.remove(filename)
+         except OSError:
+            pass
+
+   ###########################################################
+   # Find region config in discovery document
+   ###########################################################
+   def _find_region_config(self, data, country):
       region = None
       config = None
 
@@ -157,64 +323,30 @@ class CareLinkClient(object):
             break
       if config is None:
          raise Exception("ERROR: failed to get config base urls for region %s" % region)
+      return config
 
-      resp = requests.get(config["SSOConfiguration"])
-      log.debug("   status: %d" % resp.status_code)
-      sso_config = resp.json()
+   ###########################################################
+   # Get token URL from SSO config
+   ###########################################################
+   def _sso_token_url(self, sso_config):
       sso_base_url = "https://%s:%d/%s" % (sso_config["server"]["hostname"],
                                            sso_config["server"]["port"],
                                            sso_config["server"]["prefix"])
-      token_url = sso_base_url + sso_config["system_endpoints"]["token_endpoint_path"]
-      c["token_url"] = token_url
-      return config
-   
-   ###########################################################
-   # Get user data
-   ###########################################################
-   def _get_user(self, config, token_data):
-      log.info("_get_user()")
-      url = config["baseUrlCareLink"] + "/users/me"
-      headers = COMMON_HEADERS
-      headers["mag-identifier"] = token_data["mag-identifier"]
-      headers["Authorization"] = "Bearer " + token_data["access_token"]
-      self.__last_api_status = None
-      resp = requests.get(url=url,headers=headers)
-      self.__last_api_status = resp.status_code
-      log.debug("   status: %d" % resp.status_code)
-      try:
-         user = resp.json()
-      except:
-         user = None
-      return user
+      return sso_base_url + sso_config["system_endpoints"]["token_endpoint_path"]
 
    ###########################################################
-   # Get patient data
+   # Build API request headers
    ###########################################################
-   def _get_patient(self, config, token_data):
-      log.info("_get_patient()")
-      url = config["baseUrlCareLink"] + "/links/patients"
-      headers = COMMON_HEADERS
+   def _api_headers(self, token_data):
+      headers = dict(COMMON_HEADERS)
       headers["mag-identifier"] = token_data["mag-identifier"]
       headers["Authorization"] = "Bearer " + token_data["access_token"]
-      self.__last_api_status = None
-      resp = requests.get(url=url,headers=headers)
-      self.__last_api_status = resp.status_code
-      log.debug("   status: %d" % resp.status_code)
-      try:
-         patient = resp.json()[0]
-      except:
-         patient = None
-      return patient
+      return headers
 
    ###########################################################
-   # Get periodic pump and sensor data
+   # Build display message request body
    ###########################################################
-   def _get_data(self, config, token_data, username, role, patientid):
-      log.info("_get_data()")
-      url = config["baseUrlCumulus"] + "/display/message"
-      headers = COMMON_HEADERS
-      headers["mag-identifier"] = token_data["mag-identifier"]
-      headers["Authorization"] = "Bearer " + token_data["access_token"]
+   def _data_request(self, username, role, patientid):
       data = {}
       data["username"] = username
       if role in ["CARE_PARTNER","CARE_PARTNER_OUS"]:
@@ -222,43 +354,19 @@ class CareLinkClient(object):
          data["patientId"] = patientid
       else:
          data["role"] = "patient"         
-      #log.debug("url: %s" % url)
-      #log.debug("headers: %s" % json.dumps(headers))
-      #log.debug("data: %s" % json.dumps(data))
-      
-      self.__last_api_status = None
-      resp = requests.post(url=url,headers=headers,data=json.dumps(data))
-      self.__last_api_status = resp.status_code
-      log.debug("   status: %d" % resp.status_code)
-      try:
-         my_data = resp.json()
-      except:
-         my_data = None
-      return my_data
+      return data
 
    ###########################################################
-   # Do token data refresh
+   # Build token refresh request body
    ###########################################################
-   def _do_refresh(self, config, token_data):
-      log.info("_do_refresh()")
-      token_url = config["token_url"]
+   def _refresh_request(self, token_data):
       data = {
          "refresh_token": token_data["refresh_token"],
          "client_id":     token_data["client_id"],
          "client_secret": token_data["client_secret"],
          "grant_type":    "refresh_token"
          }
-      headers = {
-         "mag-identifier": token_data["mag-identifier"]
-         }
-      resp = requests.post(url=token_url, headers=headers, data=data)
-      log.debug("   status: %d" % resp.status_code)
-      if resp.status_code != 200:
-         raise Exception("ERROR: failed to refresh token")
-      new_data = resp.json()
-      token_data["access_token"] = new_data["access_token"]
-      token_data["refresh_token"] = new_data["refresh_token"]
-      return token_data
+      return data
 
    ###########################################################
    # Get access token payload 
@@ -286,6 +394,17 @@ class CareLinkClient(object):
          return None
       return payload_json
 
+   ###########################################################
+   # Export expiry of the access token in use (call only
+   # when a token is adopted, not for candidates)
+   ###########################################################
+   def _export_token_expiry(self, token_file, access_token_payload):
+      try:
+         token_validto = float(access_token_payload["exp"])
+      except (KeyError, TypeError, ValueError):
+         return
+      TOKEN_EXPIRES_IN.labels(token_file).set_function(lambda: token_validto - time.time())
+
    ###########################################################
    # Check access token validity
    ###########################################################
@@ -303,7 +422,7 @@ class CareLinkClient(object):
       if tdiff < 0:
          log.info("   access token has expired %ds ago" % abs(tdiff))
          return False
-      if tdiff < 600:
+      if tdiff < TOKEN_VALID_MARGIN:
          log.info("   access token is about to expire in %ds" % abs(tdiff))
          return False
       
@@ -312,30 +431,344 @@ class CareLinkClient(object):
       log.info("   access token expires in %ds (%s)" % (tdiff,auth_token_validto))
       return True
 
+
+###########################################################
+# Class CareLinkClient
+###########################################################
+class CareLinkClient(CareLinkClientBase):
+   
+   def __init__(self, tokenFile=DEFAULT_FILENAME, poolConnections=POOL_CONNECTIONS, poolMaxsize=POOL_MAXSIZE, cacheFile="", autoRefresh=True, streamRoutes=None):
+      
+      self.__version = VERSION
+      
+      # HTTP session (keeps TCP/TLS connections alive between polls)
+      self.__session = self._new_session(poolConnections, poolMaxsize)
+      
+      # Authorization
+      self.__tokenFile = tokenFile
+      self.__tokenStore = TokenStore(tokenFile)
+      self.__tokenData = None
+      self.__accessTokenPayload = None
+      self.__refreshLock = threading.Lock()
+      
+      # Background token refresh
+      self.__autoRefresh = autoRefresh
+      self.__refreshThread = None
+      self.__stopEvent = threading.Event()
+      
+      # Routing of large display message arrays to compact sinks 
+      # (None = parse complete response with json)
+      self.__streamRoutes = streamRoutes
+      
+      # API config
+      self.__config = None
+      
+      # Config and user profile cache ("" = next to token file, None = disabled)
+      if cacheFile == "":
+         cacheFile = os.path.splitext(tokenFile)[0] + "_cache.json"
+      self.__cacheFile = cacheFile
+      
+      # User info
+      self.__username = None
+      self.__user = None
+      self.__patient = None 
+      self.__country = None
+      
+      # API status
+      self.__last_api_status = None
+      
+   ###########################################################
+   # Class internal functions
+   ###########################################################
+   
+   ###########################################################
+   # Create pooled HTTP session
+   ###########################################################
+   def _new_session(self, pool_connections, pool_maxsize):
+      session = requests.Session()
+      adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+      session.mount("https://", adapter)
+      session.mount("http://", adapter)
+      return session
+
+   ###########################################################
+   # Send request, record latency and status code
+   ###########################################################
+   def _send(self, endpoint, method, url, **kwargs):
+      t = time.perf_counter()
+      try:
+         resp = self.__session.request(method, url, **kwargs)
+      except requests.RequestException:
+         UPSTREAM_RESPONSES.labels(endpoint, "error").inc()
+         raise
+      finally:
+         UPSTREAM_LATENCY.labels(endpoint).observe(time.perf_counter() - t)
+      UPSTREAM_RESPONSES.labels(endpoint, resp.status_code).inc()
+      return resp
+
+   ###########################################################
+   # Revalidate cached config and user profile (background)
+   ###########################################################
+   def _revalidate_cache(self):
+      log.info("_revalidate_cache()")
+      try:
+         config = self._get_config(CARELINK_CONFIG_URL, self.__country)
+         user = self._get_user(config, self.__tokenData, record_status=False)
+         patient = None
+         if user["role"] in ["CARE_PARTNER","CARE_PARTNER_OUS"]:
+            patient = self._get_patient(config, self.__tokenData, record_status=False)
+            if patient is None:
+               raise Exception("ERROR: failed to get patient")
+      except Exception as e:
+         log.error("ERROR: cache revalidation failed (%s)" % e)
+         return
+      self.__config = config
+      self.__user = user
+      self.__patient = patient
+      self._write_cache_file(self.__cacheFile, self.__username, self.__country, config, user, patient)
+
+   ###########################################################
+   # Get Carelink API config
+   ###########################################################
+   def _get_config(self, discovery_url, country):
+      log.info("_get_config()")
+      resp = self._send("discovery", "GET", discovery_url)
+      log.debug("   status: %d" % resp.status_code)
+      data = resp.json()
+      config = self._find_region_config(data, country)
+
+      resp = self._send("sso_config", "GET", config["SSOConfiguration"])
+      log.debug("   status: %d" % resp.status_code)
+      config["token_url"] = self._sso_token_url(resp.json())
+      return config
+   
+   ###########################################################
+   # Get user data
+   ###########################################################
+   def _get_user(self, config, token_data, record_status=True):
+      log.info("_get_user()")
+      url = config["baseUrlCareLink"] + "/users/me"
+      headers = self._api_headers(token_data)
+      if record_status:
+         self.__last_api_status = None
+      resp = self._send("user", "GET", url, headers=headers)
+      if record_status:
+         self.__last_api_status = resp.status_code
+      log.debug("   status: %d" % resp.status_code)
+      try:
+         user = resp.json()
+      except:
+         user = None
+      return user
+
+   ###########################################################
+   # Get patient data
+   ###########################################################
+   def _get_patient(self, config, token_data, record_status=True):
+      log.info("_get_patient()")
+      url = config["baseUrlCareLink"] + "/links/patients"
+      headers = self._api_headers(token_data)
+      if record_status:
+         self.__last_api_status = None
+      resp = self._send("patient", "GET", url, headers=headers)
+      if record_status:
+         self.__last_api_status = resp.status_code
+      log.debug("   status: %d" % resp.status_code)
+      try:
+         patient = resp.json()[0]
+      except:
+         patient = None
+      return patient
+
+   ###########################################################
+   # Get periodic pump and sensor data
+   ###########################################################
+   def _get_data(self, config, token_data, username, role, patientid):
+      log.info("_get_data()")
+      url = config["baseUrlCumulus"] + "/display/message"
+      headers = self._api_headers(token_data)
+      data = self._data_request(username, role, patientid)
+      #log.debug("url: %s" % url)
+      #log.debug("headers: %s" % json.dumps(headers))
+      #log.debug("data: %s" % json.dumps(data))
+      
+      self.__last_api_status = None
+      if self.__streamRoutes is not None:
+         # Decode response incrementally while it is downloaded
+         resp = self._send("data", "POST", url, headers=headers, data=json.dumps(data), stream=True)
+         self.__last_api_status = resp.status_code
+         log.debug("   status: %d" % resp.status_code)
+         try:
+            my_data = carelink_client2_stream.parse_stream(resp.iter_content(carelink_client2_stream.CHUNK_SIZE),
+                                                          self.__streamRoutes)
+         except Exception:
+            my_data = None
+         finally:
+            resp.close()
+         return my_data
+      
+      resp = self._send("data", "POST", url, headers=headers, data=json.dumps(data))
+      self.__last_api_status = resp.status_code
+      log.debug("   status: %d" % resp.status_code)
+      try:
+         my_data = resp.json()
+      except:
+         my_data = None
+      return my_data
+
+   ###########################################################
+   # Do token data refresh
+   ###########################################################
+   def _do_refresh(self, config, token_data):
+      log.info("_do_refresh()")
+      token_url = config["token_url"]
+      data = self._refresh_request(token_data)
+      headers = {
+         "mag-identifier": token_data["mag-identifier"]
+         }
+      resp = self._send("refresh", "POST", token_url, headers=headers, data=data)
+      log.debug("   status: %d" % resp.status_code)
+      if resp.status_code != 200:
+         TOKEN_REFRESHES.labels("failed").inc()
+         raise Exception("ERROR: failed to refresh token")
+      TOKEN_REFRESHES.labels("ok").inc()
+      new_data = resp.json()
+      token_data = dict(token_data)
+      token_data["access_token"] = new_data["access_token"]
+      token_data["refresh_token"] = new_data["refresh_token"]
+      return token_data
+
+   ###########################################################
+   # Refresh token once for all concurrent callers
+   ###########################################################
+   def _refresh_token(self, used_token_data):
+      with self.__refreshLock:
+         # Token already refreshed by another thread
+         if self.__tokenData is not used_token_data:
+            return
+         with self.__tokenStore.lock():
+            # Token already refreshed by another process
+            if self._reload_token_file(check_validity=True):
+               return
+            self.__tokenData = self._do_refresh(self.__config, self.__tokenData)
+            self.__accessTokenPayload = self._get_access_token_payload(self.__tokenData)
+            self._export_token_expiry(self.__tokenFile, self.__accessTokenPayload)
+            self.__tokenStore.write(self.__tokenData)
+
+   ###########################################################
+   # Pick up token rotated by another process
+   ###########################################################
+   def _reload_token_file(self, check_validity=False):
+      if not self.__tokenStore.changed():
+         return False
+      token_data = self.__tokenStore.read()
+      if token_data is None or self.__tokenData is None or \
+         token_data.get("refresh_token") == self.__tokenData["refresh_token"]:
+         return False
+      payload = self._get_access_token_payload(token_data)
+      if payload is None:
+         return False
+      log.info("   using token rotated by another process")
+      # Adopt the newer refresh token in any case, the old one is no longer valid
+      self.__tokenData = token_data
+      self.__accessTokenPayload = payload
+      self._export_token_expiry(self.__tokenFile, payload)
+      if check_validity:
+         return self._is_token_valid(payload)
+      return True
+
+   ###########################################################
+   # Background token refresh thread
+   ###########################################################
+   def _token_refresher(self):
+      retry = TOKEN_REFRESH_RETRY
+      lastRefresh = None
+      seenToken = None
+      while True:
+         try:
+            # Wait until shortly before the access token expires
+            token_data = self.__tokenData
+            if token_data is not seenToken:
+               seenToken = token_data
+               adoptedAt = time.time()
+            payload = self.__accessTokenPayload or {}
+            try:
+               token_validto = float(payload["exp"])
+            except (KeyError, TypeError, ValueError):
+               token_validto = time.time()
+            try:
+               lifetime = token_validto - float(payload["iat"])
+            except (KeyError, TypeError, ValueError):
+               lifetime = token_validto - adoptedAt
+            # Short lived tokens: refresh at a fraction of their lifetime,
+            # but still before requests treat the token as expired
+            limit = max(lifetime, 0) * TOKEN_REFRESH_FRACTION
+            margin = max(min(TOKEN_REFRESH_MARGIN, limit),
+                         min(TOKEN_VALID_MARGIN + TOKEN_REFRESH_SLACK, max(lifetime, 0)))
+            jitter = random.uniform(0, min(TOKEN_REFRESH_JITTER, limit / 4))
+            delay = token_validto - margin - jitter - time.time()
+            if lastRefresh is not None:
+               # Never refresh in a tight loop (clock running fast)
+               delay = max(delay, lastRefresh + TOKEN_REFRESH_MIN_INTERVAL - time.time())
+            log.debug("next token refresh in %ds" % max(delay, 0))
+            if self.__stopEvent.wait(max(delay, 0)):
+               return
+
+            self._refresh_token(token_data)
+            lastRefresh = time.time()
+            retry = TOKEN_REFRESH_RETRY
+         except requests.RequestException as e:
+            # Network error: try again later
+            log.error("ERROR: background token refresh failed (%s), retry in %ds" % (e, retry))
+            if self.__stopEvent.wait(retry):
+               return
+            retry = min(retry * 2, TOKEN_REFRESH_MARGIN / 4)
+         except Exception as e:
+            # Refresh token rejected: retrying with the same one cannot
+            # succeed until a new token is saved, keep checking slowly
+            log.error("ERROR: background token refresh failed (%s), retry in %ds" % (e, retry))
+            if self.__stopEvent.wait(retry):
+               return
+            retry = min(retry * 2, TOKEN_REFRESH_MARGIN)
+
    ###########################################################
    # Init static data
    ###########################################################
    def _init(self):
-      self.__tokenData = self._read_token_file(self.__tokenFile)
+      self.__tokenData = self.__tokenStore.read()
       if self.__tokenData is None:
          return False
       self.__accessTokenPayload = self._get_access_token_payload(self.__tokenData)
       if self.__accessTokenPayload is None:
          return False
+      self._export_token_expiry(self.__tokenFile, self.__accessTokenPayload)
       try:
          self.__country = self.__accessTokenPayload["token_details"]["country"]
-         self.__config = self._get_config(CARELINK_CONFIG_URL, self.__country)
          self.__username = self.__accessTokenPayload["token_details"]["preferred_username"]
+         
+         # Use cached config and user profile if available
+         cache = self._read_cache_file(self.__cacheFile, self.__username, self.__country)
+         if cache is not None:
+            self.__config = cache["config"]
+            self.__user = cache["user"]
+            self.__patient = cache["patient"]
+            if time.time() - cache["timestamp"] > CACHE_REVALIDATE:
+               t = threading.Thread(target=self._revalidate_cache, args=())
+               t.daemon = True
+               t.start()
+            return True
+         
+         self.__config = self._get_config(CARELINK_CONFIG_URL, self.__country)
          self.__user = self._get_user(self.__config, self.__tokenData)
          if self.__user["role"] in ["CARE_PARTNER","CARE_PARTNER_OUS"]:
             self.__patient = self._get_patient(self.__config, self.__tokenData)
+         self._write_cache_file(self.__cacheFile, self.__username, self.__country,
+                                self.__config, self.__user, self.__patient)
       except Exception as e:
          log.error(e)
          if self.__last_api_status in AUTH_ERROR_CODES:
             try:
-               self.__tokenData = self._do_refresh(self.__config, self.__tokenData)
-               self.__accessTokenPayload = self._get_access_token_payload(self.__tokenData)
-               self._write_token_file(self.__tokenData, self.__tokenFile)
+               self._refresh_token(self.__tokenData)
             except Exception as e:
                log.error(e)
          return False
@@ -357,6 +790,12 @@ class CareLinkClient(object):
             # Failed permanently
             log.error("ERROR: unable to initialize")
             return False
+      
+      # Start background token refresh
+      if self.__autoRefresh and self.__refreshThread is None:
+         self.__refreshThread = threading.Thread(target=self._token_refresher, args=())
+         self.__refreshThread.daemon = True
+         self.__refreshThread.start()
       return True
       
    ###########################################################
@@ -374,11 +813,17 @@ class CareLinkClient(object):
    # Get recent periodic pump data
    ###########################################################
    def getRecentData(self):
-      # Check if access token is valid
+      # Pick up token rotated by another process (no refresh needed)
+      if self.__refreshLock.acquire(blocking=False):
+         try:
+            self._reload_token_file()
+         finally:
+            self.__refreshLock.release()
+      
+      # Check if access token is valid (normally kept valid by the 
+      # background refresh, refresh here only as fallback)
       if not self._is_token_valid(self.__accessTokenPayload):
-         self.__tokenData = self._do_refresh(self.__config, self.__tokenData)
-         self.__accessTokenPayload = self._get_access_token_payload(self.__tokenData)
-         self._write_token_file(self.__tokenData, self.__tokenFile)
+         self._refresh_token(self.__tokenData)
          if not self._is_token_valid(self.__accessTokenPayload):
             log.error("ERROR: unable to get valid access token")
             return None
@@ -389,17 +834,16 @@ class CareLinkClient(object):
          patientId = None
       
       # Get data: first try
+      token_data = self.__tokenData
       data = self._get_data(self.__config, 
-                            self.__tokenData, 
+                            token_data, 
                             self.__username,
                             self.__user["role"],
                             patientId)
       # Check API response
       if self.__last_api_status in AUTH_ERROR_CODES:
          # Try to refresh token
-         self.__tokenData = self._do_refresh(self.__config, self.__tokenData)
-         self.__accessTokenPayload = self._get_access_token_payload(self.__tokenData)
-         self._write_token_file(self.__tokenData, self.__tokenFile)
+         self._refresh_token(token_data)
          
          # Get data: second try 
          data = self._get_data(self.__config, 
@@ -409,8 +853,376 @@ class CareLinkClient(object):
                                patientId)
          # Check API response
          if self.__last_api_status in AUTH_ERROR_CODES:
+            # Failed permanently, rediscover config and user profile on next init
+            log.error("ERROR: unable to get data")
+            self._invalidate_cache_file(self.__cacheFile)
+            return None
+      return data
+
+   ###########################################################
+   # Get last API response code
+   ###########################################################
+   def getLastResponseCode(self):
+      return self.__last_api_status
+   
+   ###########################################################
+   # Get Client library version
+   ###########################################################
+   def getClientVersion(self):
+      return self.__version
+
+   ###########################################################
+   # Close pooled HTTP connections
+   ###########################################################
+   def close(self):
+      self.__stopEvent.set()
+      self.__session.close()
+
+
+###########################################################
+# Class AsyncCareLinkClient
+#
+# Same workflow as CareLinkClient, implemented as coroutines
+# so that a single event loop can run many concurrent
+# requests. Needs the aiohttp package.
+###########################################################
+class AsyncCareLinkClient(CareLinkClientBase):
+   
+   def __init__(self, tokenFile=DEFAULT_FILENAME, poolMaxsize=ASYNC_POOL_MAXSIZE, cacheFile=""):
+      
+      self.__version = VERSION
+      
+      # HTTP session (created in the running event loop)
+      self.__session = None
+      self.__poolMaxsize = poolMaxsize
+      
+      # Authorization
+      self.__tokenFile = tokenFile
+      self.__tokenStore = TokenStore(tokenFile)
+      self.__tokenData = None
+      self.__accessTokenPayload = None
+      self.__refreshLock = None
+      
+      # API config
+      self.__config = None
+      
+      # Config and user profile cache ("" = next to token file, None = disabled)
+      if cacheFile == "":
+         cacheFile = os.path.splitext(tokenFile)[0] + "_cache.json"
+      self.__cacheFile = cacheFile
+      self.__revalidateTask = None
+      
+      # User info
+      self.__username = None
+      self.__user = None
+      self.__patient = None 
+      self.__country = None
+      
+      # API status
+      self.__last_api_status = None
+      
+   ###########################################################
+   # Class internal functions
+   ###########################################################
+   
+   ###########################################################
+   # Get pooled HTTP session
+   ###########################################################
+   def _get_session(self):
+      if self.__session is None:
+         import aiohttp
+         connector = aiohttp.TCPConnector(limit=self.__poolMaxsize)
+         self.__session = aiohttp.ClientSession(connector=connector)
+         self.__refreshLock = asyncio.Lock()
+      return self.__session
+
+   ###########################################################
+   # Send request, return status code and decoded json body
+   ###########################################################
+   async def _request(self, endpoint, method, url, record_status=True, **kwargs):
+      if record_status:
+         self.__last_api_status = None
+      t = time.perf_counter()
+      try:
+         async with self._get_session().request(method, url, **kwargs) as resp:
+            UPSTREAM_LATENCY.labels(endpoint).observe(time.perf_counter() - t)
+            body = await resp.read()
+      except Exception:
+         UPSTREAM_RESPONSES.labels(endpoint, "error").inc()
+         raise
+      UPSTREAM_RESPONSES.labels(endpoint, resp.status).inc()
+      if record_status:
+         self.__last_api_status = resp.status
+      log.debug("   status: %d" % resp.status)
+      try:
+         return resp.status, json.loads(body)
+      except ValueError:
+         return resp.status, None
+
+   ###########################################################
+   # Revalidate cached config and user profile (background)
+   ###########################################################
+   async def _revalidate_cache(self):
+      log.info("_revalidate_cache()")
+      try:
+         config = await self._get_config(CARELINK_CONFIG_URL, self.__country)
+         user = await self._get_user(config, self.__tokenData, record_status=False)
+         patient = None
+         if user["role"] in ["CARE_PARTNER","CARE_PARTNER_OUS"]:
+            patient = await self._get_patient(config, self.__tokenData, record_status=False)
+            if patient is None:
+               raise Exception("ERROR: failed to get patient")
+      except Exception as e:
+         log.error("ERROR: cache revalidation failed (%s)" % e)
+         return
+      self.__config = config
+      self.__user = user
+      self.__patient = patient
+      self._write_cache_file(self.__cacheFile, self.__username, self.__country, config, user, patient)
+
+   ###########################################################
+   # Get Carelink API config
+   ###########################################################
+   async def _get_config(self, discovery_url, country):
+      log.info("_get_config()")
+      status, data = await self._request("discovery", "GET", discovery_url, record_status=False)
+      config = self._find_region_config(data, country)
+      status, sso_config = await self._request("sso_config", "GET", config["SSOConfiguration"], record_status=False)
+      config["token_url"] = self._sso_token_url(sso_config)
+      return config
+
+   ###########################################################
+   # Get user data
+   ###########################################################
+   async def _get_user(self, config, token_data, record_status=True):
+      log.info("_get_user()")
+      url = config["baseUrlCareLink"] + "/users/me"
+      status, user = await self._request("user", "GET", url, record_status,
+                                         headers=self._api_headers(token_data))
+      return user
+
+   ###########################################################
+   # Get patient data
+   ###########################################################
+   async def _get_patient(self, config, token_data, record_status=True):
+      log.info("_get_patient()")
+      url = config["baseUrlCareLink"] + "/links/patients"
+      status, patients = await self._request("patient", "GET", url, record_status,
+                                             headers=self._api_headers(token_data))
+      try:
+         patient = patients[0]
+      except (IndexError, KeyError, TypeError):
+         patient = None
+      return patient
+
+   ###########################################################
+   # Get periodic pump and sensor data
+   ###########################################################
+   async def _get_data(self, config, token_data, username, role, patientid):
+      log.info("_get_data()")
+      url = config["baseUrlCumulus"] + "/display/message"
+      data = self._data_request(username, role, patientid)
+      status, my_data = await self._request("data", "POST", url,
+                                            headers=self._api_headers(token_data),
+                                            data=json.dumps(data))
+      return my_data
+
+   ###########################################################
+   # Do token data refresh
+   ###########################################################
+   async def _do_refresh(self, config, token_data):
+      log.info("_do_refresh()")
+      headers = {
+         "mag-identifier": token_data["mag-identifier"]
+         }
+      status, new_data = await self._request("refresh", "POST", config["token_url"], record_status=False,
+                                             headers=headers,
+                                             data=self._refresh_request(token_data))
+      if status != 200 or new_data is None:
+         TOKEN_REFRESHES.labels("failed").inc()
+         raise Exception("ERROR: failed to refresh token")
+      TOKEN_REFRESHES.labels("ok").inc()
+      token_data = dict(token_data)
+      token_data["access_token"] = new_data["access_token"]
+      token_data["refresh_token"] = new_data["refresh_token"]
+      return token_data
+
+   ###########################################################
+   # Run blocking file work outside the event loop
+   ###########################################################
+   async def _run_blocking(self, func, *args):
+      return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+   ###########################################################
+   # Hold token file lock across processes (acquired and
+   # released in executor threads, flock may block)
+   ###########################################################
+   @asynccontextmanager
+   async def _token_file_lock(self):
+      lock = self.__tokenStore.lock()
+      acquire = asyncio.ensure_future(self._run_blocking(lock.__enter__))
+      try:
+         await asyncio.shield(acquire)
+      except asyncio.CancelledError:
+         # Release the lock once the executor thread got it
+         acquire.add_done_callback(
+            lambda f: f.cancelled() or f.exception() is not None or
+                      asyncio.ensure_future(self._run_blocking(lock.__exit__, None, None, None)))
+         raise
+      try:
+         yield
+      finally:
+         await self._run_blocking(lock.__exit__, None, None, None)
+
+   ###########################################################
+   # Refresh token once for all concurrent callers
+   ###########################################################
+   async def _refresh_token(self, used_token_data):
+      async with self.__refreshLock:
+         # Token already refreshed by another coroutine
+         if self.__tokenData is not used_token_data:
+            return
+         async with self._token_file_lock():
+            # Token already refreshed by another process
+            if await self._reload_token_file(check_validity=True):
+               return
+            self.__tokenData = await self._do_refresh(self.__config, self.__tokenData)
+            self.__accessTokenPayload = self._get_access_token_payload(self.__tokenData)
+            self._export_token_expiry(self.__tokenFile, self.__accessTokenPayload)
+            await self._run_blocking(self.__tokenStore.write, self.__tokenData)
+
+   ###########################################################
+   # Read token file if rewritten since last read or write
+   ###########################################################
+   def _read_changed_token_file(self):
+      if not self.__tokenStore.changed():
+         return None
+      return self.__tokenStore.read()
+
+   ###########################################################
+   # Pick up token rotated by another process
+   ###########################################################
+   async def _reload_token_file(self, check_validity=False):
+      token_data = await self._run_blocking(self._read_changed_token_file)
+      if token_data is None or self.__tokenData is None or \
+         token_data.get("refresh_token") == self.__tokenData["refresh_token"]:
+         return False
+      payload = self._get_access_token_payload(token_data)
+      if payload is None:
+         return False
+      log.info("   using token rotated by another process")
+      # Adopt the newer refresh token in any case, the old one is no longer valid
+      self.__tokenData = token_data
+      self.__accessTokenPayload = payload
+      self._export_token_expiry(self.__tokenFile, payload)
+      if check_validity:
+         return self._is_token_valid(payload)
+      return True
+
+   ###########################################################
+   # Init static data
+   ###########################################################
+   async def _init(self):
+      self._get_session()
+      self.__tokenData = await self._run_blocking(self.__tokenStore.read)
+      if self.__tokenData is None:
+         return False
+      self.__accessTokenPayload = self._get_access_token_payload(self.__tokenData)
+      if self.__accessTokenPayload is None:
+         return False
+      self._export_token_expiry(self.__tokenFile, self.__accessTokenPayload)
+      try:
+         self.__country = self.__accessTokenPayload["token_details"]["country"]
+         self.__username = self.__accessTokenPayload["token_details"]["preferred_username"]
+         
+         # Use cached config and user profile if available
+         cache = self._read_cache_file(self.__cacheFile, self.__username, self.__country)
+         if cache is not None:
+            self.__config = cache["config"]
+            self.__user = cache["user"]
+            self.__patient = cache["patient"]
+            if time.time() - cache["timestamp"] > CACHE_REVALIDATE:
+               self.__revalidateTask = asyncio.ensure_future(self._revalidate_cache())
+            return True
+         
+         self.__config = await self._get_config(CARELINK_CONFIG_URL, self.__country)
+         self.__user = await self._get_user(self.__config, self.__tokenData)
+         if self.__user["role"] in ["CARE_PARTNER","CARE_PARTNER_OUS"]:
+            self.__patient = await self._get_patient(self.__config, self.__tokenData)
+         self._write_cache_file(self.__cacheFile, self.__username, self.__country,
+                                self.__config, self.__user, self.__patient)
+      except Exception as e:
+         log.error(e)
+         if self.__last_api_status in AUTH_ERROR_CODES:
+            try:
+               await self._refresh_token(self.__tokenData)
+            except Exception as e:
+               log.error(e)
+         return False
+      return True
+
+
+   ###########################################################
+   # Class public functions
+   ###########################################################
+
+   ###########################################################
+   # Init object
+   ###########################################################
+   async def init(self):
+      # First try
+      if await self._init() == False:
+         # Second try (after token refresh)
+         if await self._init() == False:
             # Failed permanently
+            log.error("ERROR: unable to initialize")
+            return False
+      return True
+      
+   ###########################################################
+   # Get recent periodic pump data
+   ###########################################################
+   async def getRecentData(self):
+      # Pick up token rotated by another process (no refresh needed)
+      if not self.__refreshLock.locked():
+         async with self.__refreshLock:
+            await self._reload_token_file()
+      
+      # Check if access token is valid
+      if not self._is_token_valid(self.__accessTokenPayload):
+         await self._refresh_token(self.__tokenData)
+         if not self._is_token_valid(self.__accessTokenPayload):
+            log.error("ERROR: unable to get valid access token")
+            return None
+         
+      if self.__patient is not None:
+         patientId = self.__patient["username"]
+      else:
+         patientId = None
+      
+      # Get data: first try
+      token_data = self.__tokenData
+      data = await self._get_data(self.__config, 
+                                  token_data, 
+                                  self.__username,
+                                  self.__user["role"],
+                                  patientId)
+      # Check API response
+      if self.__last_api_status in AUTH_ERROR_CODES:
+         # Try to refresh token
+         await self._refresh_token(token_data)
+         
+         # Get data: second try 
+         data = await self._get_data(self.__config, 
+                                     self.__tokenData, 
+                                     self.__username,
+                                     self.__user["role"],
+                                     patientId)
+         # Check API response
+         if self.__last_api_status in AUTH_ERROR_CODES:
+            # Failed permanently, rediscover config and user profile on next init
             log.error("ERROR: unable to get data")
+            self._invalidate_cache_file(self.__cacheFile)
             return None
       return data
 
@@ -425,3 +1237,13 @@ class CareLinkClient(object):
    ###########################################################
    def getClientVersion(self):
       return self.__version
+
+   ###########################################################
+   # Close pooled HTTP connections
+   ###########################################################
+   async def close(self):
+      if self.__revalidateTask is not None:
+         self.__revalidateTask.cancel()
+      if self.__session is not None:
+         await self.__session.close()
+         self.__session = None
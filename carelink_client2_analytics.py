@@ -0,0 +1,174 @@
+###############################################################################
+#
+#  Carelink Client 2 glucose analytics
+#
+#  Description:
+#
+#    Summary statistics and chart downsampling over SG series columns
+#    (SGSeries.times/values or any sequence of times and SG values):
+#
+#    - sg_stats(): time below/in/above range with configurable limits,
+#      mean, standard deviation, coefficient of variation, GMI and
+#      percentiles of the valid (non zero) readings
+#    - lttb(): Largest-Triangle-Three-Buckets downsampling, keeps the
+#      visual shape (peaks, lows) of long series with few points
+#
+#    Uses NumPy when it is installed (vectorized, for multi-week
+#    series), otherwise the same results are computed in pure Python.
+#
+#  Changelog:
+#
+#    17/10/2026 - Initial version
+#
+###############################################################################
+
+import math
+
+# NumPy is optional
+try:
+   import numpy as np
+except ImportError:
+   np = None
+
+
+# Default range limits (mg/dL) and percentiles
+LOW_LIMIT   = 70
+HIGH_LIMIT  = 180
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+###########################################################
+# Glucose Management Indicator (%) from mean SG (mg/dL)
+###########################################################
+def gmi(mean):
+   return 3.31 + 0.02392 * mean
+
+
+###########################################################
+# Percentile of sorted values, linear interpolation
+# between closest ranks (same as numpy.percentile)
+###########################################################
+def _percentile(ordered, p):
+   pos = (len(ordered) - 1) * p / 100.0
+   lo = int(math.floor(pos))
+   hi = min(lo + 1, len(ordered) - 1)
+   return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def _result(n, below, above, mean, sd, percentiles):
+   return {
+      "count":       n,
+      "below":       100.0 * below / n,
+      "in_range":    100.0 * (n - below - above) / n,
+      "above":       100.0 * above / n,
+      "mean":        mean,
+      "sd":          sd,
+      "cv":          100.0 * sd / mean if mean else 0.0,
+      "gmi":         gmi(mean),
+      "percentiles": percentiles
+      }
+
+
+###########################################################
+# Statistics of SG values (0 = no reading, ignored), None
+# without valid readings. Range percentages count readings
+# below low and above high limit, SD is the population SD.
+###########################################################
+def sg_stats(values, low=LOW_LIMIT, high=HIGH_LIMIT, percentiles=PERCENTILES):
+   if np is not None:
+      v = np.asarray(values, dtype=np.float64)
+      v = v[v > 0]
+      n = len(v)
+      if n == 0:
+         return None
+      pv = np.percentile(v, percentiles) if percentiles else ()
+      return _result(n, int(np.count_nonzero(v < low)), int(np.count_nonzero(v > high)),
+                     float(v.mean()), float(v.std()),
+                     dict((p, float(x)) for p, x in zip(percentiles, pv)))
+
+   v = [x for x in values if x > 0]
+   n = len(v)
+   if n == 0:
+      return None
+   mean = math.fsum(v) / n
+   sd = math.sqrt(math.fsum((x - mean) ** 2 for x in v) / n)
+   ordered = sorted(v)
+   return _result(n, sum(1 for x in v if x < low), sum(1 for x in v if x > high),
+                  mean, sd, dict((p, float(_percentile(ordered, p))) for p in percentiles))
+
+
+###########################################################
+# Indices of valid (non zero) SG values
+###########################################################
+def valid_indices(values):
+   if np is not None:
+      return np.flatnonzero(np.asarray(values)).tolist()
+   return [i for i, x in enumerate(values) if x > 0]
+
+
+###########################################################
+# Largest-Triangle-Three-Buckets: indices of (at most)
+# threshold points of the series (x sorted) that keep its
+# shape. First and last points are always kept.
+###########################################################
+def lttb(x, y, threshold):
+   n = len(x)
+   if threshold >= n or threshold < 3:
+      return list(range(n))
+
+   if np is not None:
+      return _lttb_numpy(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), threshold)
+
+   # Bucket i (1..threshold-2) covers [edges[i-1], edges[i])
+   every = (n - 2) / (threshold - 2)
+   edges = [int(i * every) + 1 for i in range(threshold - 1)]
+   edges[-1] = n - 1
+   indices = [0]
+   a = 0
+   for i in range(threshold - 2):
+      start, end = edges[i], edges[i + 1]
+      # Average of next bucket (last point for the last bucket)
+      nstart = end
+      nend = edges[i + 2] if i + 2 < len(edges) else n
+      cnt = nend - nstart
+      avg_x = math.fsum(x[nstart:nend]) / cnt
+      avg_y = math.fsum(y[nstart:nend]) / cnt
+      ax, ay = x[a], y[a]
+      best, best_area = start, -1.0
+      for j in range(start, end):
+         area = abs((ax - avg_x) * (y[j] - ay) - (ax - x[j]) * (avg_y - ay))
+         if area > best_area:
+            best, best_area = j, area
+      indices.append(best)
+      a = best
+   indices.append(n - 1)
+   return indices
+
+
+def _lttb_numpy(x, y, threshold):
+   n = len(x)
+   every = (n - 2) / (threshold - 2)
+   edges = (np.arange(threshold - 1) * every).astype(np.int64) + 1
+   edges[-1] = n - 1
+
+   # Next bucket averages for all buckets at once (cumulative sums)
+   cx = np.concatenate(([0.0], np.cumsum(x)))
+   cy = np.concatenate(([0.0], np.cumsum(y)))
+   nstart = edges[1:]
+   nend = np.append(edges[2:], n)
+   cnt = nend - nstart
+   avg_x = (cx[nend] - cx[nstart]) / cnt
+   avg_y = (cy[nend] - cy[nstart]) / cnt
+
+   # Selected point depends on the previous bucket's choice
+   indices = np.empty(threshold, dtype=np.int64)
+   indices[0] = 0
+   indices[-1] = n - 1
+   a = 0
+   for i in range(threshold - 2):
+      start, end = edges[i], edges[i + 1]
+      ax, ay = x[a], y[a]
+      area = np.abs((ax - avg_x[i]) * (y[start:end] - ay) - (ax - x[start:end]) * (avg_y[i] - ay))
+      a = start + int(area.argmax())
+      indices[i + 1] = a
+   return indices.tolist()
@@ -0,0 +1,196 @@
+###############################################################################
+#
+#  Carelink Client 2 history store
+#
+#  Description:
+#
+#    The Carelink API only returns the last 24 hours of SG readings and
+#    markers. This module keeps them in a local SQLite database so longer
+#    time ranges (weeks, months) can be queried:
+#
+#    - every snapshot is ingested, readings are deduplicated by timestamp
+#    - only readings newer than the stored high-water mark are written,
+#      in one transaction per snapshot
+#    - markers are deduplicated by a hash of type, time and data values,
+#      all markers of each snapshot are merged (markers can be entered
+#      on the pump or uploaded long after later readings)
+#    - the database runs in WAL mode with relaxed syncing to keep the
+#      writes cheap on SD cards
+#
+#    Times are stored as epoch seconds of the pump local time taken as
+#    UTC, like in the snapshot model.
+#
+#  Changelog:
+#
+#    17/10/2026 - Initial version
+#    17/10/2026 - Markers keyed by content hash, merged over the snapshot
+#
+###############################################################################
+
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from bisect import bisect_right
+
+
+SCHEMA_VERSION = 1
+MARKERS_TABLE = """
+CREATE TABLE IF NOT EXISTS markers (
+   id     BLOB PRIMARY KEY,
+   time   INTEGER NOT NULL,
+   type   TEXT NOT NULL,
+   data   TEXT NOT NULL
+) WITHOUT ROWID
+"""
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sgs (
+   time   INTEGER PRIMARY KEY,
+   sg     INTEGER NOT NULL,
+   state  TEXT
+);
+%s;
+CREATE INDEX IF NOT EXISTS markers_time ON markers (time);
+""" % MARKERS_TABLE
+
+
+###########################################################
+# Marker key: hash of type, time and data values (the
+# display fields of a marker may change between uploads)
+###########################################################
+def marker_id(mtype, t, values):
+   return hashlib.sha1(json.dumps([mtype, int(t), values], sort_keys=True).encode()).digest()
+
+
+###########################################################
+# Class HistoryStore
+###########################################################
+class HistoryStore(object):
+
+   def __init__(self, filename):
+      self.__filename = filename
+      self.__lock = threading.Lock()
+      self.__db = sqlite3.connect(filename, check_same_thread=False)
+      self.__db.execute("PRAGMA journal_mode=WAL")
+      self.__db.execute("PRAGMA synchronous=NORMAL")
+      self._migrate()
+      self.__db.executescript(SCHEMA)
+      self.__db.execute("PRAGMA user_version=%d" % SCHEMA_VERSION)
+      self.__sgMark = self._max_time("sgs")
+
+   def _max_time(self, table):
+      row = self.__db.execute("SELECT MAX(time) FROM %s" % table).fetchone()
+      return row[0]
+
+   ###########################################################
+   # Upgrade database of an older version
+   ###########################################################
+   def _migrate(self):
+      version = self.__db.execute("PRAGMA user_version").fetchone()[0]
+      columns = [r[1] for r in self.__db.execute("PRAGMA table_info(markers)")]
+      if version >= SCHEMA_VERSION or not columns or "id" in columns:
+         return
+      # Version 0: markers keyed by (time, type)
+      with self.__db:
+         self.__db.execute("BEGIN")
+         rows = self.__db.execute("SELECT time, type, data FROM markers").fetchall()
+         self.__db.execute("DROP TABLE markers")
+         self.__db.execute(MARKERS_TABLE)
+         self.__db.executemany("INSERT OR IGNORE INTO markers VALUES (?,?,?,?)",
+                               [(marker_id(mtype, t, self._data_values(data)), t, mtype, data)
+                                for t, mtype, data in rows])
+
+   def _data_values(self, data):
+      try:
+         return json.loads(data)["data"]["dataValues"]
+      except (ValueError, KeyError, TypeError):
+         return {}
+
+   ###########################################################
+   # Store readings of snapshot newer than the high-water
+   # mark and new markers, returns number of new (sgs, markers)
+   ###########################################################
+   def ingest(self, snapshot):
+      sgs = snapshot.sgs
+      lo = 0 if self.__sgMark is None else bisect_right(sgs.times, self.__sgMark)
+      sg_rows = [(int(sgs.times[i]), sgs.values[i], sgs.stateNames[sgs.states[i]])
+                 for i in range(lo, len(sgs.times))]
+
+      markers = snapshot.markers
+      marker_rows = []
+      for i in range(len(markers.times)):
+         mtype = markers.types[markers.kinds[i]]
+         marker_rows.append((marker_id(mtype, markers.times[i], markers.values[i]),
+                             int(markers.times[i]), mtype, markers.raw[i].decode()))
+
+      if not sg_rows and not marker_rows:
+         return 0, 0
+
+      with self.__lock:
+         with self.__db:
+            cur = self.__db.executemany("INSERT OR IGNORE INTO sgs VALUES (?,?,?)", sg_rows)
+            new_sgs = max(cur.rowcount, 0)
+            cur = self.__db.executemany("INSERT OR IGNORE INTO markers VALUES (?,?,?,?)", marker_rows)
+            new_markers = max(cur.rowcount, 0)
+         if sg_rows:
+            self.__sgMark = max(self.__sgMark or 0, sg_rows[-1][0])
+      return new_sgs, new_markers
+
+   ###########################################################
+   # Resolve time range bound: None, epoch seconds or
+   # negative = seconds before latest stored reading
+   ###########################################################
+   def _bound(self, t):
+      if t is None or t >= 0:
+         return t
+      if self.__sgMark is None:
+         return None
+      return self.__sgMark + t
+
+   def _range(self, since, until):
+      since = self._bound(since)
+      until = self._bound(until)
+      return (-1 if since is None else since,
+              2**62 if until is None else until)
+
+   ###########################################################
+   # SG readings in time range (API format)
+   ###########################################################
+   def sgRange(self, since=None, until=None):
+      with self.__lock:
+         rows = self.__db.execute("SELECT time, sg, state FROM sgs WHERE time BETWEEN ? AND ? ORDER BY time",
+                                  self._range(since, until)).fetchall()
+      return [{
+         "kind":        "SG",
+         "version":     1,
+         "sg":          sg,
+         "sensorState": state,
+         "timestamp":   time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t))
+         } for t, sg, state in rows]
+
+   ###########################################################
+   # Markers in time range, optionally of one type (API format)
+   ###########################################################
+   def markerRange(self, since=None, until=None, mtype=None):
+      query = "SELECT data FROM markers WHERE time BETWEEN ? AND ?"
+      params = self._range(since, until)
+      if mtype is not None:
+         query += " AND type = ?"
+         params += (mtype,)
+      with self.__lock:
+         rows = self.__db.execute(query + " ORDER BY time", params).fetchall()
+      return [json.loads(r[0]) for r in rows]
+
+   ###########################################################
+   # Stored time span (first, last) and counts
+   ###########################################################
+   def getStats(self):
+      with self.__lock:
+         first, last, count = self.__db.execute("SELECT MIN(time), MAX(time), COUNT(*) FROM sgs").fetchone()
+         markers = self.__db.execute("SELECT COUNT(*) FROM markers").fetchone()[0]
+      return {"first": first, "last": last, "sgs": count, "markers": markers}
+
+   def close(self):
+      with self.__lock:
+         self.__db.close()
@@ -0,0 +1,207 @@
+###############################################################################
+#
+#  Carelink Client 2 asyncio HTTP server
+#
+#  Description:
+#
+#    Minimal HTTP/1.1 server on asyncio for the proxy API. All
+#    connections are served by one event loop thread instead of one
+#    OS thread per connection:
+#
+#    - persistent connections (keep-alive), closed after an idle timeout
+#    - cap on the number of open connections, excess connections get
+#      503 Service Unavailable
+#    - GET, HEAD and POST requests are passed to a handler coroutine
+#
+#        async def handler(method, target, headers) -> (status, headers, body)
+#
+#      where headers are the request headers (lower case names) and the
+#      response headers are a list of (name, value) tuples.
+#
+#    - the body may also be an async iterator of byte chunks (e.g. server
+#      sent events): each chunk is written as soon as it is produced and
+#      the connection is closed at the end of the stream. Peers that stop
+#      acknowledging data are dropped after STREAM_TIMEOUT (Linux).
+#
+#  Changelog:
+#
+#    17/10/2026 - Initial version
+#    17/10/2026 - Pass POST requests to the handler
+#    17/10/2026 - Add streamed response bodies
+#
+###############################################################################
+
+import asyncio
+import socket
+import logging as log
+from http import HTTPStatus
+
+
+IDLE_TIMEOUT      = 15     # close keep-alive connections idle this long (seconds)
+MAX_CONNECTIONS   = 512    # open connections
+MAX_HEADER_SIZE   = 16384
+MAX_BODY_SIZE     = 65536
+STREAM_TIMEOUT    = 45     # drop streaming peers with unacknowledged data this long (seconds)
+SERVER_NAME       = "carelink_client2_httpd"
+
+
+###########################################################
+# Class AsyncHTTPServer
+###########################################################
+class AsyncHTTPServer(object):
+
+   def __init__(self, host, port, handler, maxConnections=MAX_CONNECTIONS, idleTimeout=IDLE_TIMEOUT):
+      self.__host = host
+      self.__port = port
+      self.__handler = handler
+      self.__maxConnections = maxConnections
+      self.__idleTimeout = idleTimeout
+      self.__connections = 0
+      self.__server = None
+
+   ###########################################################
+   # Read request line and headers, None on closed connection
+   ###########################################################
+   async def _read_request(self, reader):
+      try:
+         head = await reader.readuntil(b"\r\n\r\n")
+      except asyncio.IncompleteReadError as e:
+         if e.partial.strip():
+            raise ValueError("incomplete request")
+         return None
+      except asyncio.LimitOverrunError:
+         raise ValueError("request header too large")
+
+      lines = head.decode("latin-1").split("\r\n")
+      parts = lines[0].split()
+      if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+         raise ValueError("bad request line")
+      headers = {}
+      for line in lines[1:]:
+         if not line:
+            continue
+         name, sep, value = line.partition(":")
+         if not sep:
+            raise ValueError("bad header line")
+         headers[name.strip().lower()] = value.strip()
+
+      # Request body is not used, but has to be consumed
+      length = int(headers.get("content-length", 0))
+      if length < 0 or length > MAX_BODY_SIZE:
+         raise ValueError("bad content length")
+      if length:
+         await reader.readexactly(length)
+      return parts[0], parts[1], parts[2], headers
+
+   ###########################################################
+   # Write response
+   ###########################################################
+   def _write_response(self, writer, version, status, headers, body, keep_alive, send_body=True):
+      status = HTTPStatus(status)
+      out = ["%s %d %s" % (version, status.value, status.phrase),
+             "Server: %s" % SERVER_NAME]
+      for name, value in headers:
+         out.append("%s: %s" % (name, value))
+      if body is None:
+         # Streamed body, ends when the connection is closed
+         keep_alive = False
+      elif status != HTTPStatus.NOT_MODIFIED:
+         out.append("Content-Length: %d" % len(body))
+      out.append("Connection: %s" % ("keep-alive" if keep_alive else "close"))
+      writer.write(("\r\n".join(out) + "\r\n\r\n").encode("latin-1"))
+      if body and send_body and status != HTTPStatus.NOT_MODIFIED:
+         writer.write(body)
+
+   ###########################################################
+   # Write streamed body chunks until the iterator ends
+   ###########################################################
+   async def _write_stream(self, writer, chunks):
+      sock = writer.get_extra_info("socket")
+      if sock is not None and hasattr(socket, "TCP_USER_TIMEOUT"):
+         try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, STREAM_TIMEOUT * 1000)
+         except OSError:
+            pass
+      async for chunk in chunks:
+         writer.write(chunk)
+         await writer.drain()
+
+   ###########################################################
+   # Serve one connection
+   ###########################################################
+   async def _serve(self, reader, writer):
+      if self.__connections >= self.__maxConnections:
+         self._write_response(writer, "HTTP/1.1", HTTPStatus.SERVICE_UNAVAILABLE, [], b"", False)
+         writer.close()
+         return
+      self.__connections += 1
+      try:
+         while True:
+            try:
+               request = await asyncio.wait_for(self._read_request(reader), self.__idleTimeout)
+            except asyncio.TimeoutError:
+               break
+            except ValueError as e:
+               log.debug("bad request: %s" % e)
+               self._write_response(writer, "HTTP/1.1", HTTPStatus.BAD_REQUEST, [], b"", False)
+               await writer.drain()
+               break
+            if request is None:
+               break
+            method, target, version, headers = request
+
+            connection = headers.get("connection", "").lower()
+            if version == "HTTP/1.0":
+               keep_alive = (connection == "keep-alive")
+            else:
+               keep_alive = (connection != "close")
+
+            if method in ("GET", "HEAD", "POST"):
+               try:
+                  status, resp_headers, body = await self.__handler(method, target, headers)
+               except Exception as e:
+                  log.error("ERROR: request handler failed (%s)" % e)
+                  status, resp_headers, body = HTTPStatus.INTERNAL_SERVER_ERROR, [], b""
+            else:
+               status, resp_headers, body = HTTPStatus.METHOD_NOT_ALLOWED, [("Allow", "GET, HEAD, POST")], b""
+
+            if isinstance(body, (bytes, bytearray)):
+               self._write_response(writer, version, status, resp_headers, body, keep_alive, method != "HEAD")
+               await writer.drain()
+               if not keep_alive:
+                  break
+               continue
+
+            # Streamed body
+            try:
+               self._write_response(writer, version, status, resp_headers, None, False)
+               await writer.drain()
+               if method != "HEAD":
+                  await self._write_stream(writer, body)
+            finally:
+               if hasattr(body, "aclose"):
+                  await body.aclose()
+            break
+      except (ConnectionError, asyncio.IncompleteReadError):
+         pass
+      except asyncio.CancelledError:
+         # Server shutdown
+         pass
+      finally:
+         self.__connections -= 1
+         try:
+            writer.close()
+         except Exception:
+            pass
+
+   ###########################################################
+   # Run server until the loop is stopped
+   ###########################################################
+   async def serve_forever(self):
+      self.__server = await asyncio.start_server(self._serve, self.__host, self.__port,
+                                                 limit=MAX_HEADER_SIZE, backlog=self.__maxConnections)
+      async with self.__server:
+         await self.__server.serve_forever()
+
+   def getConnections(self):
+      return self.__connections
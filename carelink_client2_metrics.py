@@ -0,0 +1,251 @@
+###############################################################################
+#
+#  Carelink Client 2 metrics
+#
+#  Description:
+#
+#    Counters, gauges and histograms exported in the Prometheus text
+#    format (GET /metrics on the proxy and the web app).
+#
+#    Updates only take a per-metric lock for a few increments, the text
+#    is built when it is requested. Gauges can also be computed at that
+#    time from a function (e.g. age of the served data).
+#
+#    Usage:
+#      REQUESTS = metrics.Counter("app_requests_total", "Requests", ("route",))
+#      REQUESTS.labels("/api").inc()
+#      with LATENCY.labels("data").time():
+#         ...
+#
+#  Changelog:
+#
+#    17/10/2026 - Initial version
+#
+###############################################################################
+
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Default histogram buckets (seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+_registryLock = threading.Lock()
+
+
+def _format_value(v):
+   if v == float("inf"):
+      return "+Inf"
+   if float(v).is_integer():
+      return "%d" % v
+   return repr(float(v))
+
+
+def _format_labels(names, values, extra=None):
+   pairs = list(zip(names, values))
+   if extra is not None:
+      pairs.append(extra)
+   if not pairs:
+      return ""
+   return "{%s}" % ",".join('%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                            for n, v in pairs)
+
+
+###########################################################
+# Class Metric
+#
+# Base class: metric with optional labels, one child per
+# label value combination
+###########################################################
+class Metric(object):
+
+   kind = None
+
+   def __init__(self, name, documentation, labelnames=()):
+      self.name = name
+      self.documentation = documentation
+      self.labelnames = tuple(labelnames)
+      self._lock = threading.Lock()
+      self._children = {}
+      self._lookup = {}
+      with _registryLock:
+         _registry.append(self)
+
+   def _new_child(self):
+      raise NotImplementedError
+
+   ###########################################################
+   # Get child for label values (positional, in labelnames order)
+   ###########################################################
+   def labels(self, *values):
+      child = self._lookup.get(values)
+      if child is None:
+         if len(values) != len(self.labelnames):
+            raise ValueError("%s expects labels %s" % (self.name, self.labelnames))
+         # 200 and "200" are the same child
+         key = tuple(str(v) for v in values)
+         with self._lock:
+            child = self._children.get(key)
+            if child is None:
+               child = self._children[key] = self._new_child()
+            self._lookup[values] = child
+      return child
+
+   def _samples(self):
+      raise NotImplementedError
+
+   def render(self):
+      lines = ["# HELP %s %s" % (self.name, self.documentation),
+               "# TYPE %s %s" % (self.name, self.kind)]
+      lines.extend(self._samples())
+      return "\n".join(lines)
+
+
+###########################################################
+# Counter (only goes up)
+###########################################################
+class _CounterChild(object):
+   __slots__ = ("value", "lock")
+
+   def __init__(self, lock):
+      self.value = 0
+      self.lock = lock
+
+   def inc(self, amount=1):
+      with self.lock:
+         self.value += amount
+
+
+class Counter(Metric):
+
+   kind = "counter"
+
+   def _new_child(self):
+      return _CounterChild(self._lock)
+
+   def inc(self, amount=1):
+      self.labels().inc(amount)
+
+   def _samples(self):
+      return ["%s%s %s" % (self.name, _format_labels(self.labelnames, k), _format_value(c.value))
+              for k, c in list(self._children.items())]
+
+
+###########################################################
+# Gauge (set to a value or computed on collection)
+###########################################################
+class _GaugeChild(object):
+   __slots__ = ("value", "function")
+
+   def __init__(self):
+      self.value = 0
+      self.function = None
+
+   def set(self, value):
+      self.value = value
+
+   def set_function(self, function):
+      self.function = function
+
+   def get(self):
+      if self.function is not None:
+         return self.function()
+      return self.value
+
+
+class Gauge(Metric):
+
+   kind = "gauge"
+
+   def _new_child(self):
+      return _GaugeChild()
+
+   def set(self, value):
+      self.labels().set(value)
+
+   def set_function(self, function):
+      self.labels().set_function(function)
+
+   def _samples(self):
+      samples = []
+      for k, c in list(self._children.items()):
+         try:
+            value = c.get()
+         except Exception:
+            value = None
+         if value is not None:
+            samples.append("%s%s %s" % (self.name, _format_labels(self.labelnames, k), _format_value(value)))
+      return samples
+
+
+###########################################################
+# Histogram
+###########################################################
+class _HistogramChild(object):
+   __slots__ = ("buckets", "counts", "sum", "lock")
+
+   def __init__(self, buckets, lock):
+      self.buckets = buckets
+      self.counts = [0] * (len(buckets) + 1)
+      self.sum = 0.0
+      self.lock = lock
+
+   def observe(self, value):
+      i = bisect_left(self.buckets, value)
+      with self.lock:
+         self.counts[i] += 1
+         self.sum += value
+
+   @contextmanager
+   def time(self):
+      t = time.perf_counter()
+      try:
+         yield
+      finally:
+         self.observe(time.perf_counter() - t)
+
+
+class Histogram(Metric):
+
+   kind = "histogram"
+
+   def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+      self.buckets = tuple(sorted(buckets))
+      Metric.__init__(self, name, documentation, labelnames)
+
+   def _new_child(self):
+      return _HistogramChild(self.buckets, self._lock)
+
+   def observe(self, value):
+      self.labels().observe(value)
+
+   def time(self):
+      return self.labels().time()
+
+   def _samples(self):
+      samples = []
+      for k, c in list(self._children.items()):
+         with self._lock:
+            counts = list(c.counts)
+            total = c.sum
+         cumulative = 0
+         for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            samples.append("%s_bucket%s %d" % (self.name, _format_labels(self.labelnames, k, ("le", _format_value(bound))), cumulative))
+         samples.append("%s_sum%s %s" % (self.name, _format_labels(self.labelnames, k), _format_value(total)))
+         samples.append("%s_count%s %d" % (self.name, _format_labels(self.labelnames, k), cumulative))
+      return samples
+
+
+###########################################################
+# Text of all registered metrics
+###########################################################
+def render():
+   with _registryLock:
+      metrics = list(_registry)
+   return ("\n".join(m.render() for m in metrics) + "\n").encode()
@@ -0,0 +1,235 @@
+###############################################################################
+#
+#  Carelink Client 2 Multi Account Scheduler
+#
+#  Description:
+#
+#    This program periodically downloads the recent pump and sensor data
+#    of several Carelink accounts (one token file per account) from a
+#    single process. Each account is polled on its own cadence by a
+#    bounded pool of worker threads and has its own CareLinkClient
+#    instance. Per account fetch latency and data staleness are tracked
+#    and reported.
+#
+#    Usage:
+#      python carelink_client2_multi.py -t data/patient1.json -t data/patient2.json
+#
+#  Changelog:
+#
+#    17/10/2026 - Initial version
+#
+###############################################################################
+
+import carelink_client2
+import carelink_client2_schedule
+import argparse
+import time
+import threading
+import logging as log
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+
+VERSION = "1.0"
+
+# Logging config
+FORMAT = '[%(asctime)s:%(levelname)s] %(message)s'
+log.basicConfig(format=FORMAT, datefmt='%Y-%m-%d %H:%M:%S', level=log.INFO)
+
+UPDATE_INTERVAL = 300
+MAX_WORKERS     = 4
+REPORT_INTERVAL = 60
+
+
+###########################################################
+# Class AccountPoller
+#
+# Polling state of one Carelink account
+###########################################################
+class AccountPoller(object):
+
+   def __init__(self, tokenFile, wait=UPDATE_INTERVAL):
+      self.tokenFile = tokenFile
+      self.scheduler = carelink_client2_schedule.UploadScheduler(interval=wait)
+      self.client = None
+      self.initialized = False
+      self.busy = False
+      self.nextPoll = 0
+
+      # Latest data and statistics
+      self.recentData = None
+      self.lastFetchTime = None
+      self.lastLatency = None
+      self.lastStatus = None
+      self.fetchCount = 0
+      self.errorCount = 0
+
+   ###########################################################
+   # Server time of the last upload by the conduit (seconds)
+   ###########################################################
+   def lastUpdateTime(self):
+      try:
+         return self.recentData["patientData"]["lastConduitUpdateServerDateTime"] / 1000
+      except (KeyError, TypeError):
+         return None
+
+   ###########################################################
+   # Poll Carelink once (runs in worker thread)
+   ###########################################################
+   def poll(self):
+      try:
+         self._poll()
+      finally:
+         self.busy = False
+
+   def _poll(self):
+      try:
+         if not self.initialized:
+            if self.client is not None:
+               self.client.close()
+            self.client = carelink_client2.CareLinkClient(tokenFile=self.tokenFile)
+            self.initialized = self.client.init()
+            if not self.initialized:
+               log.error("ERROR: %s: unable to login" % self.tokenFile)
+               self.errorCount += 1
+               self.nextPoll = time.time() + self.scheduler.failed()
+               return
+
+         t = time.time()
+         data = self.client.getRecentData()
+         self.lastLatency = time.time() - t
+         self.lastStatus = self.client.getLastResponseCode()
+         self.fetchCount += 1
+
+         if data is not None and self.lastStatus == HTTPStatus.OK:
+            self.recentData = data
+            self.lastFetchTime = time.time()
+            patientData = data.get("patientData", {})
+            self.nextPoll = time.time() + self.scheduler.update(patientData.get("currentServerTime"),
+                                                                patientData.get("lastConduitUpdateServerDateTime"))
+         else:
+            log.error("ERROR: %s: failed to get data (response code %s)" % (self.tokenFile, self.lastStatus))
+            self.errorCount += 1
+            if self.lastStatus in carelink_client2.AUTH_ERROR_CODES:
+               self.initialized = False
+            self.nextPoll = time.time() + self.scheduler.failed()
+      except Exception as e:
+         log.error("ERROR: %s: %s" % (self.tokenFile, e))
+         self.errorCount += 1
+         self.nextPoll = time.time() + self.scheduler.failed()
+
+   ###########################################################
+   # Get account statistics
+   ###########################################################
+   def getStats(self):
+      lastUpdate = self.lastUpdateTime()
+      return {
+         "tokenfile":  self.tokenFile,
+         "logged_in":  self.initialized,
+         "fetches":    self.fetchCount,
+         "errors":     self.errorCount,
+         "status":     self.lastStatus,
+         "latency":    self.lastLatency,
+         "staleness":  None if lastUpdate is None else time.time() - lastUpdate,
+         "interval":   self.scheduler.getInterval(),
+         "next_poll":  max(0, self.nextPoll - time.time())
+         }
+
+
+###########################################################
+# Class MultiAccountScheduler
+###########################################################
+class MultiAccountScheduler(object):
+
+   def __init__(self, tokenFiles, wait=UPDATE_INTERVAL, workers=MAX_WORKERS):
+      self.__accounts = [AccountPoller(f, wait) for f in tokenFiles]
+      self.__workers = workers
+      self.__executor = None
+      self.__thread = None
+      self.__running = False
+      self.__wakeup = threading.Event()
+
+   ###########################################################
+   # Scheduler loop: dispatch due accounts to worker pool
+   ###########################################################
+   def _run(self):
+      while self.__running:
+         now = time.time()
+         for acc in self.__accounts:
+            if not acc.busy and acc.nextPoll <= now:
+               acc.busy = True
+               self.__executor.submit(acc.poll)
+
+         # Sleep until the next account is due
+         pending = [acc.nextPoll for acc in self.__accounts if not acc.busy]
+         timeout = min(pending) - time.time() if pending else 1
+         self.__wakeup.wait(min(max(timeout, 0.1), 1))
+         self.__wakeup.clear()
+
+   ###########################################################
+   # Start polling
+   ###########################################################
+   def start(self):
+      self.__running = True
+      self.__executor = ThreadPoolExecutor(max_workers=self.__workers)
+      self.__thread = threading.Thread(target=self._run, args=())
+      self.__thread.daemon = True
+      self.__thread.start()
+
+   ###########################################################
+   # Stop polling
+   ###########################################################
+   def stop(self):
+      self.__running = False
+      self.__wakeup.set()
+      if self.__thread is not None:
+         self.__thread.join()
+      if self.__executor is not None:
+         self.__executor.shutdown(wait=True)
+      for acc in self.__accounts:
+         if acc.client is not None:
+            acc.client.close()
+
+   ###########################################################
+   # Get latest data of an account
+   ###########################################################
+   def getRecentData(self, tokenFile):
+      for acc in self.__accounts:
+         if acc.tokenFile == tokenFile:
+            return acc.recentData
+      return None
+
+   ###########################################################
+   # Get statistics of all accounts
+   ###########################################################
+   def getStats(self):
+      return [acc.getStats() for acc in self.__accounts]
+
+
+if __name__ == "__main__":
+   # Parse command line
+   parser = argparse.ArgumentParser()
+   parser.add_argument('--tokenfile','-t', type=str, action='append', help='File containing auth tokens (repeat for each account)', required=True)
+   parser.add_argument('--wait',     '-w', type=int, help='Wait seconds between repeated calls (default %d)' % UPDATE_INTERVAL, required=False)
+   parser.add_argument('--workers',  '-n', type=int, help='Number of worker threads (default %d)' % MAX_WORKERS, required=False)
+   args = parser.parse_args()
+
+   wait    = UPDATE_INTERVAL if args.wait == None else args.wait
+   workers = MAX_WORKERS if args.workers == None else args.workers
+
+   log.info("Starting Carelink Client Multi Account Scheduler (version %s)" % VERSION)
+
+   scheduler = MultiAccountScheduler(args.tokenfile, wait=wait, workers=workers)
+   scheduler.start()
+   try:
+      while True:
+         time.sleep(REPORT_INTERVAL)
+         for s in scheduler.getStats():
+            log.info("%s: logged in %s, fetches %d, errors %d, latency %s, staleness %s" % (
+                     s["tokenfile"], s["logged_in"], s["fetches"], s["errors"],
+                     "--" if s["latency"] is None else "%.2fs" % s["latency"],
+                     "--" if s["staleness"] is None else "%ds" % s["staleness"]))
+   except KeyboardInterrupt:
+      pass
+   scheduler.stop()
+   log.info("Exit")
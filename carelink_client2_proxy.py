@@ -11,6 +11,45 @@
 #    Send a GET request to the following URI: 
 #      http://<serveraddr>:8081/carelink/          # all Carelink data
 #      http://<serveraddr>:8081/carelink/nohistory # no history data
+#
+#      http://<serveraddr>:8081/carelink/sgs       # SG readings
+#      http://<serveraddr>:8081/carelink/markers   # markers
+#      http://<serveraddr>:8081/metrics            # Prometheus metrics
+#
+#    Query parameters:
+#      fields=<f1>,<f2.sub>  only these patientData fields (carelink, nohistory)
+#      since=<t>, until=<t>  time range (sgs, markers), <t> is a timestamp
+#                            (2025-03-11T13:00:00), epoch seconds or negative
+#                            seconds before the latest reading (since=-3600)
+#      type=<markertype>     only markers of this type (markers)
+#
+#    With a history database (--history <file>) all readings are kept
+#    and can be queried over longer time ranges with the same parameters:
+#      http://<serveraddr>:8081/carelink/history/sgs
+#      http://<serveraddr>:8081/carelink/history/markers
+#
+#    The proxy can also be embedded in another program:
+#
+#      proxy = carelink_client2_proxy.CareLinkProxy(tokenFile="data/logindata.json")
+#      proxy.addListener(lambda snapshot: ...)   # called on new data
+#      proxy.start()
+#      snapshot = proxy.getSnapshot()
+#      proxy.stop()
+#
+#    Add ?refresh=1 (or send a POST request) to download new data from
+#    Carelink before responding. Concurrent requests share one download
+#    and requests within REFRESH_MIN_SPACING seconds of the last download
+#    get its data. The response header X-Refresh is the result (ok, 
+#    failed, throttled, timeout, unavailable).
+#
+#    Add ?after=<version> to wait until data newer than <version> 
+#    (X-Snapshot-Version response header) is available (long-poll,
+#    optional &timeout=<seconds>, 304 if nothing new arrived)
+#
+#    The last data is saved to disk and served again after a restart
+#    until new data is downloaded. The response header X-Snapshot-Age
+#    is the age of the data in seconds, X-Snapshot-Stale: 1 is set if
+#    the data was loaded from disk or is older than STALE_AGE.
 #  
 #  Author:
 #
@@ -28,22 +67,47 @@
 #    03/01/2024 - Porting to Carelink Client 2
 #    11/04/2024 - Handle reconnection in case of network error
 #    17/01/2025 - Adapt get_essential_data() to new data format
+#    17/10/2026 - Add streaming parse option (--stream)
+#    17/10/2026 - Keep latest data as compact snapshot
+#    17/10/2026 - Poll just after predicted upload (learned cadence)
+#    17/10/2026 - Serve pre-serialized responses with ETag/304
+#    17/10/2026 - Serve precompressed gzip/deflate responses
+#    17/10/2026 - Add long-poll (?after=<version>) for new data
+#    17/10/2026 - Add field projection and sgs/markers range queries
+#    17/10/2026 - Add local history store (--history) beyond 24 hours
+#    17/10/2026 - Add asyncio HTTP/1.1 keep-alive server mode (--async)
+#    17/10/2026 - Persist last snapshot, serve it as stale after restart
+#    17/10/2026 - Add /metrics (Prometheus text format)
+#    17/10/2026 - Package proxy as importable CareLinkProxy class
+#    17/10/2026 - Add on demand refresh (?refresh=1 or POST)
 #
 #  Copyright 2021-2025, Ondrej Wisniewski
 #
 ###############################################################################
 
 import carelink_client2
+import carelink_client2_snapshot
+import carelink_client2_schedule
+import carelink_client2_history
+import carelink_client2_httpd
+import carelink_client2_metrics as metrics
 import argparse
 import time
 import json
+import os
+import hashlib
+import functools
+import gzip
+import zlib
 import sys
 import signal
 import threading 
+import asyncio
+import concurrent.futures
 import logging as log
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from http import HTTPStatus
-from urllib.parse import parse_qs
+from urllib.parse import parse_qs, urlsplit
 
 
 VERSION = "1.2"
@@ -58,23 +122,63 @@ PORT     = 8081
 GUIURL   = ""
 APIURL   = "carelink"
 OPT_NOHISTORY = "nohistory"
+OPT_SGS       = "sgs"
+OPT_MARKERS   = "markers"
+OPT_HISTORY   = "history"
+METRICSURL    = "metrics"
+
+# Response compression (preferred first)
+ENCODINGS = ("gzip", "deflate")
+COMPRESS_LEVEL = 6
+COMPRESS_MIN_SIZE = 1024
+
+# Query results cached per snapshot
+QUERY_CACHE_SIZE = 64
+QUERY_PARAMS = ("fields", "since", "until", "type")
+
+# Long-poll
+LONGPOLL_TIMEOUT     = 55
+LONGPOLL_MAX_TIMEOUT = 300
 
 UPDATE_INTERVAL = 300
 RETRY_INTERVAL  = 120
 
+# On demand refresh
+REFRESH_MIN_SPACING = 30   # min seconds between downloads
+REFRESH_TIMEOUT     = 60   # max wait for the download
+REFRESH_OK          = "ok"
+REFRESH_FAILED      = "failed"
+REFRESH_THROTTLED   = "throttled"
+REFRESH_TIMEDOUT    = "timeout"
+REFRESH_UNAVAILABLE = "unavailable"
+
+# Poll results
+POLL_OK         = 0
+POLL_FAILED     = 1
+POLL_AUTH_ERROR = 2
+
+# Data older than this is flagged as stale (seconds)
+STALE_AGE = 900
+
 # Token handling
 TOKENFILE = "data/logindata.json"
-wait_for_params = True
+TOKEN_CHECK_INTERVAL = 1   # check for new token file while waiting
 
 # Status messages
 STATUS_INIT     = "Initialization"
 STATUS_DO_LOGIN = "Performing login"
 STATUS_LOGIN_OK = "Login successful"
 STATUS_NEED_TKN = "Valid token required"
-g_status = STATUS_INIT
 
-recentData = None
-verbose = False
+# Metrics
+REQUESTS = metrics.Counter("carelink_proxy_requests_total", "HTTP requests by route and status code", ("route", "code"))
+RESPONSE_BYTES = metrics.Counter("carelink_proxy_response_bytes_total", "HTTP response body bytes by route", ("route",))
+SERIALIZE_TIME = metrics.Histogram("carelink_proxy_serialize_duration_seconds", "Time to serialize and compress responses",
+                                   ("view",), buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+SNAPSHOT_AGE = metrics.Gauge("carelink_proxy_snapshot_age_seconds", "Age of the served data")
+SNAPSHOT_STALE = metrics.Gauge("carelink_proxy_snapshot_stale", "1 if the served data is stale")
+SNAPSHOT_VERSION = metrics.Gauge("carelink_proxy_snapshot_version", "Version of the served data")
+REFRESHES = metrics.Counter("carelink_proxy_refreshes_total", "On demand refresh requests by result", ("result",))
 
 
 #################################################
@@ -87,30 +191,255 @@ def on_sigterm(signum, frame):
 
 
 #################################################
-# Get only essential data from json
+# Get all data from snapshot
 #################################################
-def get_essential_data(data):
-   mydata = ""
-   if data != None:      
-      mydata = data["patientData"].copy()
-      try:
-         del mydata["sgs"]
-      except (KeyError,TypeError) as e:
-         pass
-      try:
-         del mydata["markers"]
-      except (KeyError,TypeError) as e:
-         pass
-      try:
-         del mydata["limits"]
-      except (KeyError,TypeError) as e:
-         pass
-      try:
-         del mydata["notificationHistory"]
-      except (KeyError,TypeError) as e:
-         pass
-   return mydata
-   
+def get_all_data(snapshot):
+   if snapshot is None:
+      return None
+   return snapshot.to_dict()
+
+
+#################################################
+# Get only essential data from snapshot
+#################################################
+def get_essential_data(snapshot):
+   if snapshot is None:
+      return ""
+   return snapshot.essential
+
+
+#################################################
+# Serialized API response (immutable), with
+# precompressed variants
+#################################################
+class ResponseView(object):
+   __slots__ = ("body", "etag", "encoded")
+
+   def __init__(self, body):
+      self.body = body
+      self.etag = '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+      self.encoded = {}
+      if len(body) >= COMPRESS_MIN_SIZE:
+         self.encoded["gzip"] = gzip.compress(body, COMPRESS_LEVEL, mtime=0)
+         self.encoded["deflate"] = zlib.compress(body, COMPRESS_LEVEL)
+
+   # Select body for Accept-Encoding request header,
+   # returns (content encoding or None, body)
+   def negotiate(self, accept_encoding):
+      if not accept_encoding:
+         return None, self.body
+      accepted = {}
+      for item in accept_encoding.split(","):
+         parts = item.strip().split(";")
+         q = 1.0
+         for p in parts[1:]:
+            p = p.strip()
+            if p.startswith("q="):
+               try:
+                  q = float(p[2:])
+               except ValueError:
+                  q = 0.0
+         accepted[parts[0].strip().lower()] = q
+      best = None
+      for enc in ENCODINGS:
+         if enc not in self.encoded:
+            continue
+         q = accepted.get(enc, accepted.get("*", 0.0))
+         if q > 0 and (best is None or q > best[1]):
+            best = (enc, q)
+      if best is None:
+         return None, self.body
+      return best[0], self.encoded[best[0]]
+
+   # Check If-None-Match request header
+   def matches(self, if_none_match):
+      if not if_none_match:
+         return False
+      for tag in if_none_match.split(","):
+         tag = tag.strip()
+         if tag.startswith("W/"):
+            tag = tag[2:]
+         if tag == self.etag or tag == "*":
+            return True
+      return False
+
+
+HISTORY_PATHS = (APIURL+'/'+OPT_HISTORY+'/'+OPT_SGS, APIURL+'/'+OPT_HISTORY+'/'+OPT_MARKERS)
+API_PATHS = (APIURL, APIURL+'/'+OPT_NOHISTORY, APIURL+'/'+OPT_SGS, APIURL+'/'+OPT_MARKERS) + HISTORY_PATHS
+
+
+#################################################
+# Parse time range parameter
+#################################################
+def parse_time_param(value):
+   if value is None:
+      return None
+   try:
+      return float(value)
+   except ValueError:
+      return carelink_client2_snapshot.parse_timestamp(value)
+
+
+#################################################
+# Compile query to function (snapshot, history) -> 
+# result (cached per distinct query)
+#################################################
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+def compile_query(path, fields, since, until, mtype):
+   since = parse_time_param(since)
+   until = parse_time_param(until)
+   if path == APIURL+'/'+OPT_SGS:
+      return lambda snapshot, history: [] if snapshot is None else snapshot.sgRange(since, until)
+   if path == APIURL+'/'+OPT_MARKERS:
+      return lambda snapshot, history: [] if snapshot is None else snapshot.markerRange(since, until, mtype)
+   if path in HISTORY_PATHS:
+      if path.endswith(OPT_SGS):
+         return lambda snapshot, history: history.sgRange(since, until)
+      return lambda snapshot, history: history.markerRange(since, until, mtype)
+   if fields is None:
+      raise ValueError("no query parameters for %s" % path)
+   field_paths = tuple(tuple(f.split(".")) for f in fields.split(",") if f)
+   history = (path == APIURL)
+   return lambda snapshot, store: None if snapshot is None else snapshot.project(field_paths, history)
+
+
+#################################################
+# API responses of one snapshot, serialized once
+#################################################
+class SnapshotViews(object):
+
+   def __init__(self, snapshot, body=None, persisted=False, history=None):
+      self.snapshot = snapshot
+      self.version = 0 if snapshot is None else snapshot.version
+      self.persisted = persisted
+      self.history = history
+      with SERIALIZE_TIME.labels("snapshot").time():
+         if body is None:
+            body = json.dumps(get_all_data(snapshot)).encode()
+         self.views = {
+            APIURL:                     ResponseView(body),
+            APIURL+'/'+OPT_NOHISTORY:   ResponseView(json.dumps(get_essential_data(snapshot)).encode())
+            }
+      self.queries = {}
+
+   # Age of data in seconds and stale flag
+   def get_age(self):
+      if self.snapshot is None:
+         return None, False
+      age = max(0, time.time() - self.snapshot.fetchTime)
+      return age, self.persisted or age > STALE_AGE
+
+   # Get view for path and query parameters, raises ValueError
+   # for invalid queries
+   def get_view(self, path, query):
+      key = (path,) + tuple(query[p][0] if p in query else None for p in QUERY_PARAMS)
+      if key[1:] == (None,) * len(QUERY_PARAMS) and path in self.views:
+         return self.views[path]
+      view = self.queries.get(key)
+      if view is None:
+         if path in HISTORY_PATHS and self.history is None:
+            raise ValueError("no history database")
+         plan = compile_query(*key)
+         with SERIALIZE_TIME.labels("query").time():
+            view = ResponseView(json.dumps(plan(self.snapshot, self.history)).encode())
+         # History ranges can be large, don't keep them
+         if path not in HISTORY_PATHS and len(self.queries) < QUERY_CACHE_SIZE:
+            self.queries[key] = view
+      return view
+
+
+#################################################
+# Save snapshot views to file: header line with the
+# fetch time, then the serialized full data
+#################################################
+def save_snapshot_file(filename, views):
+   if filename is None or views.snapshot is None:
+      return
+   tmpname = filename + ".tmp"
+   try:
+      with open(tmpname, "wb") as f:
+         f.write(json.dumps({"fetchTime": views.snapshot.fetchTime}).encode() + b"\n")
+         f.write(views.views[APIURL].body)
+      os.replace(tmpname, filename)
+   except OSError as e:
+      log.error("ERROR: failed writing snapshot file %s (%s)" % (filename, e))
+
+
+#################################################
+# Load snapshot views saved by save_snapshot_file()
+#################################################
+def load_snapshot_file(filename, history=None):
+   if filename is None or not os.path.isfile(filename):
+      return None
+   try:
+      with open(filename, "rb") as f:
+         header = json.loads(f.readline())
+         body = f.read()
+      snapshot = carelink_client2_snapshot.Snapshot.from_data(json.loads(body), header["fetchTime"])
+   except (OSError, ValueError, KeyError, TypeError):
+      log.error("ERROR: failed parsing snapshot file %s" % filename)
+      return None
+   return SnapshotViews(snapshot, body, persisted=True, history=history)
+
+
+#################################################
+# Parse long-poll parameters, returns (after, timeout)
+# or None, raises ValueError for invalid values
+#################################################
+def longpoll_params(query):
+   if "after" not in query:
+      return None
+   after = int(query["after"][0])
+   timeout = float(query["timeout"][0]) if "timeout" in query else LONGPOLL_TIMEOUT
+   return after, min(max(timeout, 0), LONGPOLL_MAX_TIMEOUT)
+
+
+#################################################
+# API response for view: (status, headers, body)
+#################################################
+def view_response(views, view, if_none_match, accept_encoding, not_modified=False, refresh=None):
+   headers = [("ETag", view.etag),
+              ("X-Snapshot-Version", str(views.version)),
+              ("Vary", "Accept-Encoding"),
+              ("Access-Control-Allow-Origin", "*")]
+   if refresh is not None:
+      headers.append(("X-Refresh", refresh))
+   age, stale = views.get_age()
+   if age is not None:
+      headers.append(("X-Snapshot-Age", "%d" % age))
+      if stale:
+         headers.append(("X-Snapshot-Stale", "1"))
+   if not_modified or view.matches(if_none_match):
+      # Client has current data already
+      return HTTPStatus.NOT_MODIFIED, headers, b""
+   encoding, body = view.negotiate(accept_encoding)
+   headers.append(("Content-type", "application/json"))
+   headers.append(("Cache-Control", "no-cache"))
+   if encoding is not None:
+      headers.append(("Content-Encoding", encoding))
+   return HTTPStatus.OK, headers, body
+
+
+#################################################
+# Check refresh query parameter
+#################################################
+def refresh_param(query):
+   return query.get("refresh", ["0"])[0] not in ("0", "", "false")
+
+
+#################################################
+# Count served request
+#################################################
+def count_request(path, status, nbytes):
+   if path in API_PATHS or path == METRICSURL:
+      route = "/" + path
+   elif path == "":
+      route = "/"
+   else:
+      route = "other"
+   REQUESTS.labels(route, int(status)).inc()
+   RESPONSE_BYTES.labels(route).inc(nbytes)
+
 
 def webgui(status,action=None,country=""):
    head =  '<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd"> \n \
@@ -150,31 +479,51 @@ class MyServer(BaseHTTPRequestHandler):
       #Disable logging
       pass
 
-   def do_GET(self):
+   def do_GET(self, refresh=False):
       # Security checks (if any)
       # TODO
       log.debug("received client GET request from %s" % (self.address_string()))
       #print(self.path)
       
       # Check request path
-      if self.path.strip("/") == APIURL:
-         # Get latest Carelink data (complete)
-         response = json.dumps(recentData)
-         status_code = HTTPStatus.OK
-         content_type = "application/json"
-         #print("All data requested")
-      elif self.path.strip("/") == APIURL+'/'+OPT_NOHISTORY:
-         # Get latest Carelink data without history
-         response = json.dumps(get_essential_data(recentData))
+      proxy = self.server.proxy
+      url = urlsplit(self.path)
+      path = url.path.strip("/")
+      views = proxy.getViews()
+      if path in API_PATHS:
+         # Get latest Carelink data (complete, without history, or 
+         # query result), serialized once per snapshot
+         query = parse_qs(url.query)
+         result = None
+         try:
+            longpoll = longpoll_params(query)
+            if refresh or refresh_param(query):
+               # Download new data now (shared with concurrent requests)
+               result, views = proxy.refresh()
+               longpoll = None
+            elif longpoll is not None:
+               # Long-poll: wait for data newer than the client has
+               views = proxy.waitForViews(*longpoll)
+            view = views.get_view(path, query)
+         except ValueError:
+            count_request(path, HTTPStatus.BAD_REQUEST, 0)
+            self.send_response(HTTPStatus.BAD_REQUEST)
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            return
+         self.send_view(path, views, view, longpoll is not None and views.version == longpoll[0], result)
+         return
+      elif path == METRICSURL:
+         response = metrics.render().decode()
          status_code = HTTPStatus.OK
-         content_type = "application/json"
-         #print("Only essential data requested")
+         content_type = metrics.CONTENT_TYPE
       elif self.path == "/":
          # Show web GUI
-         if g_status == STATUS_NEED_TKN:
-            response = webgui(status=g_status, action=GUIURL)
+         status = proxy.getStatus()
+         if status == STATUS_NEED_TKN:
+            response = webgui(status=status, action=GUIURL)
          else:
-            response = webgui(status=g_status)
+            response = webgui(status=status)
          status_code = HTTPStatus.OK
          content_type = "text/html"
          #print("Setup web page requested")
@@ -185,15 +534,50 @@ class MyServer(BaseHTTPRequestHandler):
          #print("page not found")
       
       # Send response
+      body = bytes(response, "utf-8")
+      count_request(path, status_code, len(body))
       self.send_response(status_code)
       self.send_header("Content-type", content_type)
       self.send_header("Access-Control-Allow-Origin", "*")
       self.end_headers()
       try:
-         self.wfile.write(bytes(response, "utf-8"))
+         self.wfile.write(body)
+      except BrokenPipeError:
+         pass
+
+   def send_view(self, path, views, view, not_modified=False, refresh=None):
+      status, headers, body = view_response(views, view,
+                                            self.headers.get("If-None-Match"),
+                                            self.headers.get("Accept-Encoding"),
+                                            not_modified, refresh)
+      count_request(path, status, len(body))
+      self.send_response(status)
+      for name, value in headers:
+         self.send_header(name, value)
+      if status == HTTPStatus.OK:
+         self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      try:
+         self.wfile.write(body)
       except BrokenPipeError:
          pass
 
+   # POST to API path: refresh, then respond like GET
+   def do_POST(self):
+      try:
+         content_length = int(self.headers.get('Content-Length', 0))
+      except ValueError:
+         content_length = 0
+      if content_length > 0:
+         self.rfile.read(content_length)
+      if urlsplit(self.path).path.strip("/") in API_PATHS:
+         self.do_GET(refresh=True)
+         return
+      count_request("other", HTTPStatus.NOT_FOUND, 0)
+      self.send_response(HTTPStatus.NOT_FOUND)
+      self.send_header("Access-Control-Allow-Origin", "*")
+      self.end_headers()
+
    '''
    def do_POST(self):
       # Get request body
@@ -234,108 +618,511 @@ class MyServer(BaseHTTPRequestHandler):
          pass
    '''
 
+
+
 #################################################
-# Web server thread
+# HTTP request handler for asyncio server
 #################################################
-def webserver_thread():
-   # Init web server
-   webserver = ThreadingHTTPServer((HOSTNAME, PORT), MyServer)
-   log.debug("HTTP server started at http://%s:%s" % (HOSTNAME, PORT))
+class AsyncApi(object):
 
-   # Start server loop
-   webserver.serve_forever()
+   def __init__(self, proxy, loop):
+      self.proxy = proxy
+      self.loop = loop
+      self.changed = loop.create_future()
+      # Refresh waits in its own thread, not in the default executor
+      # used by history queries
+      self.refreshExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="refresh")
+      self.refreshing = None
 
+   def close(self):
+      self.refreshExecutor.shutdown(wait=False)
 
-#################################################
-# Start web server as asynchronous thread
-#################################################
-def start_webserver():
-   t = threading.Thread(target=webserver_thread, args=())
-   t.daemon = True
-   t.start()
+   # Called by the proxy in the poller thread
+   def on_snapshot(self, snapshot):
+      self.loop.call_soon_threadsafe(self._notify)
 
+   def _notify(self):
+      changed, self.changed = self.changed, self.loop.create_future()
+      changed.set_result(None)
 
-# Parse command line 
-parser = argparse.ArgumentParser()
-parser.add_argument('--tokenfile','-t', type=str, help='File containing auth tokens (default: %s)' % TOKENFILE, required=False)
-parser.add_argument('--wait',     '-w', type=int, help='Wait seconds between repeated calls (default 300)', required=False)
-parser.add_argument('--verbose',  '-v', help='Verbose mode', action='store_true')
-args = parser.parse_args()
+   # Wait until views differ from given version
+   async def wait_for_views(self, after, timeout):
+      deadline = self.loop.time() + timeout
+      while self.proxy.getViews().version == after:
+         remaining = deadline - self.loop.time()
+         if remaining <= 0:
+            break
+         try:
+            await asyncio.wait_for(asyncio.shield(self.changed), remaining)
+         except asyncio.TimeoutError:
+            break
+      return self.proxy.getViews()
 
-# Get parameters from CLI
-tokenfile = TOKENFILE if args.tokenfile == None else args.tokenfile
-wait      = UPDATE_INTERVAL if args.wait == None else args.wait
-verbose   = args.verbose
+   # Download new data now, concurrent requests share one call
+   async def refresh(self):
+      if self.refreshing is None:
+         self.refreshing = self.loop.run_in_executor(self.refreshExecutor, self.proxy.refresh)
+         self.refreshing.add_done_callback(self._refresh_done)
+      return await asyncio.shield(self.refreshing)
 
-# Logging config (verbose)
-if verbose:
-   log.enable(level=log.DEBUG)
+   def _refresh_done(self, future):
+      self.refreshing = None
 
-log.info("Starting Carelink Client Proxy (version %s)" % VERSION)
+   async def handle(self, method, target, headers):
+      path = urlsplit(target).path.strip("/")
+      status, resp_headers, body = await self._handle(method, path, target, headers)
+      count_request(path, status, len(body))
+      return status, resp_headers, body
 
-# Init signal handler
-signal.signal(signal.SIGTERM, on_sigterm)
-signal.signal(signal.SIGINT, on_sigterm)
+   async def _handle(self, method, path, target, headers):
+      url = urlsplit(target)
+      views = self.proxy.getViews()
+      if path in API_PATHS:
+         query = parse_qs(url.query)
+         result = None
+         try:
+            longpoll = longpoll_params(query)
+            if method == "POST" or refresh_param(query):
+               # Waits for the shared download in the refresh thread
+               result, views = await self.refresh()
+               longpoll = None
+            elif longpoll is not None:
+               views = await self.wait_for_views(*longpoll)
+            if path in HISTORY_PATHS:
+               # Database query, keep it off the event loop
+               view = await self.loop.run_in_executor(None, views.get_view, path, query)
+            else:
+               view = views.get_view(path, query)
+         except ValueError:
+            return HTTPStatus.BAD_REQUEST, [("Access-Control-Allow-Origin", "*")], b""
+         return view_response(views, view,
+                              headers.get("if-none-match"),
+                              headers.get("accept-encoding"),
+                              longpoll is not None and views.version == longpoll[0],
+                              result)
+      elif method == "POST":
+         return HTTPStatus.NOT_FOUND, [("Access-Control-Allow-Origin", "*")], b""
+      elif path == METRICSURL:
+         return HTTPStatus.OK, [("Content-type", metrics.CONTENT_TYPE)], metrics.render()
+      elif target == "/":
+         status = self.proxy.getStatus()
+         if status == STATUS_NEED_TKN:
+            response = webgui(status=status, action=GUIURL)
+         else:
+            response = webgui(status=status)
+         status_code = HTTPStatus.OK
+      else:
+         response = ""
+         status_code = HTTPStatus.NOT_FOUND
+      return status_code, [("Content-type", "text/html"), ("Access-Control-Allow-Origin", "*")], response.encode()
 
-# Start web server
-start_webserver()
 
-# Main process loop
-while True:
-   # Init Carelink client
-   client = carelink_client2.CareLinkClient(tokenFile=tokenfile)
-   g_status = STATUS_DO_LOGIN
-   
-   # Login to Carelink server
-   if client.init():
-      g_status = STATUS_LOGIN_OK
+###########################################################
+# Class CareLinkProxy
+#
+# Polls the Carelink API in a background thread, keeps the
+# latest data as snapshot and serves it via HTTP
+###########################################################
+class CareLinkProxy(object):
 
-      # Infinite loop requesting Carelink data periodically
-      i = 0
-      while True:
-         i += 1
-         log.debug("Starting download %d" % i)
+   def __init__(self, tokenFile=TOKENFILE, wait=UPDATE_INTERVAL, streamRoutes=None, snapshotFile="",
+                historyFile=None, hostname=HOSTNAME, port=PORT, useAsync=False):
+      self.__tokenFile = tokenFile
+      self.__streamRoutes = streamRoutes
+      self.__historyFile = historyFile
+      self.__hostname = hostname
+      self.__port = port
+      self.__useAsync = useAsync
 
+      # Last data file ("" = next to token file, None = disabled)
+      if snapshotFile == "":
+         snapshotFile = os.path.splitext(tokenFile)[0] + "_snapshot.json"
+      self.__snapshotFile = snapshotFile
+
+      # Upload cadence scheduler (learns interval and clock offset)
+      self.__scheduler = carelink_client2_schedule.UploadScheduler(interval=wait)
+
+      # Latest data
+      self.__views = SnapshotViews(None)
+      self.__cond = threading.Condition()
+      self.__listeners = []
+      self.__status = STATUS_INIT
+      self.__history = None
+
+      # Downloads (for on demand refresh)
+      self.__pollStarted = 0
+      self.__pollDone = 0
+      self.__pollResult = None
+      self.__lastPoll = 0
+      self.__refreshRequested = False
+
+      # Threads
+      self.__client = None
+      self.__stopEvent = threading.Event()
+      self.__reloadEvent = threading.Event()
+      self.__wakeEvent = threading.Event()
+      self.__pollThread = None
+      self.__webserver = None
+      self.__webThread = None
+      self.__loop = None
+      self.__serverTask = None
+
+   ###########################################################
+   # Publish new snapshot views
+   ###########################################################
+   def _publish(self, views):
+      with self.__cond:
+         self.__views = views
+         # Wake up waiting long-poll clients
+         self.__cond.notify_all()
+      for listener in list(self.__listeners):
          try:
-            recentData = client.getRecentData()
-            if recentData != None and client.getLastResponseCode() == HTTPStatus.OK:
-               log.debug("New data received")
-            elif client.getLastResponseCode() == HTTPStatus.FORBIDDEN or client.getLastResponseCode() == HTTPStatus.UNAUTHORIZED:
-               # Authorization error occured
-               log.error("ERROR: failed to get data (Authotization error, response code %d)" % client.getLastResponseCode())
-               break
-            else:
-               # Connection error occured
-               log.error("ERROR: failed to get data (Connection error, response code %d)" % client.getLastResponseCode())
-               time.sleep(60)
-               continue
+            listener(views.snapshot)
          except Exception as e:
-            log.error(e)
-            recentData = None
-            time.sleep(60)
-            continue
-            
-         # Calculate time until next reading
+            log.error("ERROR: snapshot listener failed (%s)" % e)
+
+   ###########################################################
+   # Store and publish new data
+   ###########################################################
+   def _set_snapshot(self, snapshot):
+      if self.__history is not None:
          try:
-            nextReading = int(recentData["lastConduitUpdateServerTime"]/1000) + wait
-            tmoSeconds  = int(nextReading - time.time())
-            log.debug("Next reading at {0}, {1} seconds from now\n".format(nextReading,tmoSeconds))
-            if tmoSeconds < 0:
-               tmoSeconds = RETRY_INTERVAL
-         except KeyError:
-            tmoSeconds = RETRY_INTERVAL
-            #print("Retry reading {0} seconds from now\n".format(tmoSeconds))
-
-         log.debug("Waiting " + str(tmoSeconds) + " seconds before next download")
-         time.sleep(tmoSeconds+10)
-
-   # Wait for new token
-   # FIXME
-   log.info(STATUS_NEED_TKN)
-   g_status = STATUS_NEED_TKN
-   wait_for_params = True
-   while wait_for_params:
-      time.sleep(0.1)
-
-# Exit         
-log.info("Exit")
+            log.debug("History: %d new SG readings, %d new markers" % self.__history.ingest(snapshot))
+         except Exception as e:
+            log.error("ERROR: failed to store history (%s)" % e)
+      lastViews = self.__views
+      self._publish(SnapshotViews(snapshot, history=self.__history))
+      # Save data when the conduit uploaded new data
+      if lastViews.snapshot is None or lastViews.persisted or \
+         lastViews.snapshot.lastUpdateTime() != snapshot.lastUpdateTime():
+         save_snapshot_file(self.__snapshotFile, self.__views)
+
+   ###########################################################
+   # Sleep in poller thread until timeout, stop() or
+   # reloadToken()
+   ###########################################################
+   def _sleep(self, seconds):
+      self.__wakeEvent.wait(seconds)
+      self.__wakeEvent.clear()
+
+   ###########################################################
+   # Token file stamp (detects token saved by other programs)
+   ###########################################################
+   def _token_stamp(self):
+      try:
+         st = os.stat(self.__tokenFile)
+      except OSError:
+         return None
+      return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+   ###########################################################
+   # Wait for new token, returns False when stopped
+   ###########################################################
+   def _wait_for_token(self):
+      log.info(STATUS_NEED_TKN)
+      self.__status = STATUS_NEED_TKN
+      stamp = self._token_stamp()
+      while not self.__stopEvent.is_set():
+         if self.__reloadEvent.is_set() or self._token_stamp() != stamp:
+            self.__reloadEvent.clear()
+            return True
+         self._sleep(TOKEN_CHECK_INTERVAL)
+      return False
+
+   ###########################################################
+   # Download data once, returns (poll result, seconds until
+   # next download)
+   ###########################################################
+   def _poll(self, client):
+      scheduler = self.__scheduler
+      with self.__cond:
+         self.__pollStarted += 1
+         self.__lastPoll = time.time()
+         forced = self.__refreshRequested
+         self.__refreshRequested = False
+      result = POLL_FAILED
+      try:
+         recentData = client.getRecentData()
+         if recentData != None and client.getLastResponseCode() == HTTPStatus.OK:
+            log.debug("New data received")
+            snapshot = carelink_client2_snapshot.Snapshot.from_data(recentData)
+            self._set_snapshot(snapshot)
+            result = POLL_OK
+            return result, scheduler.update(snapshot.status.currentServerTime,
+                                            snapshot.status.lastConduitUpdateServerDateTime,
+                                            forced=forced)
+         elif client.getLastResponseCode() in carelink_client2.AUTH_ERROR_CODES:
+            # Authorization error occured
+            log.error("ERROR: failed to get data (Authotization error, response code %d)" % client.getLastResponseCode())
+            result = POLL_AUTH_ERROR
+            return result, 0
+         else:
+            # Connection error occured
+            log.error("ERROR: failed to get data (Connection error, response code %s)" % client.getLastResponseCode())
+      except Exception as e:
+         log.error(e)
+      finally:
+         with self.__cond:
+            self.__pollDone += 1
+            self.__pollResult = result
+            self.__cond.notify_all()
+      # Keep serving the last data (flagged stale when too old)
+      return result, scheduler.failed()
+
+   ###########################################################
+   # Poller thread
+   ###########################################################
+   def _run(self):
+      scheduler = self.__scheduler
+      stop = self.__stopEvent
+      while not stop.is_set():
+         # Init Carelink client
+         self.__client = client = carelink_client2.CareLinkClient(tokenFile=self.__tokenFile,
+                                                                  streamRoutes=self.__streamRoutes)
+         self.__reloadEvent.clear()
+         self.__status = STATUS_DO_LOGIN
+
+         # Login to Carelink server
+         if client.init():
+            self.__status = STATUS_LOGIN_OK
+
+            # Loop requesting Carelink data periodically
+            i = 0
+            while not stop.is_set() and not self.__reloadEvent.is_set():
+               i += 1
+               log.debug("Starting download %d" % i)
+
+               result, tmoSeconds = self._poll(client)
+               if result == POLL_AUTH_ERROR:
+                  break
+               if result == POLL_OK:
+                  log.debug("Upload interval %ds, server clock offset %.1fs" % (scheduler.getInterval(), scheduler.getSkew()))
+               log.debug("Waiting %d seconds before next download" % tmoSeconds)
+               self._sleep(tmoSeconds)
+
+         # Release pooled connections of this client
+         client.close()
+         if stop.is_set():
+            break
+         if self.__reloadEvent.is_set():
+            # New token saved: login again
+            continue
+
+         # Wait for new token
+         if not self._wait_for_token():
+            break
+
+   ###########################################################
+   # Web server threads
+   ###########################################################
+   def _webserver_thread(self):
+      log.debug("HTTP server started at http://%s:%s" % (self.__hostname, self.__port))
+      self.__webserver.serve_forever()
+
+   def _async_webserver_thread(self):
+      loop = self.__loop
+      asyncio.set_event_loop(loop)
+      api = AsyncApi(self, loop)
+      self.addListener(api.on_snapshot)
+      webserver = carelink_client2_httpd.AsyncHTTPServer(self.__hostname, self.__port, api.handle)
+      log.debug("Asyncio HTTP server started at http://%s:%s" % (self.__hostname, self.__port))
+      self.__serverTask = loop.create_task(webserver.serve_forever())
+      try:
+         loop.run_until_complete(self.__serverTask)
+      except asyncio.CancelledError:
+         pass
+      finally:
+         self.removeListener(api.on_snapshot)
+         api.close()
+         # Close open connections
+         pending = asyncio.all_tasks(loop)
+         for task in pending:
+            task.cancel()
+         loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+         loop.close()
+
+   ###########################################################
+   # Start polling and serving (port None = don't serve HTTP)
+   ###########################################################
+   def start(self):
+      log.info("Starting Carelink Client Proxy (version %s)" % VERSION)
+      self.__stopEvent.clear()
+
+      # Open history database
+      if self.__historyFile is not None:
+         self.__history = carelink_client2_history.HistoryStore(self.__historyFile)
+         log.info("History database %s: %d SG readings" % (self.__historyFile, self.__history.getStats()["sgs"]))
+
+      # Serve last saved data until new data arrives
+      views = load_snapshot_file(self.__snapshotFile, self.__history)
+      if views is not None:
+         log.info("Serving saved data from %s (age %ds)" % (self.__snapshotFile, views.get_age()[0]))
+      else:
+         views = SnapshotViews(None, history=self.__history)
+      self._publish(views)
+
+      SNAPSHOT_AGE.set_function(lambda: self.getViews().get_age()[0])
+      SNAPSHOT_STALE.set_function(lambda: int(self.getViews().get_age()[1]))
+      SNAPSHOT_VERSION.set_function(lambda: self.getViews().version)
+
+      # Start web server
+      if self.__port is not None:
+         if self.__useAsync:
+            self.__loop = asyncio.new_event_loop()
+            target = self._async_webserver_thread
+         else:
+            self.__webserver = ThreadingHTTPServer((self.__hostname, self.__port), MyServer)
+            self.__webserver.proxy = self
+            target = self._webserver_thread
+         self.__webThread = threading.Thread(target=target, args=())
+         self.__webThread.daemon = True
+         self.__webThread.start()
+
+      # Start poller
+      self.__pollThread = threading.Thread(target=self._run, args=())
+      self.__pollThread.daemon = True
+      self.__pollThread.start()
+
+   ###########################################################
+   # Stop polling and serving
+   ###########################################################
+   def stop(self):
+      self.__stopEvent.set()
+      self.__wakeEvent.set()
+      if self.__webserver is not None:
+         self.__webserver.shutdown()
+         self.__webserver.server_close()
+         self.__webserver = None
+      if self.__serverTask is not None:
+         self.__loop.call_soon_threadsafe(self.__serverTask.cancel)
+         self.__serverTask = None
+      if self.__webThread is not None:
+         self.__webThread.join()
+         self.__webThread = None
+      if self.__pollThread is not None:
+         # A download in progress is not interrupted
+         self.__pollThread.join(timeout=10)
+         self.__pollThread = None
+      if self.__history is not None:
+         self.__history.close()
+         self.__history = None
+
+   ###########################################################
+   # Login again with a new token
+   ###########################################################
+   def reloadToken(self):
+      self.__reloadEvent.set()
+      self.__wakeEvent.set()
+
+   ###########################################################
+   # Download new data now, returns (result, views). 
+   # Concurrent callers share one download, within 
+   # REFRESH_MIN_SPACING of the last download its data is
+   # returned without a new download
+   ###########################################################
+   def refresh(self, timeout=REFRESH_TIMEOUT):
+      with self.__cond:
+         if self.__status != STATUS_LOGIN_OK:
+            result = REFRESH_UNAVAILABLE
+         else:
+            if self.__pollStarted > self.__pollDone:
+               # Download in progress: use its result
+               target = self.__pollStarted
+            elif time.time() - self.__lastPoll < REFRESH_MIN_SPACING:
+               target = None
+            else:
+               target = self.__pollStarted + 1
+               if not self.__refreshRequested:
+                  self.__refreshRequested = True
+                  self.__wakeEvent.set()
+            if target is None:
+               result = REFRESH_THROTTLED
+            elif not self.__cond.wait_for(lambda: self.__pollDone >= target, timeout):
+               result = REFRESH_TIMEDOUT
+            elif self.__pollResult == POLL_OK:
+               result = REFRESH_OK
+            else:
+               result = REFRESH_FAILED
+         views = self.__views
+      REFRESHES.labels(result).inc()
+      return result, views
+
+   ###########################################################
+   # Latest data
+   ###########################################################
+   def getSnapshot(self):
+      return self.__views.snapshot
+
+   def getViews(self):
+      return self.__views
+
+   ###########################################################
+   # Wait until views differ from given version
+   ###########################################################
+   def waitForViews(self, after, timeout):
+      with self.__cond:
+         self.__cond.wait_for(lambda: self.__views.version != after, timeout)
+         return self.__views
+
+   ###########################################################
+   # Callbacks on new data: callback(snapshot), called in the
+   # poller thread
+   ###########################################################
+   def addListener(self, callback):
+      self.__listeners.append(callback)
+
+   def removeListener(self, callback):
+      try:
+         self.__listeners.remove(callback)
+      except ValueError:
+         pass
+
+   def getStatus(self):
+      return self.__status
+
+
+#################################################
+# Run proxy from command line
+#################################################
+def main():
+   # Parse command line 
+   parser = argparse.ArgumentParser()
+   parser.add_argument('--tokenfile','-t', type=str, help='File containing auth tokens (default: %s)' % TOKENFILE, required=False)
+   parser.add_argument('--wait',     '-w', type=int, help='Wait seconds between repeated calls (default 300)', required=False)
+   parser.add_argument('--stream',   '-s', help='Streaming parse, keep history arrays in compact form', action='store_true')
+   parser.add_argument('--snapshotfile', '-p', type=str, help='File to keep last data in across restarts (default: <tokenfile>_snapshot.json)', required=False)
+   parser.add_argument('--history',  '-d', type=str, help='SQLite database to keep all readings in (default: none)', required=False)
+   parser.add_argument('--async',    '-a', help='Serve API with asyncio HTTP/1.1 keep-alive server', action='store_true', dest='asyncServer')
+   parser.add_argument('--verbose',  '-v', help='Verbose mode', action='store_true')
+   args = parser.parse_args()
+
+   # Get parameters from CLI
+   tokenfile = TOKENFILE if args.tokenfile == None else args.tokenfile
+   wait      = UPDATE_INTERVAL if args.wait == None else args.wait
+   streamRoutes = carelink_client2_snapshot.SNAPSHOT_ROUTES if args.stream else None
+   snapshotfile = "" if args.snapshotfile == None else args.snapshotfile
+
+   # Logging config (verbose)
+   if args.verbose:
+      log.getLogger().setLevel(log.DEBUG)
+
+   # Init signal handler
+   signal.signal(signal.SIGTERM, on_sigterm)
+   signal.signal(signal.SIGINT, on_sigterm)
+
+   proxy = CareLinkProxy(tokenFile=tokenfile, wait=wait, streamRoutes=streamRoutes, snapshotFile=snapshotfile,
+                         historyFile=args.history, useAsync=args.asyncServer)
+   proxy.start()
+   try:
+      while True:
+         time.sleep(60)
+   except SystemExit:
+      pass
+   proxy.stop()
+
+   # Exit         
+   log.info("Exit")
+
+
+if __name__ == "__main__":
+   main()
@@ -0,0 +1,139 @@
+###############################################################################
+#
+#  Carelink Client 2 upload cadence scheduler
+#
+#  Description:
+#
+#    Decides when to poll the Carelink API next. The phone app (conduit)
+#    uploads new pump data at a roughly fixed interval. From the recent
+#    responses the scheduler learns:
+#
+#    - the upload interval (median of the intervals between uploads)
+#    - the offset between the server clock and the local clock
+#
+#    and polls just after the next predicted upload. Only when a poll
+#    finds no new upload (prediction missed) or fails it backs off with
+#    an exponentially growing delay.
+#
+#  Changelog:
+#
+#    17/10/2026 - Initial version
+#    17/10/2026 - Don't count forced (on demand) polls as missed
+#
+###############################################################################
+
+import time
+from collections import deque
+
+
+UPDATE_INTERVAL = 300   # initial guess of the upload interval
+MIN_INTERVAL    = 60    # bounds of the learned upload interval
+MAX_INTERVAL    = 900
+POLL_MARGIN     = 15    # poll this long after the predicted upload
+BACKOFF_BASE    = 30    # first retry delay after a missed prediction
+MIN_DELAY       = 5
+HISTORY         = 12    # number of uploads used for learning
+SKEW_WEIGHT     = 0.2   # smoothing of clock offset samples
+
+
+###########################################################
+# Class UploadScheduler
+###########################################################
+class UploadScheduler(object):
+
+   def __init__(self, interval=UPDATE_INTERVAL, margin=POLL_MARGIN):
+      self.__interval = interval
+      self.__margin = margin
+      self.__uploads = deque(maxlen=HISTORY)
+      self.__skew = 0.0
+      self.__haveSkew = False
+      self.__misses = 0
+
+   ###########################################################
+   # Learn upload interval from recent upload times
+   ###########################################################
+   def _learn_interval(self):
+      u = self.__uploads
+      samples = []
+      for i in range(1, len(u)):
+         d = u[i] - u[i-1]
+         # Skipped uploads: count the gap as several intervals
+         n = max(1, round(d / self.__interval))
+         samples.append(d / n)
+      if samples:
+         samples.sort()
+         interval = samples[len(samples) // 2]
+         self.__interval = min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+
+   ###########################################################
+   # Delay after a missed prediction or failed poll
+   ###########################################################
+   def _backoff(self):
+      return min(BACKOFF_BASE * 2 ** (self.__misses - 1), self.__interval)
+
+   ###########################################################
+   # Process poll result, return seconds until next poll
+   #   currentServerTime - server time of response (ms)
+   #   lastUploadTime    - server time of last conduit upload (ms)
+   #   forced            - poll was requested out of schedule
+   ###########################################################
+   def update(self, currentServerTime, lastUploadTime, receivedAt=None, forced=False):
+      now = time.time() if receivedAt is None else receivedAt
+
+      # Offset between server and local clock
+      if currentServerTime is not None:
+         sample = currentServerTime / 1000 - now
+         if self.__haveSkew:
+            self.__skew += SKEW_WEIGHT * (sample - self.__skew)
+         else:
+            self.__skew = sample
+            self.__haveSkew = True
+
+      if lastUploadTime is None:
+         return self.failed()
+
+      upload = lastUploadTime / 1000
+      if not self.__uploads or upload > self.__uploads[-1]:
+         # New upload received
+         self.__uploads.append(upload)
+         self.__misses = 0
+         self._learn_interval()
+      elif forced:
+         # Out of schedule poll, keep waiting for the predicted upload
+         return self.nextDelay(now)
+      else:
+         # No new upload since last poll: prediction missed
+         self.__misses += 1
+         return self._backoff()
+      return self.nextDelay(now)
+
+   ###########################################################
+   # Process failed poll, return seconds until next poll
+   ###########################################################
+   def failed(self):
+      self.__misses += 1
+      return self._backoff()
+
+   ###########################################################
+   # Seconds from now until shortly after next predicted upload
+   ###########################################################
+   def nextDelay(self, now=None):
+      now = time.time() if now is None else now
+      if not self.__uploads:
+         return self.__interval
+      server_now = now + self.__skew
+      predicted = self.__uploads[-1] + self.__interval
+      while predicted + self.__margin <= server_now:
+         predicted += self.__interval
+      delay = predicted + self.__margin - server_now
+      # Never wait longer than one interval (protects against bogus clock offsets)
+      return min(max(delay, MIN_DELAY), self.__interval + self.__margin)
+
+   ###########################################################
+   # Learned values
+   ###########################################################
+   def getInterval(self):
+      return self.__interval
+
+   def getSkew(self):
+      return self.__skew
@@ -0,0 +1,187 @@
+###############################################################################
+#
+#  Carelink Client 2 shared snapshot
+#
+#  Description:
+#
+#    Latest snapshot body published in a memory-mapped file, so several
+#    worker processes can serve the same data while a single ingest
+#    process downloads it:
+#
+#    - the writer (one process, enforced with an exclusive file lock)
+#      copies the body into the region and increments the version
+#    - readers map the same file; checking for a new version is one
+#      read of the header, without locks or system calls. The body is
+#      only copied out when the version changed.
+#
+#    Consistency uses a sequence counter (odd while a write is in
+#    progress) and a CRC of version, fetch time and body, readers retry
+#    on a torn read.
+#
+#    Layout: 64 bytes header (magic, sequence, version, body length,
+#    body CRC32, fetch time), then the body.
+#
+#  Changelog:
+#
+#    17/10/2026 - Initial version
+#
+###############################################################################
+
+import os
+import mmap
+import time
+import zlib
+import struct
+
+# Advisory file locking (not available on Windows)
+try:
+   import fcntl
+except ImportError:
+   fcntl = None
+
+
+MAGIC        = b"CLSNAP1\0"
+HEADER       = struct.Struct("<8sQQQId")
+HEADER_SIZE  = 64
+INITIAL_SIZE = 256 * 1024
+READ_RETRIES = 100
+
+# Default file: shared memory if available
+DEFAULT_FILE = "/dev/shm/carelink-snapshot" if os.path.isdir("/dev/shm") else "data/carelink-snapshot.shm"
+
+
+###########################################################
+# CRC of a published body and its header fields
+###########################################################
+def _checksum(version, fetchTime, body):
+   return zlib.crc32(body, zlib.crc32(struct.pack("<Qd", version, fetchTime)))
+
+
+###########################################################
+# Class SharedSnapshotWriter
+###########################################################
+class SharedSnapshotWriter(object):
+
+   def __init__(self, filename=DEFAULT_FILE, size=INITIAL_SIZE):
+      self.__filename = filename
+      self.__file = open(filename, "a+b")
+      if fcntl is not None:
+         try:
+            fcntl.flock(self.__file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+         except OSError:
+            self.__file.close()
+            raise RuntimeError("%s is already published by another process" % filename)
+      if os.fstat(self.__file.fileno()).st_size < HEADER_SIZE + size:
+         self.__file.truncate(HEADER_SIZE + size)
+      self.__map = mmap.mmap(self.__file.fileno(), 0)
+
+      # Continue the version of a previous writer, readers compare it
+      magic, seq, version, length, crc, fetchTime = HEADER.unpack_from(self.__map, 0)
+      if magic != MAGIC:
+         seq = version = 0
+      self.__seq = seq + (seq & 1)
+      self.__version = version
+      if magic != MAGIC:
+         HEADER.pack_into(self.__map, 0, MAGIC, self.__seq, 0, 0, 0, 0.0)
+
+   ###########################################################
+   # Publish new body, returns its version
+   ###########################################################
+   def publish(self, body, fetchTime=None):
+      if fetchTime is None:
+         fetchTime = time.time()
+      needed = HEADER_SIZE + len(body)
+      if needed > len(self.__map):
+         # Grow file, readers remap when they see a larger body
+         size = max(needed, 2 * len(self.__map))
+         self.__map.close()
+         self.__file.truncate(size)
+         self.__map = mmap.mmap(self.__file.fileno(), 0)
+
+      m = self.__map
+      self.__seq += 1
+      struct.pack_into("<Q", m, 8, self.__seq)
+      self.__version += 1
+      m[HEADER_SIZE:needed] = body
+      HEADER.pack_into(m, 0, MAGIC, self.__seq + 1, self.__version, len(body),
+                       _checksum(self.__version, fetchTime, body), fetchTime)
+      self.__seq += 1
+      return self.__version
+
+   def getVersion(self):
+      return self.__version
+
+   def close(self):
+      self.__map.close()
+      self.__file.close()
+
+
+###########################################################
+# Class SharedSnapshotReader
+###########################################################
+class SharedSnapshotReader(object):
+
+   def __init__(self, filename=DEFAULT_FILE):
+      self.__filename = filename
+      self.__file = None
+      self.__map = None
+
+   def _map(self):
+      if self.__map is None:
+         try:
+            self.__file = open(self.__filename, "rb")
+         except FileNotFoundError:
+            return None
+         if os.fstat(self.__file.fileno()).st_size < HEADER_SIZE:
+            self.__file.close()
+            return None
+         self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+      return self.__map
+
+   def _remap(self):
+      self.__map.close()
+      self.__file.close()
+      self.__map = None
+      return self._map()
+
+   ###########################################################
+   # Version of the published body (0 = none yet)
+   ###########################################################
+   def getVersion(self):
+      m = self._map()
+      if m is None:
+         return 0
+      return struct.unpack_from("<Q", m, 16)[0]
+
+   ###########################################################
+   # Copy of the published body, returns (version, body,
+   # fetch time) or None if nothing consistent is published
+   ###########################################################
+   def read(self):
+      m = self._map()
+      if m is None:
+         return None
+      for i in range(READ_RETRIES):
+         magic, seq, version, length, crc, fetchTime = HEADER.unpack_from(m, 0)
+         if magic != MAGIC or version == 0:
+            return None
+         if seq & 1:
+            time.sleep(0.001)
+            continue
+         if HEADER_SIZE + length > len(m):
+            # Body grew past the mapping, map the file again (None if
+            # it was removed or truncated meanwhile)
+            m = self._remap()
+            if m is None:
+               return None
+            continue
+         body = m[HEADER_SIZE:HEADER_SIZE + length]
+         if struct.unpack_from("<Q", m, 8)[0] == seq and _checksum(version, fetchTime, body) == crc:
+            return version, body, fetchTime
+      return None
+
+   def close(self):
+      if self.__map is not None:
+         self.__map.close()
+         self.__file.close()
+         self.__map = None
@@ -0,0 +1,318 @@
+###############################################################################
+#
+#  Carelink Client 2 snapshot model
+#
+#  Description:
+#
+#    Compact typed representation of one display/message response.
+#    It is built once per fetch and shared by the proxy and the web
+#    app instead of passing the raw nested dicts around:
+#
+#    - status:    __slots__ record with the status fields used by the
+#                 dashboard
+#    - essential: scalar patientData fields (the "nohistory" view)
+#    - sgs:       SGSeries, time sorted array columns (epoch seconds, SG)
+#    - markers:   MarkerTable, markers grouped by type with epoch times
+#
+#    Timestamps of the API are pump local times without time zone,
+#    they are stored as epoch seconds of that local time taken as UTC
+#    (use time.gmtime() to format them).
+#
+#  Changelog:
+#
+#    17/10/2026 - Initial version
+#    17/10/2026 - Add field projection and time range selection
+#    17/10/2026 - Keep markers without timestamp
+#
+###############################################################################
+
+import json
+import time
+import calendar
+import itertools
+import logging as log
+from bisect import bisect_left, bisect_right
+from array import array
+from carelink_client2_stream import SGSeries, CompactList
+
+
+# patientData keys not part of the essential (nohistory) view
+HISTORY_KEYS = ("sgs", "markers", "limits", "notificationHistory")
+
+_versions = itertools.count(1)
+
+
+###########################################################
+# Parse API timestamp to epoch seconds
+###########################################################
+def parse_timestamp(ts):
+   return calendar.timegm(time.strptime(ts, "%Y-%m-%dT%H:%M:%S"))
+
+
+###########################################################
+# Class MarkerTable
+#
+# Markers stored by type: event time and type index in array
+# columns, data values as small dicts and the complete marker
+# as compact JSON bytes (only decoded for the full view).
+# Markers without a valid timestamp are only kept in
+# untimed (compact JSON), listed after the others.
+###########################################################
+class MarkerTable(object):
+
+   __slots__ = ("types", "times", "kinds", "values", "raw", "untimed", "__typeIndex")
+
+   def __init__(self):
+      self.types = []
+      self.times = array("d")
+      self.kinds = array("B")
+      self.values = []
+      self.raw = []
+      self.untimed = []
+      self.__typeIndex = {}
+
+   def append(self, item):
+      try:
+         t = parse_timestamp(item["timestamp"])
+      except (KeyError, ValueError, TypeError):
+         log.info("marker without valid timestamp kept untimed")
+         self.untimed.append(json.dumps(item, separators=(",", ":")).encode())
+         return
+      mtype = item.get("type", "unknown")
+      idx = self.__typeIndex.get(mtype)
+      if idx is None:
+         idx = len(self.types)
+         self.types.append(mtype)
+         self.__typeIndex[mtype] = idx
+      try:
+         values = item["data"]["dataValues"]
+      except (KeyError, TypeError):
+         values = {}
+      self.times.append(t)
+      self.kinds.append(idx)
+      self.values.append(values)
+      self.raw.append(json.dumps(item, separators=(",", ":")).encode())
+
+   def __len__(self):
+      return len(self.times)
+
+   def __iter__(self):
+      for b in self.raw:
+         yield json.loads(b)
+      for b in self.untimed:
+         yield json.loads(b)
+
+   ###########################################################
+   # Iterate (type, epoch time, data values)
+   ###########################################################
+   def entries(self, mtype=None):
+      for i in range(len(self.times)):
+         t = self.types[self.kinds[i]]
+         if mtype is None or t == mtype:
+            yield t, self.times[i], self.values[i]
+
+   def to_list(self):
+      return list(self)
+
+
+###########################################################
+# Class PatientStatus
+###########################################################
+class PatientStatus(object):
+
+   __slots__ = ("lastSG", "lastSGTime", "lastSGTrend", "activeInsulin",
+                "pumpBatteryLevelPercent", "reservoirRemainingUnits",
+                "conduitInRange", "conduitMedicalDeviceInRange", "conduitSensorInRange",
+                "sensorDurationHours", "sensorState", "calibStatus", "timeToNextCalibHours",
+                "pumpBannerState", "currentServerTime", "lastConduitUpdateServerDateTime",
+                "belowHypoLimit", "timeInRange", "aboveHyperLimit", "averageSG")
+
+   def __init__(self, pd):
+      last_sg = pd.get("lastSG") or {}
+      self.lastSG = last_sg.get("sg", 0)
+      try:
+         self.lastSGTime = parse_timestamp(last_sg["timestamp"])
+      except (KeyError, ValueError, TypeError):
+         self.lastSGTime = None
+      self.lastSGTrend = pd.get("lastSGTrend", "NONE")
+      self.activeInsulin = (pd.get("activeInsulin") or {}).get("amount")
+      self.pumpBatteryLevelPercent = pd.get("pumpBatteryLevelPercent")
+      self.reservoirRemainingUnits = pd.get("reservoirRemainingUnits")
+      self.conduitInRange = pd.get("conduitInRange", False)
+      self.conduitMedicalDeviceInRange = pd.get("conduitMedicalDeviceInRange", False)
+      self.conduitSensorInRange = pd.get("conduitSensorInRange", False)
+      self.sensorDurationHours = pd.get("sensorDurationHours", 255)
+      self.sensorState = pd.get("sensorState")
+      self.calibStatus = pd.get("calibStatus")
+      self.timeToNextCalibHours = pd.get("timeToNextCalibHours", 255)
+      self.pumpBannerState = tuple(b.get("type", "") for b in pd.get("pumpBannerState") or ())
+      self.currentServerTime = pd.get("currentServerTime")
+      self.lastConduitUpdateServerDateTime = pd.get("lastConduitUpdateServerDateTime")
+      self.belowHypoLimit = pd.get("belowHypoLimit", 0)
+      self.timeInRange = pd.get("timeInRange", 0)
+      self.aboveHyperLimit = pd.get("aboveHyperLimit", 0)
+      self.averageSG = pd.get("averageSG", 0)
+
+
+###########################################################
+# Class Snapshot
+###########################################################
+class Snapshot(object):
+
+   __slots__ = ("version", "fetchTime", "metadata", "status", "essential",
+                "sgs", "markers", "limits", "notificationHistory")
+
+   def __init__(self, metadata, essential, sgs, markers, limits, notificationHistory, fetchTime=None):
+      self.version = next(_versions)
+      self.fetchTime = time.time() if fetchTime is None else fetchTime
+      self.metadata = metadata
+      self.status = PatientStatus(essential)
+      self.essential = essential
+      self.sgs = sgs
+      self.markers = markers
+      self.limits = limits
+      self.notificationHistory = notificationHistory
+
+   ###########################################################
+   # Build snapshot from display message data (plain or
+   # streamed with SNAPSHOT_ROUTES)
+   ###########################################################
+   @classmethod
+   def from_data(cls, data, fetchTime=None):
+      pd = data["patientData"]
+      essential = dict((k, v) for k, v in pd.items() if k not in HISTORY_KEYS)
+
+      sgs = pd.get("sgs")
+      if not isinstance(sgs, SGSeries):
+         series = SGSeries()
+         for sg in sgs or ():
+            series.append(sg)
+         sgs = series
+      sgs.sort()
+
+      markers = pd.get("markers")
+      if not isinstance(markers, MarkerTable):
+         table = MarkerTable()
+         for m in markers or ():
+            table.append(m)
+         markers = table
+
+      notifications = pd.get("notificationHistory")
+      if isinstance(notifications, dict):
+         compact = {}
+         for k, v in notifications.items():
+            if isinstance(v, list):
+               c = CompactList()
+               for item in v:
+                  c.append(item)
+               v = c
+            compact[k] = v
+         notifications = compact
+
+      return cls(data.get("metadata"), essential, sgs, markers,
+                 pd.get("limits"), notifications, fetchTime)
+
+   ###########################################################
+   # Server time of last upload by the conduit (seconds)
+   ###########################################################
+   def lastUpdateTime(self):
+      t = self.status.lastConduitUpdateServerDateTime
+      return None if t is None else t / 1000
+
+   ###########################################################
+   # Resolve time range bound: None, epoch seconds (pump local
+   # time as UTC) or negative = seconds before latest reading
+   ###########################################################
+   def _bound(self, t):
+      if t is None or t >= 0:
+         return t
+      if len(self.sgs) == 0:
+         return None
+      return self.sgs.times[-1] + t
+
+   ###########################################################
+   # SG readings in time range (API format)
+   ###########################################################
+   def sgRange(self, since=None, until=None):
+      times = self.sgs.times
+      since = self._bound(since)
+      until = self._bound(until)
+      lo = 0 if since is None else bisect_left(times, since)
+      hi = len(times) if until is None else bisect_right(times, until)
+      return [self.sgs.item(i) for i in range(lo, hi)]
+
+   ###########################################################
+   # Markers in time range, optionally of one type (API format)
+   ###########################################################
+   def markerRange(self, since=None, until=None, mtype=None):
+      since = self._bound(since)
+      until = self._bound(until)
+      markers = self.markers
+      result = []
+      for i in range(len(markers.times)):
+         t = markers.times[i]
+         if (since is None or t >= since) and (until is None or t <= until) and \
+            (mtype is None or markers.types[markers.kinds[i]] == mtype):
+            result.append(json.loads(markers.raw[i]))
+      return result
+
+   ###########################################################
+   # Selected patientData fields, each given as tuple of keys
+   # e.g. ("lastSG", "sg"), missing fields are left out
+   ###########################################################
+   def project(self, fields, history=True):
+      result = {}
+      for path in fields:
+         key = path[0]
+         if key in HISTORY_KEYS:
+            if not history:
+               continue
+            if key == "sgs":
+               value = self.sgs.to_list()
+            elif key == "markers":
+               value = self.markers.to_list()
+            elif key == "limits":
+               value = self.limits
+            else:
+               value = self.to_dict()["patientData"].get(key)
+         elif key in self.essential:
+            value = self.essential[key]
+         else:
+            continue
+         try:
+            for k in path[1:]:
+               value = value[int(k)] if isinstance(value, list) else value[k]
+         except (KeyError, IndexError, ValueError, TypeError):
+            continue
+         target = result
+         for k in path[:-1]:
+            target = target.setdefault(k, {})
+         target[path[-1]] = value
+      return result
+
+   ###########################################################
+   # Full display message data as nested dicts
+   ###########################################################
+   def to_dict(self):
+      pd = dict(self.essential)
+      if self.limits is not None:
+         pd["limits"] = self.limits
+      pd["markers"] = self.markers.to_list()
+      pd["sgs"] = self.sgs.to_list()
+      if self.notificationHistory is not None:
+         pd["notificationHistory"] = dict((k, v.to_list() if isinstance(v, CompactList) else v)
+                                          for k, v in self.notificationHistory.items())
+      data = {}
+      if self.metadata is not None:
+         data["metadata"] = self.metadata
+      data["patientData"] = pd
+      return data
+
+
+# Stream routing that builds the snapshot columns while parsing
+SNAPSHOT_ROUTES = {
+   ("patientData", "sgs"):                                         SGSeries,
+   ("patientData", "markers"):                                     MarkerTable,
+   ("patientData", "notificationHistory", "activeNotifications"):  CompactList,
+   ("patientData", "notificationHistory", "clearedNotifications"): CompactList,
+   }
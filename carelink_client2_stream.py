@@ -0,0 +1,318 @@
+###############################################################################
+#
+#  Carelink Client 2 streaming parser
+#
+#  Description:
+#
+#    Incremental JSON parser for the Carelink display/message response.
+#    The response is decoded chunk by chunk as it arrives. Large arrays
+#    (sgs, markers, notifications) are not materialized as a list of
+#    dicts but routed element by element into compact sinks, while all
+#    other (scalar status) fields are decoded normally.
+#
+#    A sink is any object with an append() method, so a plain list
+#    gives the same result as json.loads().
+#
+#  Changelog:
+#
+#    17/10/2026 - Initial version
+#    17/10/2026 - Keep unknown SG reading fields
+#    17/10/2026 - Fix numbers split by a chunk boundary
+#    17/10/2026 - Keep SG readings without timestamp
+#
+###############################################################################
+
+import json
+import codecs
+import calendar
+import time
+import logging as log
+from array import array
+
+
+# Read size for streamed responses
+CHUNK_SIZE = 16384
+
+WHITESPACE = " \t\r\n"
+
+# Characters that can continue a decoded number ("80." of "80.5")
+NUMBER_CHARS = "0123456789.eE+-"
+
+
+###########################################################
+# Class SGSeries
+#
+# Sensor glucose readings stored as columns:
+#   times  - epoch seconds of the (pump local) timestamp
+#   values - sensor glucose value (0 = no valid reading)
+#   states - index into the sensor state name table
+#   extras - other fields of the reading as given by the
+#            API (None if only the standard fields)
+# Readings without a valid timestamp are kept as given in
+# untimed, listed after the others in the API format.
+###########################################################
+class SGSeries(object):
+
+   __slots__ = ("times", "values", "states", "extras", "untimed", "stateNames", "__stateIndex")
+
+   # Fields stored in the columns and their usual values
+   COLUMNS = ("sg", "sensorState", "timestamp")
+   DEFAULTS = {"kind": "SG", "version": 1}
+
+   def __init__(self):
+      self.times = array("d")
+      self.values = array("H")
+      self.states = array("B")
+      self.extras = []
+      self.untimed = []
+      self.stateNames = []
+      self.__stateIndex = {}
+
+   def append(self, item):
+      try:
+         t = calendar.timegm(time.strptime(item["timestamp"], "%Y-%m-%dT%H:%M:%S"))
+      except (KeyError, ValueError, TypeError):
+         log.info("SG reading without valid timestamp kept untimed")
+         self.untimed.append(item)
+         return
+      extras = None
+      for k, v in item.items():
+         if k not in self.COLUMNS and self.DEFAULTS.get(k, extras) != v:
+            if extras is None:
+               extras = {}
+            extras[k] = v
+      try:
+         sg = max(0, min(int(item.get("sg", 0)), 0xFFFF))
+      except (ValueError, TypeError):
+         # Null or invalid value: no reading (0), the given value is kept
+         sg = 0
+         if extras is None:
+            extras = {}
+         extras["sg"] = item["sg"]
+      state = item.get("sensorState", "")
+      idx = self.__stateIndex.get(state)
+      if idx is None:
+         idx = len(self.stateNames)
+         self.stateNames.append(state)
+         self.__stateIndex[state] = idx
+      self.times.append(t)
+      self.values.append(sg)
+      self.states.append(idx)
+      self.extras.append(extras)
+
+   ###########################################################
+   # Sort readings by time (the API sends them in order)
+   ###########################################################
+   def sort(self):
+      t = self.times
+      if all(t[i] <= t[i+1] for i in range(len(t) - 1)):
+         return
+      order = sorted(range(len(t)), key=t.__getitem__)
+      self.times = array("d", (t[i] for i in order))
+      self.values = array("H", (self.values[i] for i in order))
+      self.states = array("B", (self.states[i] for i in order))
+      self.extras = [self.extras[i] for i in order]
+
+   def __len__(self):
+      return len(self.times)
+
+   ###########################################################
+   # Reading i in API format
+   ###########################################################
+   def item(self, i):
+      item = {
+         "kind":        "SG",
+         "version":     1,
+         "sg":          self.values[i],
+         "sensorState": self.stateNames[self.states[i]],
+         "timestamp":   time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(self.times[i]))
+         }
+      if self.extras[i] is not None:
+         item.update(self.extras[i])
+      return item
+
+   def __iter__(self):
+      for i in range(len(self.times)):
+         yield self.item(i)
+      for item in self.untimed:
+         yield item
+
+   def to_list(self):
+      return list(self)
+
+
+###########################################################
+# Class CompactList
+#
+# List of JSON objects, each kept as compact encoded bytes
+# and decoded only on access
+###########################################################
+class CompactList(object):
+
+   __slots__ = ("items",)
+
+   def __init__(self):
+      self.items = []
+
+   def append(self, item):
+      self.items.append(json.dumps(item, separators=(",", ":")).encode())
+
+   def __len__(self):
+      return len(self.items)
+
+   def __getitem__(self, i):
+      return json.loads(self.items[i])
+
+   def __iter__(self):
+      for b in self.items:
+         yield json.loads(b)
+
+   def to_list(self):
+      return list(self)
+
+
+# Default routing of the display/message arrays
+DEFAULT_ROUTES = {
+   ("patientData", "sgs"):                                         SGSeries,
+   ("patientData", "markers"):                                     CompactList,
+   ("patientData", "notificationHistory", "activeNotifications"):  CompactList,
+   ("patientData", "notificationHistory", "clearedNotifications"): CompactList,
+   }
+
+
+###########################################################
+# JSON encoder hook for data containing sinks
+###########################################################
+def to_json(obj):
+   try:
+      return obj.to_list()
+   except AttributeError:
+      raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+###########################################################
+# Class StreamParser
+###########################################################
+class StreamParser(object):
+
+   def __init__(self, chunks, routes=DEFAULT_ROUTES):
+      self.__chunks = iter(chunks)
+      self.__routes = routes
+      self.__prefixes = set(path[:i] for path in routes for i in range(len(path)))
+      self.__utf8 = codecs.getincrementaldecoder("utf-8")()
+      self.__decoder = json.JSONDecoder()
+      self.__buf = ""
+      self.__pos = 0
+      self.__eof = False
+
+   ###########################################################
+   # Append next chunk to buffer, drop consumed data
+   ###########################################################
+   def _fill(self):
+      if self.__eof:
+         return False
+      try:
+         chunk = next(self.__chunks)
+      except StopIteration:
+         chunk = b""
+         self.__eof = True
+      if isinstance(chunk, bytes):
+         chunk = self.__utf8.decode(chunk, final=self.__eof)
+      self.__buf = self.__buf[self.__pos:] + chunk
+      self.__pos = 0
+      return True
+
+   ###########################################################
+   # Get next non whitespace character (not consumed)
+   ###########################################################
+   def _peek(self):
+      while True:
+         while self.__pos < len(self.__buf) and self.__buf[self.__pos] in WHITESPACE:
+            self.__pos += 1
+         if self.__pos < len(self.__buf):
+            return self.__buf[self.__pos]
+         if not self._fill():
+            raise ValueError("unexpected end of JSON data")
+
+   def _expect(self, chars):
+      c = self._peek()
+      if c not in chars:
+         raise ValueError("expected %s at offset %d, found %s" % (" or ".join(chars), self.__pos, c))
+      self.__pos += 1
+      return c
+
+   ###########################################################
+   # Decode one complete JSON value from buffer
+   ###########################################################
+   def _decode_value(self):
+      self._peek()
+      while True:
+         try:
+            value, end = self.__decoder.raw_decode(self.__buf, self.__pos)
+            # A number at the end of the buffer, or followed by the start
+            # of a fraction or exponent, may continue in the next chunk
+            if self.__eof or not isinstance(value, (int, float)) or isinstance(value, bool) or \
+               (end < len(self.__buf) and self.__buf[end] not in NUMBER_CHARS):
+               self.__pos = end
+               return value
+         except json.JSONDecodeError:
+            if self.__eof:
+               raise
+         # Read at least as much again as is buffered (avoids quadratic retries)
+         target = max(2 * (len(self.__buf) - self.__pos), CHUNK_SIZE)
+         while len(self.__buf) - self.__pos < target and self._fill():
+            pass
+
+   ###########################################################
+   # Parse value at path, walking into routed objects/arrays
+   ###########################################################
+   def _parse_value(self, path):
+      if path in self.__routes:
+         return self._parse_array(self.__routes[path]())
+      if path in self.__prefixes and self._peek() == "{":
+         return self._parse_object(path)
+      return self._decode_value()
+
+   def _parse_array(self, sink):
+      if self._peek() != "[":
+         # Not an array, keep the value as is
+         return self._decode_value()
+      self.__pos += 1
+      if self._peek() == "]":
+         self.__pos += 1
+         return sink
+      while True:
+         sink.append(self._decode_value())
+         if self._expect(",]") == "]":
+            return sink
+
+   def _parse_object(self, path):
+      obj = {}
+      self._expect("{")
+      if self._peek() == "}":
+         self.__pos += 1
+         return obj
+      while True:
+         key = self._decode_value()
+         self._expect(":")
+         obj[key] = self._parse_value(path + (key,))
+         if self._expect(",}") == "}":
+            return obj
+
+   ###########################################################
+   # Parse complete document
+   ###########################################################
+   def parse(self):
+      value = self._parse_value(())
+      while self.__pos < len(self.__buf) or self._fill():
+         if self.__buf[self.__pos:].strip(WHITESPACE):
+            raise ValueError("extra data after JSON document")
+         self.__pos = len(self.__buf)
+      return value
+
+
+###########################################################
+# Parse JSON from iterable of byte (or str) chunks
+###########################################################
+def parse_stream(chunks, routes=DEFAULT_ROUTES):
+   return StreamParser(chunks, routes).parse()
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, jsonify, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, g
 import threading
 import time
 import datetime
@@ -10,17 +10,26 @@ import logging as log
 import os
 import subprocess
 import socket
+import asyncio
+import argparse
+import hashlib
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+from collections import OrderedDict
+from bisect import bisect_right
+from urllib.parse import urlsplit, parse_qs
 
-# import carelink_client2_proxy - se importará dinámicamente para evitar ejecución automática
 import carelink_client2
-
-# Definir estados
-STATUS_INIT = "STATUS_INIT"
-STATUS_DO_LOGIN = "STATUS_DO_LOGIN" 
-STATUS_LOGIN_OK = "STATUS_LOGIN_OK"
-STATUS_NEED_TKN = "STATUS_NEED_TKN"
-
-# Función eliminada - ahora usamos subprocess para el servidor proxy
+import carelink_client2_proxy
+import carelink_client2_metrics as metrics
+import carelink_client2_analytics as analytics
+import carelink_client2_shm as shm
+from carelink_client2_snapshot import Snapshot, SNAPSHOT_ROUTES
+from carelink_client2_stream import parse_stream, CHUNK_SIZE
+from carelink_client2_proxy import ResponseView
+from carelink_client2_httpd import AsyncHTTPServer
 
 app = Flask(__name__)
 app.secret_key = 'minimed_secret_key_2024'  # Necesario para flash messages
@@ -30,30 +39,84 @@ DEFAULT_NTP_SERVER = "pool.ntp.org"
 DEFAULT_TIME_ZONE  = "0"
 DEFAULT_PROXY_PORT = "8081"
 
-# API
-API_URL = "carelink/nohistory"
-API_GRAPH_URL = "carelink"
+# API (snapshot completo; la vista de estado se deriva de él)
+API_URL = "carelink"
 proxyaddr = "localhost"  # Replace with your Carelink Python Client IP address
 proxyport = 8081
+LONGPOLL_TIMEOUT = 55  # Segundos de espera máxima por datos nuevos en el proxy
+
+# Eventos (server-sent events) para avisar a la página de datos nuevos
+EVENTS_PORT = 5002
+EVENTS_HEARTBEAT = 15  # Segundos entre eventos "ping" si no hay datos nuevos
+# Conexiones abiertas como máximo (variable de entorno MINIMED_EVENTS_MAX_CLIENTS);
+# cada una usa un descriptor de archivo, ver raise_open_files_limit()
+EVENTS_MAX_CLIENTS = int(os.environ.get("MINIMED_EVENTS_MAX_CLIENTS") or 4096)
+EVENTS_RESERVED_FDS = 256  # Descriptores para Flask, el proxy y archivos
+
+# Análisis de glucosa: rango objetivo (mg/dL). También con las variables
+# de entorno MINIMED_TIR_LOW, MINIMED_TIR_HIGH y MINIMED_LOCAL_ANALYTICS=0
+# (procesos worker, sin línea de comandos). Los "limits" del paciente en
+# los datos son sus límites de alerta, no el rango objetivo.
+TIR_LOW = int(os.environ.get("MINIMED_TIR_LOW") or analytics.LOW_LIMIT)
+TIR_HIGH = int(os.environ.get("MINIMED_TIR_HIGH") or analytics.HIGH_LIMIT)
+LOCAL_ANALYTICS = os.environ.get("MINIMED_LOCAL_ANALYTICS", "1") != "0"  # False = valores del servidor
 
 # Global variables
-last_pump_data = {}
 last_update_time = None
-last_pump_graph_data = {}
-last_update_graph_time = None
+last_pump_snapshot = None  # Último snapshot (estado, sgs, marcadores)
 dst_delta = 0
 
 # Variables globales para carelink proxy
-g_status = STATUS_INIT
-recentData = None
-wait_for_params = True
 TOKENFILE = "data/logindata.json"
-UPDATE_INTERVAL = 300
-RETRY_INTERVAL = 120
 
-# Variable global para el proceso proxy
+# Proxy integrado en este proceso (None si se usa un proxy externo)
+embedded_proxy = None
+
+# Bucle asyncio del servidor de eventos: todas las conexiones abiertas son
+# corrutinas de un solo hilo (no un hilo por página conectada)
+events_loop = None
+events_changed = None  # asyncio.Event, se reemplaza en cada snapshot nuevo
+events_id = None  # Id del último snapshot publicado, ver event_id()
+events_clients = 0
+
+# Snapshot compartido entre procesos (ver minimed_mon_wsgi.py): el proceso
+# que recibe los datos lo publica, los procesos worker lo leen
+shared_writer = None
+shared_reader = None
+shared_version = 0
+shared_lock = threading.Lock()
+
+# Versión de datos en que apareció cada marcador, para el cursor del gráfico:
+# versión del snapshot -> (versión de datos, {marcador JSON: versión}), de
+# los dos últimos snapshots. La versión de datos es la de la memoria
+# compartida si se usa (igual en todos los procesos), si no la del snapshot.
+marker_versions = {}
+
+# Respuestas JSON formateadas: (nombre, clave) -> ResponseView, la clave
+# incluye la versión del snapshot y los parámetros. Las menos usadas
+# recientemente se descartan pasadas FORMATTED_VIEWS_MAX.
+FORMATTED_VIEWS_MAX = 32
+formatted_views = OrderedDict()
+formatted_views_lock = threading.Lock()
+
+# Variable global para el proceso proxy externo
 proxy_process = None
 
+# Métricas (GET /metrics)
+WEB_REQUESTS = metrics.Counter("minimed_web_requests_total", "HTTP requests by route and status code", ("route", "code"))
+WEB_RESPONSE_BYTES = metrics.Counter("minimed_web_response_bytes_total", "HTTP response body bytes by route", ("route",))
+WEB_REQUEST_TIME = metrics.Histogram("minimed_web_request_duration_seconds", "Time to handle HTTP requests", ("route",),
+                                     buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+PROXY_REQUEST_TIME = metrics.Histogram("minimed_web_proxy_request_duration_seconds",
+                                       "Proxy request latency (long-poll requests include the wait)", ("endpoint",),
+                                       buckets=metrics.DEFAULT_BUCKETS + (60.0,))
+PROXY_RESPONSES = metrics.Counter("minimed_web_proxy_responses_total", "Proxy responses by status code (error = no response)",
+                                  ("endpoint", "code"))
+SNAPSHOT_AGE = metrics.Gauge("minimed_web_snapshot_age_seconds", "Age of the displayed data")
+SNAPSHOT_AGE.set_function(lambda: None if current_snapshot() is None else time.time() - current_snapshot().fetchTime)
+EVENT_CLIENTS = metrics.Gauge("minimed_web_event_clients", "Connected server-sent event streams")
+EVENT_CLIENTS.set_function(lambda: events_clients)
+
 #################################################
 # The signal handler for the TERM signal
 #################################################
@@ -138,67 +201,157 @@ def restart_proxy():
     return start_proxy()
 
 #################################################
-# Función para ejecutar el cliente Carelink en segundo plano
+# Datos nuevos del proxy integrado (hilo del proxy)
 #################################################
-def carelink_client_thread():
-    global g_status, recentData, wait_for_params
-    
-    # Note: signal handlers only work in main thread, skipping in daemon thread
-    
-    # Main process loop
-    while True:
-       # Init Carelink client
-       client = carelink_client2.CareLinkClient(tokenFile=TOKENFILE)
-       g_status = STATUS_DO_LOGIN
-       
-       # Login to Carelink server
-       if client.init():
-          g_status = STATUS_LOGIN_OK
-
-          # Infinite loop requesting Carelink data periodically
-          i = 0
-          while True:
-             i += 1
-             log.debug("Starting download %d" % i)
-
-             try:
-                recentData = client.getRecentData()
-                if recentData != None and client.getLastResponseCode() == 200:  # HTTPStatus.OK
-                   log.debug("New data received")
-                elif client.getLastResponseCode() == 403 or client.getLastResponseCode() == 401:  # HTTPStatus.FORBIDDEN or HTTPStatus.UNAUTHORIZED
-                   # Authorization error occured
-                   log.error("ERROR: failed to get data (Authotization error, response code %d)" % client.getLastResponseCode())
-                   break
-                else:
-                   # Connection error occured
-                   log.error("ERROR: failed to get data (Connection error, response code %d)" % client.getLastResponseCode())
-                   time.sleep(60)
-                   continue
-             except Exception as e:
-                log.error(e)
-                recentData = None
-                time.sleep(60)
-                continue
-                
-             # Calculate time until next reading
-             try:
-                nextReading = int(recentData["lastConduitUpdateServerTime"]/1000) + UPDATE_INTERVAL
-                tmoSeconds  = int(nextReading - time.time())
-                log.debug("Next reading at {0}, {1} seconds from now\n".format(nextReading,tmoSeconds))
-                if tmoSeconds < 0:
-                   tmoSeconds = RETRY_INTERVAL
-             except KeyError:
-                tmoSeconds = RETRY_INTERVAL
-
-             log.debug("Waiting " + str(tmoSeconds) + " seconds before next download")
-             time.sleep(tmoSeconds+10)
-
-       # Wait for new token
-       log.info(STATUS_NEED_TKN)
-       g_status = STATUS_NEED_TKN
-       wait_for_params = True
-       while wait_for_params:
-          time.sleep(0.1)
+def on_new_snapshot(snapshot, data_version=None, body=None):
+    global last_update_time, last_pump_snapshot
+    if snapshot is None:
+        return
+    if shared_writer is not None:
+        if body is None:
+            body = snapshot_body(snapshot)
+        data_version = shared_writer.publish(body, snapshot.fetchTime)
+    elif data_version is None:
+        data_version = snapshot.version
+    label_markers(snapshot, data_version)
+    update_time = snapshot.lastUpdateTime()
+    if update_time is not None:
+        last_update_time = time.localtime(int(update_time))
+    last_pump_snapshot = snapshot
+    publish_event(event_id(snapshot))
+
+def snapshot_body(snapshot):
+    """JSON del snapshot; el del proxy integrado si ya lo serializó"""
+    views = embedded_proxy.getViews() if embedded_proxy is not None else None
+    if views is not None and views.snapshot is snapshot:
+        return views.get_view(carelink_client2_proxy.APIURL, {}).body
+    return json.dumps(snapshot.to_dict(), separators=(",", ":")).encode()
+
+def label_markers(snapshot, data_version):
+    """Marcadores nuevos del snapshot: versión de datos actual"""
+    global marker_versions
+    seen = {}
+    for _, labels in marker_versions.values():
+        seen.update(labels)
+    labels = dict((raw, seen.get(raw, data_version)) for raw in snapshot.markers.raw)
+    versions = dict(list(marker_versions.items())[-1:])
+    versions[snapshot.version] = (data_version, labels)
+    marker_versions = versions
+
+#################################################
+# Snapshot actual; en un proceso worker se relee de la memoria compartida
+# solo cuando cambió la versión publicada
+#################################################
+def current_snapshot():
+    if shared_reader is not None and shared_reader.getVersion() != shared_version:
+        load_shared_snapshot()
+    return last_pump_snapshot
+
+def load_shared_snapshot():
+    global shared_version
+    with shared_lock:
+        if shared_reader.getVersion() == shared_version:
+            return
+        published = shared_reader.read()
+        if published is None:
+            return
+        version, body, fetch_time = published
+        try:
+            data = parse_stream([body], SNAPSHOT_ROUTES)
+            on_new_snapshot(Snapshot.from_data(data, fetch_time), version)
+        except Exception as e:
+            log.error(f"Error leyendo el snapshot compartido: {e}")
+        shared_version = version
+
+def attach_shared_snapshot(filename=shm.DEFAULT_FILE):
+    """Usar el snapshot publicado por otro proceso (procesos worker)"""
+    global shared_reader
+    shared_reader = shm.SharedSnapshotReader(filename)
+
+#################################################
+# Eventos para las páginas conectadas (puerto EVENTS_PORT)
+#################################################
+def event_id(snapshot):
+    """Id del evento: hora de descarga en ms, crece también entre reinicios
+    (snapshot.version es un contador que vuelve a 1 en cada proceso)"""
+    return int(snapshot.fetchTime * 1000)
+
+def publish_event(snapshot_id):
+    # Llamado desde el hilo que recibe los datos
+    if events_loop is not None:
+        events_loop.call_soon_threadsafe(notify_event, snapshot_id)
+
+def notify_event(snapshot_id):
+    global events_id, events_changed
+    events_id = snapshot_id
+    changed = events_changed
+    events_changed = asyncio.Event()
+    changed.set()
+
+def format_event(snapshot_id):
+    return f"id: {snapshot_id}\nevent: snapshot\ndata: {snapshot_id}\n\n".encode()
+
+async def event_stream(last_id):
+    global events_clients
+    events_clients += 1
+    try:
+        yield b"retry: 5000\n\n"
+        while True:
+            # Enviar el snapshot actual si el cliente no lo tiene (también al
+            # reconectar con Last-Event-ID, o si llegaron datos nuevos durante un reinicio)
+            if events_id is not None and str(events_id) != last_id:
+                last_id = str(events_id)
+                yield format_event(events_id)
+            changed = events_changed
+            try:
+                await asyncio.wait_for(changed.wait(), EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                # Mantener viva la conexión y detectar clientes caídos
+                yield b"event: ping\ndata: \n\n"
+    finally:
+        events_clients -= 1
+
+async def handle_event_request(method, target, headers):
+    url = urlsplit(target)
+    if url.path != "/events":
+        return 404, [], b""
+    # Reanudar desde la última versión recibida (reconexión automática o ?after=)
+    last_id = headers.get("last-event-id") or parse_qs(url.query).get("after", [None])[0]
+    return 200, [("Content-Type", "text/event-stream"),
+                 ("Cache-Control", "no-cache"),
+                 ("Access-Control-Allow-Origin", "*")], event_stream(last_id)
+
+def raise_open_files_limit(needed):
+    """Subir el límite blando de archivos abiertos hasta el duro si hace falta"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= needed:
+        return
+    new_soft = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+    except (ValueError, OSError) as e:
+        log.warning(f"No se pudo subir el límite de archivos abiertos: {e}")
+        new_soft = soft
+    if new_soft < needed:
+        log.warning(f"Límite de archivos abiertos {new_soft} < {needed}: menos de "
+                    f"{EVENTS_MAX_CLIENTS} páginas conectadas (ulimit -n)")
+
+def run_event_server():
+    global events_loop, events_changed
+    raise_open_files_limit(EVENTS_MAX_CLIENTS + EVENTS_RESERVED_FDS)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    events_changed = asyncio.Event()
+    events_loop = loop
+    if last_pump_snapshot is not None:
+        notify_event(event_id(last_pump_snapshot))
+    server = AsyncHTTPServer("0.0.0.0", EVENTS_PORT, handle_event_request, maxConnections=EVENTS_MAX_CLIENTS)
+    try:
+        loop.run_until_complete(server.serve_forever())
+    except Exception as e:
+        log.error(f"Error en el servidor de eventos: {e}")
 
 def get_time_ago(timestamp):
     if not timestamp:
@@ -215,29 +368,57 @@ def get_time_ago(timestamp):
     else:
         return "Over 1 hour ago"
 
+def proxy_get(session, endpoint, url, **kwargs):
+    t = time.perf_counter()
+    try:
+        response = session.get(url, **kwargs)
+    except requests.RequestException:
+        PROXY_RESPONSES.labels(endpoint, "error").inc()
+        raise
+    finally:
+        PROXY_REQUEST_TIME.labels(endpoint).observe(time.perf_counter() - t)
+    PROXY_RESPONSES.labels(endpoint, response.status_code).inc()
+    return response
+
 def get_pump_data():
-    global last_pump_data, last_update_time, last_pump_graph_data, last_update_graph_time
+    session = requests.Session()
+    version = None
     while True:
         try:
+            # Long-poll: el proxy responde en cuanto hay datos nuevos (304 si no hay)
             proxy_url = f"http://{proxyaddr}:{proxyport}/{API_URL}"
-            response = requests.get(proxy_url)
-            if response.status_code == 200 and response.json():
-                last_pump_data = response.json()
-                last_update_time = time.localtime(int(last_pump_data["lastConduitUpdateServerDateTime"]/1000))
+            params = {"after": version, "timeout": LONGPOLL_TIMEOUT} if version is not None else None
+            response = proxy_get(session, API_URL, proxy_url, params=params, stream=True, timeout=LONGPOLL_TIMEOUT + 10)
+            with response:
+                if response.status_code == 304:
+                    continue
+                version = response.headers.get("X-Snapshot-Version")
+                if response.status_code == 200:
+                    # Una sola descarga: sgs y marcadores van directo a las columnas del
+                    # snapshot; con memoria compartida se guarda además el cuerpo recibido
+                    chunks = response.iter_content(CHUNK_SIZE)
+                    body = None
+                    if shared_writer is not None:
+                        body = []
+                        chunks = keep_chunks(chunks, body)
+                    data = parse_stream(chunks, SNAPSHOT_ROUTES)
+                    if data:
+                        on_new_snapshot(Snapshot.from_data(data), body=None if body is None else b"".join(body))
         except Exception as e:
             print(f"Error fetching pump data: {e}")
-        try:
-            proxy_graph_url = f"http://{proxyaddr}:{proxyport}/{API_GRAPH_URL}"
-            response = requests.get(proxy_graph_url)
-            if response.status_code == 200 and response.json():
-                last_pump_graph_data = response.json()
-                last_update_graph_time = time.localtime(int(last_pump_graph_data["patientData"]["lastConduitUpdateServerDateTime"]/1000))
-        except Exception as e:
-            print(f"Error fetching pump graph data: {e}")
-        time.sleep(60)  # Update every 60 seconds
+            version = None
+            time.sleep(60)
+            continue
+        if version is None:
+            time.sleep(60)  # Proxy sin long-poll: actualizar cada 60 segundos
+
+def keep_chunks(chunks, kept):
+    for chunk in chunks:
+        kept.append(chunk)
+        yield chunk
 
-def format_pump_data():
-    if not last_pump_data:
+def format_pump_data(snapshot):
+    if snapshot is None:
         return {
             "glucose": "--",
             "battery": "unk",
@@ -252,31 +433,136 @@ def format_pump_data():
             "banner_state": None
         }
 
-    data = last_pump_data
-    have_data = data["conduitInRange"] and data["conduitMedicalDeviceInRange"]
+    # Campos de estado ya extraídos en el snapshot (sin copiar patientData)
+    status = snapshot.status
+    have_data = status.conduitInRange and status.conduitMedicalDeviceInRange
 
-    # print("data -> ", data) 
-    
     formatted_data = {
-        "glucose": str(data["lastSG"]["sg"]) if data["lastSG"]["sg"] > 0 else "--",
-        "battery": str(data["pumpBatteryLevelPercent"]) if have_data else "unk",
-        "reservoir": str(data["reservoirRemainingUnits"]) if have_data else "unk",
-        "active_insulin": f"{round(data['activeInsulin']['amount'], 1)} U" if have_data else "-- U",
-        "sensor_connection": data["conduitSensorInRange"],
+        "glucose": str(status.lastSG) if status.lastSG > 0 else "--",
+        "battery": str(status.pumpBatteryLevelPercent) if have_data else "unk",
+        "reservoir": str(status.reservoirRemainingUnits) if have_data else "unk",
+        "active_insulin": f"{round(status.activeInsulin, 1)} U" if have_data and status.activeInsulin is not None else "-- U",
+        "sensor_connection": status.conduitSensorInRange,
         "last_update": time.strftime("%H:%M", last_update_time) if last_update_time else "--:--",
         "time_ago": get_time_ago(last_update_time),
-        "sensor_age": str(round(data["sensorDurationHours"]/24)) if data["sensorDurationHours"] != 255 and have_data else "",
-        "calibration_status": data["calibStatus"],
-        "trend": data["lastSGTrend"].lower() if "lastSGTrend" in data else "none",
-        "time_to_calib": data["timeToNextCalibHours"] if "timeToNextCalibHours" in data else 255,
-        "sensor_status": data["sensorState"],
-        "banner_state": data["pumpBannerState"][0]["type"].lower() if "pumpBannerState" in data and data["pumpBannerState"] else None
+        "sensor_age": str(round(status.sensorDurationHours/24)) if status.sensorDurationHours != 255 and have_data else "",
+        "calibration_status": status.calibStatus,
+        "trend": status.lastSGTrend.lower(),
+        "time_to_calib": status.timeToNextCalibHours,
+        "sensor_status": status.sensorState,
+        "banner_state": status.pumpBannerState[0].lower() if status.pumpBannerState else None
     }
     return formatted_data
 
-def format_pump_graph_data():
-    if not last_pump_graph_data:
+def format_marker(marker_type, t, values):
+    """Marcador del gráfico, None si sus datos no son válidos"""
+    try:
+        time_str = time.strftime("%H:%M", time.gmtime(t))
+        
+        marker_data = {
+            "time": time_str,
+            "t": int(t),
+            "type": marker_type
+        }
+        
+        # Procesar específicamente los marcadores AUTO_BASAL_DELIVERY
+        if marker_type == "AUTO_BASAL_DELIVERY":
+            marker_data.update({
+                "value": 250,  # Valor fijo en la parte superior
+                "color": "#9370DB",  # Color lila
+                "radius": float(values.get("bolusAmount","4")) * 80,  # Tamaño basado en bolusAmount convertido a float
+                "borderWidth": 0  # Sin borde
+            })
+        elif marker_type == "CALIBRATION":
+            marker_data.update({
+                "value": float(values.get("unitValue", "0")),  # Usar el valor de bolusAmount
+                "color": "#FF0000",  # Color rojo
+                "radius": 4,  # Radio fijo
+                "borderWidth": 0  # Sin borde
+            })
+        elif marker_type == "INSULIN" and values.get("activationType", "0") == "AUTOCORRECTION":
+            marker_data.update({
+                "value": 240,  # Usar el valor de bolusAmount
+                "color": "#0000FF",  # Color azul
+                "radius": float(values.get("deliveredFastAmount","4")) * 40,  # Tamaño basado en bolusAmount convertido a float
+                "borderWidth": 0  # Sin borde
+            })
+        elif marker_type == "INSULIN" and values.get("activationType", "0") == "RECOMMENDED":
+            marker_data.update({
+                "value": 250,  # Usar el valor de bolusAmount
+                "color": "#00FF00",  # Color verde
+                "radius": float(values.get("deliveredFastAmount","4")) * 6,  # Tamaño basado en bolusAmount convertido a float
+                # "radius": 3,
+                "borderWidth": 0,  # Sin borde
+                # "pointStyle": "star"  # Usar asterisco en lugar de círculo
+            })
+        elif marker_type == "MEAL":
+            marker_data.update({
+                "value": 40,  # Usar el valor de bolusAmount
+                "color": "#FFFF00",  # Color amarillo
+                "radius": float(values.get("amount","4")) * 0.4,  # Tamaño basado en bolusAmount convertido a float
+                "borderWidth": 0,  # Sin borde
+            })
+        else:
+            # Configuración por defecto para otros tipos de marcadores
+            marker_data.update({
+                "value": 0,
+                "color": "#FF0000",
+                "radius": 4
+            })
+        
+        return marker_data
+    except (ValueError, KeyError) as e:
+        print(f"Error processing marker: {e}")
+        return None
+
+def format_markers(markers, indices):
+    """Marcadores del gráfico con un identificador de su contenido"""
+    formatted = []
+    for i in indices:
+        marker_data = format_marker(markers.types[markers.kinds[i]], markers.times[i], markers.values[i])
+        if marker_data is not None:
+            marker_data["id"] = hashlib.sha1(markers.raw[i]).hexdigest()[:16]
+            formatted.append(marker_data)
+    return formatted
+
+def format_glucose_points(times, sg_values, indices):
+    return [{
+        "time": time.strftime("%H:%M", time.gmtime(times[i])),
+        "t": int(times[i]),
+        "value": sg_values[i]
+    } for i in indices]
+
+#################################################
+# Cursor de actualizaciones del gráfico: "<hora última SG>.<versión de
+# datos>" (hora en segundos epoch de la hora local de la bomba). Los
+# marcadores se siguen por la versión en que aparecieron, no por su hora:
+# la bomba puede subir tarde marcadores anteriores a los ya enviados.
+#################################################
+def graph_cursor(snapshot):
+    sg_time = snapshot.sgs.times[-1] if len(snapshot.sgs) else 0
+    return "%d.%d" % (sg_time, snapshot_marker_versions(snapshot)[0])
+
+def snapshot_marker_versions(snapshot):
+    return marker_versions.get(snapshot.version, (0, {}))
+
+def parse_graph_cursor(cursor):
+    sg_time, marker_time = cursor.split(".")
+    return int(sg_time), int(marker_time)
+
+def graph_window_start(snapshot):
+    return int(snapshot.sgs.times[0]) if len(snapshot.sgs) else 0
+
+def marker_window_start(snapshot):
+    return int(min(snapshot.markers.times)) if len(snapshot.markers) else 0
+
+def format_pump_graph_data(snapshot, points=None):
+    if snapshot is None:
         return {
+            "cursor": None,
+            "reset": True,
+            "start": 0,
+            "marker_start": 0,
             "glucose_history": [],
             "time_range": {
                 "below": 0,
@@ -284,128 +570,165 @@ def format_pump_graph_data():
                 "above": 0
             },
             "average_sg": 0,
+            "stats": None,
             "markers": []
         }
 
-    data = last_pump_graph_data["patientData"]
-    # print("Datos completos del paciente:", json.dumps(data, indent=2))
-    
-    # Procesar datos del gráfico
-    glucose_history = []
-    if "sgs" in data:
-        # Ordenar los datos por timestamp
-        sorted_sgs = sorted(data["sgs"], key=lambda x: x["timestamp"])
-        
-        for sg in sorted_sgs:
-            if sg["sg"] > 0:  # Solo valores válidos
-                try:
-                    timestamp = datetime.datetime.strptime(sg["timestamp"], "%Y-%m-%dT%H:%M:%S")
-                    time_str = timestamp.strftime("%H:%M")
-                    glucose_history.append({
-                        "time": time_str,
-                        "value": sg["sg"]
-                    })
-                except (ValueError, KeyError) as e:
-                    print(f"Error processing timestamp: {e}")
-                    continue
+    # Procesar datos del gráfico (columnas ya ordenadas por timestamp)
+    times = snapshot.sgs.times
+    sg_values = snapshot.sgs.values
+    valid = analytics.valid_indices(sg_values)  # Solo valores válidos
+    if points is not None and len(valid) > points:
+        # Reducir a 'points' puntos conservando la forma de la curva
+        selected = analytics.lttb([times[i] for i in valid], [sg_values[i] for i in valid], points)
+        valid = [valid[i] for i in selected]
+    glucose_history = format_glucose_points(times, sg_values, valid)
     
     # Procesar marcadores
-    markers = []
-    if "markers" in data:
-        # print("Marcadores encontrados:", json.dumps(data["markers"], indent=2))
-        for marker in data["markers"]:
-            try:
-                timestamp = datetime.datetime.strptime(marker["timestamp"], "%Y-%m-%dT%H:%M:%S")
-                time_str = timestamp.strftime("%H:%M")
-                marker_type = marker.get("type", "unknown")
-                
-                marker_data = {
-                    "time": time_str,
-                    "type": marker_type
-                }
-                
-                # Procesar específicamente los marcadores AUTO_BASAL_DELIVERY
-                if marker_type == "AUTO_BASAL_DELIVERY":
-                    marker_data.update({
-                        "value": 250,  # Valor fijo en la parte superior
-                        "color": "#9370DB",  # Color lila
-                        "radius": float(marker.get("data", {}).get("dataValues", {}).get("bolusAmount","4")) * 80,  # Tamaño basado en bolusAmount convertido a float
-                        "borderWidth": 0  # Sin borde
-                    })
-                elif marker_type == "CALIBRATION":
-                    marker_data.update({
-                        "value": float(marker.get("data", {}).get("dataValues", {}).get("unitValue", "0")),  # Usar el valor de bolusAmount
-                        "color": "#FF0000",  # Color rojo
-                        "radius": 4,  # Radio fijo
-                        "borderWidth": 0  # Sin borde
-                    })
-                elif marker_type == "INSULIN" and marker.get("data", {}).get("dataValues", {}).get("activationType", "0") == "AUTOCORRECTION":
-                    print("marker_data insulin 1 -> ", marker.get("data", {}).get("dataValues", {}).get("deliveredFastAmount","4"))
-                    marker_data.update({
-                        "value": 240,  # Usar el valor de bolusAmount
-                        "color": "#0000FF",  # Color azul
-                        "radius": float(marker.get("data", {}).get("dataValues", {}).get("deliveredFastAmount","4")) * 40,  # Tamaño basado en bolusAmount convertido a float
-                        "borderWidth": 0  # Sin borde
-                    })
-                elif marker_type == "INSULIN" and marker.get("data", {}).get("dataValues", {}).get("activationType", "0") == "RECOMMENDED":
-                    print("marker_data insulin 2 -> ", marker.get("data", {}).get("dataValues", {}).get("deliveredFastAmount","4"))
-                    marker_data.update({
-                        "value": 250,  # Usar el valor de bolusAmount
-                        "color": "#00FF00",  # Color verde
-                        "radius": float(marker.get("data", {}).get("dataValues", {}).get("deliveredFastAmount","4")) * 6,  # Tamaño basado en bolusAmount convertido a float
-                        # "radius": 3,
-                        "borderWidth": 0,  # Sin borde
-                        # "pointStyle": "star"  # Usar asterisco en lugar de círculo
-                    })
-                elif marker_type == "MEAL":
-                    print("marker_data MEAL -> ", marker.get("data", {}).get("dataValues", {}).get("amount","-"), " -> ", marker.get("timestamp", "---"))
-                    marker_data.update({
-                        "value": 40,  # Usar el valor de bolusAmount
-                        "color": "#FFFF00",  # Color amarillo
-                        "radius": float(marker.get("data", {}).get("dataValues", {}).get("amount","4")) * 0.4,  # Tamaño basado en bolusAmount convertido a float
-                        "borderWidth": 0,  # Sin borde
-                    })
-                else:
-                    # Configuración por defecto para otros tipos de marcadores
-                    marker_data.update({
-                        "value": marker.get("value", 0),
-                        "color": "#FF0000",
-                        "radius": 4
-                    })
-                
-                markers.append(marker_data)
-            except (ValueError, KeyError) as e:
-                print(f"Error processing marker: {e}")
-                continue
-    else:
-        print("No se encontraron marcadores en los datos")
+    markers = format_markers(snapshot.markers, range(len(snapshot.markers)))
     
-    # Obtener estadísticas y marcadores
+    # Estadísticas calculadas sobre todas las lecturas (las del servidor si
+    # no hay lecturas o están desactivadas)
+    status = snapshot.status
+    stats = analytics.sg_stats(sg_values, TIR_LOW, TIR_HIGH) if LOCAL_ANALYTICS else None
+    if stats is None:
+        time_range = {
+            "below": status.belowHypoLimit,
+            "in_range": status.timeInRange,
+            "above": status.aboveHyperLimit
+        }
+        average_sg = status.averageSG
+    else:
+        time_range = {
+            "below": round(stats["below"]),
+            "in_range": round(stats["in_range"]),
+            "above": round(stats["above"])
+        }
+        average_sg = round(stats["mean"])
+        stats = {
+            "low": TIR_LOW,
+            "high": TIR_HIGH,
+            "count": stats["count"],
+            "mean": round(stats["mean"], 1),
+            "sd": round(stats["sd"], 1),
+            "cv": round(stats["cv"], 1),
+            "gmi": round(stats["gmi"], 1),
+            "percentiles": dict((str(p), round(v, 1)) for p, v in stats["percentiles"].items())
+        }
     formatted_data = {
+        "cursor": graph_cursor(snapshot),
+        "reset": True,  # Reemplaza los datos del cliente
+        "start": graph_window_start(snapshot),
+        "marker_start": marker_window_start(snapshot),
         "glucose_history": glucose_history,
-        "time_range": {
-            "below": data.get("belowHypoLimit", 0),
-            "in_range": data.get("timeInRange", 0),
-            "above": data.get("aboveHyperLimit", 0)
-        },
-        "average_sg": data.get("averageSG", 0),
+        "time_range": time_range,
+        "average_sg": average_sg,
+        "stats": stats,
         "markers": markers
     }
     
-    # print("Datos formateados:", json.dumps(formatted_data, indent=2))
     return formatted_data
 
+#################################################
+# Respuesta JSON formateada, calculada una vez por nombre y clave
+#################################################
+def get_formatted_view(name, key, build):
+    cache_key = (name, key)
+    with formatted_views_lock:
+        view = formatted_views.get(cache_key)
+        if view is not None:
+            formatted_views.move_to_end(cache_key)
+            return view
+        view = formatted_views[cache_key] = ResponseView(json.dumps(build(), separators=(",", ":")).encode())
+        if len(formatted_views) > FORMATTED_VIEWS_MAX:
+            formatted_views.popitem(last=False)
+    return view
+
+def send_formatted_view(view):
+    headers = {"ETag": view.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if view.matches(request.headers.get("If-None-Match")):
+        return "", 304, headers
+    encoding, body = view.negotiate(request.headers.get("Accept-Encoding"))
+    headers["Content-Type"] = "application/json"
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return body, 200, headers
+
+#################################################
+# Solo lecturas y marcadores posteriores al cursor; si el cursor no
+# corresponde a los datos actuales, gráfico completo con "reset"
+#################################################
+def format_pump_graph_delta(snapshot, since):
+    sg_since, marker_since = since
+    if snapshot is None:
+        return {"cursor": None, "reset": True, "start": 0, "marker_start": 0, "glucose_history": [], "markers": []}
+    times = snapshot.sgs.times
+    sg_time = times[-1] if len(times) else 0
+    data_version, labels = snapshot_marker_versions(snapshot)
+    if sg_since > sg_time or marker_since > data_version or (len(times) and sg_since < times[0]):
+        return format_pump_graph_data(snapshot)
+
+    sg_values = snapshot.sgs.values
+    lo = bisect_right(times, sg_since)
+    valid = [lo + i for i in analytics.valid_indices(sg_values[lo:])]
+    markers = snapshot.markers
+    new_markers = format_markers(markers, [i for i, raw in enumerate(markers.raw)
+                                           if labels.get(raw, data_version) > marker_since])
+    return {
+        "cursor": graph_cursor(snapshot),
+        "reset": False,
+        "start": graph_window_start(snapshot),
+        "marker_start": marker_window_start(snapshot),
+        "glucose_history": format_glucose_points(times, sg_values, valid),
+        "markers": new_markers
+    }
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def count_request(response):
+    route = request.url_rule.rule if request.url_rule is not None else "other"
+    if "request_start" in g:
+        WEB_REQUEST_TIME.labels(route).observe(time.perf_counter() - g.request_start)
+    WEB_REQUESTS.labels(route, response.status_code).inc()
+    WEB_RESPONSE_BYTES.labels(route).inc(response.content_length or 0)
+    return response
+
+@app.route('/metrics')
+def get_metrics():
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', events_port=EVENTS_PORT, events_heartbeat=EVENTS_HEARTBEAT)
 
 @app.route('/api/pump-data')
 def get_current_pump_data():
-    return jsonify(format_pump_data())
+    snapshot = current_snapshot()
+    # "time_ago" cambia con el reloj, no solo con el snapshot
+    key = (snapshot and snapshot.version, get_time_ago(last_update_time))
+    return send_formatted_view(get_formatted_view("pump-data", key, lambda: format_pump_data(snapshot)))
 
 @app.route('/api/pump-graph-data')
 def get_current_pump_graph_data():
-    return jsonify(format_pump_graph_data())
+    snapshot = current_snapshot()
+    # ?since=<cursor>: solo los datos nuevos desde la respuesta anterior
+    since = request.args.get("since")
+    if since is not None:
+        try:
+            since = parse_graph_cursor(since)
+        except ValueError:
+            return "", 400
+        key = (snapshot and snapshot.version, since)
+        return send_formatted_view(get_formatted_view("pump-graph-delta", key, lambda: format_pump_graph_delta(snapshot, since)))
+    # ?points=N: historial reducido a N puntos (LTTB) para pantallas pequeñas
+    points = request.args.get("points", type=int)
+    if points is not None and points < 3:
+        return "", 400
+    key = (snapshot and snapshot.version, points)
+    return send_formatted_view(get_formatted_view("pump-graph-data", key, lambda: format_pump_graph_data(snapshot, points)))
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -439,13 +762,19 @@ def login():
                     with open(backup_path, 'w') as backup:
                         backup.write(original.read())
             
-            # Guardar el nuevo contenido
-            with open(logindata_path, 'w', encoding='utf-8') as f:
-                json.dump(json_data, f, indent=4, ensure_ascii=False)
+            # Guardar el nuevo contenido (escritura atómica, con bloqueo compartido con el proxy)
+            token_store = carelink_client2.TokenStore(logindata_path)
+            with token_store.lock():
+                token_store.write(json_data)
             
             # Reiniciar el servidor proxy para que use los nuevos datos
-            log.info("Reiniciando servidor proxy debido a cambios en logindata.json...")
-            restart_success = restart_proxy()
+            if embedded_proxy is not None:
+                log.info("Nuevo login del proxy integrado debido a cambios en logindata.json...")
+                embedded_proxy.reloadToken()
+                restart_success = True
+            else:
+                log.info("Reiniciando servidor proxy debido a cambios en logindata.json...")
+                restart_success = restart_proxy()
             
             if restart_success:
                 message = 'Los datos de login se han guardado correctamente y el servidor proxy se ha reiniciado.'
@@ -499,26 +828,54 @@ if __name__ == '__main__':
     FORMAT = '[%(asctime)s:%(levelname)s] %(message)s'
     log.basicConfig(format=FORMAT, datefmt='%Y-%m-%d %H:%M:%S', level=log.INFO)
     
+    parser = argparse.ArgumentParser(description="MiniMed Monitor Web")
+    parser.add_argument("-s", "--shared", action="store_true",
+                        help="publicar cada snapshot en memoria compartida para procesos worker (minimed_mon_wsgi.py)")
+    parser.add_argument("-i", "--ingest-only", action="store_true",
+                        help="solo recibir y publicar los datos, sin servidor Flask (implica --shared)")
+    parser.add_argument("--tir-low", type=int, default=TIR_LOW,
+                        help="límite inferior del rango objetivo en mg/dL (por defecto: %d)" % TIR_LOW)
+    parser.add_argument("--tir-high", type=int, default=TIR_HIGH,
+                        help="límite superior del rango objetivo en mg/dL (por defecto: %d)" % TIR_HIGH)
+    parser.add_argument("--no-local-analytics", action="store_false", dest="local_analytics", default=LOCAL_ANALYTICS,
+                        help="mostrar el tiempo en rango y la media calculados por CareLink")
+    args = parser.parse_args()
+    TIR_LOW, TIR_HIGH, LOCAL_ANALYTICS = args.tir_low, args.tir_high, args.local_analytics
+
     log.info("Starting MiniMed Monitor Web with Carelink Client Proxy integration")
+
+    if args.shared or args.ingest_only:
+        try:
+            shared_writer = shm.SharedSnapshotWriter()
+        except RuntimeError as e:
+            log.error(f"Error: {e}")
+            sys.exit(1)
+        log.info(f"Publicando snapshots en {shm.DEFAULT_FILE}")
     
     # Check if proxy server is already running
     if is_proxy_running():
+        # Proxy externo: recibir los datos por HTTP
         log.info("Servidor proxy ya está ejecutándose en puerto 8081")
+        log.info("Iniciando recolección de datos...")
+        data_thread = threading.Thread(target=get_pump_data, daemon=True)
+        data_thread.start()
     else:
-        log.info("No se detectó servidor proxy. Iniciando proceso independiente...")
-        if not start_proxy():
-            log.info("Continuando sin servidor proxy...")
-    
-    # Start the Carelink client thread
-    log.info("Iniciando cliente Carelink...")
-    carelink_thread = threading.Thread(target=carelink_client_thread, daemon=True)
-    carelink_thread.start()
-    
-    # Start the background thread for data collection
-    log.info("Iniciando recolección de datos...")
-    data_thread = threading.Thread(target=get_pump_data, daemon=True)
-    data_thread.start()
+        # Proxy integrado: los datos llegan sin pasar por HTTP, la API
+        # del proxy sigue disponible en el puerto 8081 para otros clientes
+        log.info("No se detectó servidor proxy. Iniciando proxy integrado...")
+        embedded_proxy = carelink_client2_proxy.CareLinkProxy(tokenFile=TOKENFILE, port=proxyport)
+        embedded_proxy.addListener(on_new_snapshot)
+        embedded_proxy.start()
     
+    # Servidor de eventos para actualizar las páginas en cuanto llegan datos
+    threading.Thread(target=run_event_server, daemon=True).start()
+
+    if args.ingest_only:
+        # Las peticiones las atienden los procesos worker
+        log.info("Modo solo ingesta: sin servidor Flask")
+        while True:
+            time.sleep(3600)
+
     # Run the Flask app
     log.info("Iniciando servidor Flask en puerto 5001...")
     app.run(host='0.0.0.0', port=5001, debug=False, use_reloader=False) 
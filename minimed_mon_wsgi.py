@@ -0,0 +1,22 @@
+#################################################
+# Punto de entrada WSGI para atender la aplicación web con varios
+# procesos worker, por ejemplo:
+#
+#   python minimed-mon-web.py --ingest-only
+#   gunicorn -w 4 -b 0.0.0.0:5001 minimed_mon_wsgi:app
+#
+# Un solo proceso (--ingest-only) recibe los datos y publica cada
+# snapshot en memoria compartida; los workers solo lo leen, no inician
+# el proxy ni el servidor de eventos.
+#################################################
+import os
+import importlib.util
+
+_spec = importlib.util.spec_from_file_location("minimed_mon_web",
+                                               os.path.join(os.path.dirname(os.path.abspath(__file__)), "minimed-mon-web.py"))
+web = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(web)
+
+web.attach_shared_snapshot()
+
+app = web.app
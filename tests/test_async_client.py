@@ -0,0 +1,160 @@
+###############################################################################
+#
+#  AsyncCareLinkClient tests against a local stub of the Carelink API
+#  (discovery, SSO config, user, display message, token endpoints)
+#
+#  Run with:  python -m pytest tests
+#
+###############################################################################
+
+import json
+import time
+import base64
+import socket
+import asyncio
+
+import pytest
+
+# aiohttp is in requirements-dev.txt, a missing package fails the tests
+from aiohttp import web
+
+import carelink_client2
+
+
+CONCURRENT_CALLS = 500
+POOL_MAXSIZE     = 10
+
+
+def make_jwt(exp, username="patient"):
+   payload = {"exp": exp, "token_details": {"country": "CL", "preferred_username": username}}
+   encoded = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+   return "header." + encoded + ".signature"
+
+
+###########################################################
+# Stub Carelink API, counts calls and concurrent requests
+###########################################################
+class StubServer(object):
+
+   def __init__(self, delay=0.01):
+      self.delay = delay
+      self.calls = {"data": 0, "refresh": 0}
+      self.active = 0
+      self.maxActive = 0
+      self.baseUrl = None
+      self.__runner = None
+
+   async def start(self):
+      app = web.Application()
+      app.router.add_get("/discover", self.discover)
+      app.router.add_get("/sso", self.sso)
+      app.router.add_get("/carelink/users/me", self.user)
+      app.router.add_post("/cumulus/display/message", self.data)
+      app.router.add_post("/sso/token", self.token)
+      sock = socket.socket()
+      sock.bind(("127.0.0.1", 0))
+      self.baseUrl = "http://127.0.0.1:%d" % sock.getsockname()[1]
+      self.__runner = web.AppRunner(app)
+      await self.__runner.setup()
+      await web.SockSite(self.__runner, sock).start()
+
+   async def stop(self):
+      await self.__runner.cleanup()
+
+   async def discover(self, request):
+      return web.json_response({
+         "supportedCountries": [{"CL": {"region": "EU"}}],
+         "CP": [{"region": "EU",
+                 "SSOConfiguration": self.baseUrl + "/sso",
+                 "baseUrlCareLink": self.baseUrl + "/carelink",
+                 "baseUrlCumulus": self.baseUrl + "/cumulus"}]
+         })
+
+   async def sso(self, request):
+      return web.json_response({"system_endpoints": {"token_endpoint_path": "/token"}})
+
+   async def user(self, request):
+      return web.json_response({"role": "PATIENT", "firstName": "First", "lastName": "Last"})
+
+   async def data(self, request):
+      self.calls["data"] += 1
+      self.active += 1
+      self.maxActive = max(self.maxActive, self.active)
+      try:
+         await asyncio.sleep(self.delay)
+      finally:
+         self.active -= 1
+      return web.json_response({"patientData": {"lastSG": {"sg": 120}}})
+
+   async def token(self, request):
+      self.calls["refresh"] += 1
+      await asyncio.sleep(self.delay)
+      return web.json_response({"access_token": make_jwt(time.time() + 3600), "refresh_token": "refresh-2"})
+
+
+@pytest.fixture
+def token_file(tmp_path):
+   def write(expires_in, refresh_token="refresh-1"):
+      path = tmp_path / "logindata.json"
+      path.write_text(json.dumps({
+         "access_token":   make_jwt(time.time() + expires_in),
+         "refresh_token":  refresh_token,
+         "scope":          "profile openid",
+         "client_id":      "client",
+         "client_secret":  "secret",
+         "mag-identifier": "mag"
+         }))
+      return str(path)
+   return write
+
+
+def run_client(monkeypatch, tokenFile, calls, after_init=None):
+   async def main():
+      server = StubServer()
+      await server.start()
+      monkeypatch.setattr(carelink_client2, "CARELINK_CONFIG_URL", server.baseUrl + "/discover")
+      monkeypatch.setattr(carelink_client2.CareLinkClientBase, "_sso_token_url",
+                          lambda self, sso_config: server.baseUrl + "/sso" + sso_config["system_endpoints"]["token_endpoint_path"])
+      client = carelink_client2.AsyncCareLinkClient(tokenFile=tokenFile, poolMaxsize=POOL_MAXSIZE, cacheFile=None)
+      try:
+         assert await client.init()
+         if after_init is not None:
+            after_init()
+         results = await asyncio.gather(*[client.getRecentData() for i in range(calls)])
+      finally:
+         await client.close()
+         await server.stop()
+      return server, results
+   return asyncio.run(main())
+
+
+def test_concurrent_get_recent_data(monkeypatch, token_file):
+   server, results = run_client(monkeypatch, token_file(3600), CONCURRENT_CALLS)
+
+   assert len(results) == CONCURRENT_CALLS
+   assert all(r == {"patientData": {"lastSG": {"sg": 120}}} for r in results)
+   assert server.calls == {"data": CONCURRENT_CALLS, "refresh": 0}
+   # Requests overlap, limited by the connection pool
+   assert 1 < server.maxActive <= POOL_MAXSIZE
+
+
+def test_concurrent_calls_refresh_token_once(monkeypatch, token_file):
+   tokenFile = token_file(-60)
+   server, results = run_client(monkeypatch, tokenFile, CONCURRENT_CALLS)
+
+   assert all(r is not None for r in results)
+   assert server.calls == {"data": CONCURRENT_CALLS, "refresh": 1}
+   with open(tokenFile) as f:
+      assert json.load(f)["refresh_token"] == "refresh-2"
+
+
+def test_token_rotated_by_another_process(monkeypatch, token_file):
+   tokenFile = token_file(-60)
+   # Another process refreshes the token after this client read it
+   server, results = run_client(monkeypatch, tokenFile, CONCURRENT_CALLS,
+                                after_init=lambda: token_file(3600, "refresh-other"))
+
+   assert all(r is not None for r in results)
+   assert server.calls == {"data": CONCURRENT_CALLS, "refresh": 0}
+   with open(tokenFile) as f:
+      assert json.load(f)["refresh_token"] == "refresh-other"
@@ -0,0 +1,75 @@
+###############################################################################
+#
+#  Streaming parser tests: documents split into chunks at any offset
+#  must parse like json.loads()
+#
+#  Run with:  python -m pytest tests
+#
+###############################################################################
+
+import os
+import re
+import json
+
+import pytest
+
+from carelink_client2_stream import parse_stream, DEFAULT_ROUTES
+from carelink_client2_snapshot import Snapshot, SNAPSHOT_ROUTES
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates", "data_graph.json")
+
+# Float scalars directly under patientData
+FLOAT_FIELDS = ("reservoirRemainingUnits", "maxAutoBasalRate", "maxBolusAmount", "averageSGFloat")
+
+
+@pytest.fixture(scope="module")
+def document():
+   with open(FIXTURE, "rb") as f:
+      return f.read()
+
+
+def split_offsets(document, field):
+   match = re.search(rb'"%s"\s*:\s*(-?[0-9.eE+-]+)' % field.encode(), document)
+   assert match is not None, field
+   return range(match.start(1) - 2, match.end(1) + 3)
+
+
+@pytest.mark.parametrize("field", FLOAT_FIELDS)
+def test_split_inside_number(document, field):
+   expected = json.loads(document)
+   for offset in split_offsets(document, field):
+      chunks = [document[:offset], document[offset:]]
+      assert parse_stream(chunks, {}) == expected, offset
+      data = parse_stream(chunks, DEFAULT_ROUTES)
+      assert data["patientData"][field] == expected["patientData"][field], offset
+
+
+@pytest.mark.parametrize("chunks, expected", [
+   ([b'{"patientData": {"reservoir": 80.', b'5}}'], {"patientData": {"reservoir": 80.5}}),
+   ([b'[1e', b'3, 2', b'0, -', b'1]'],             [1000.0, 20, -1]),
+   ([b'[12', b'.', b'25', b']'],                   [12.25]),
+   ([b'{"a": 7}'],                                 {"a": 7}),
+   ])
+def test_split_numbers(chunks, expected):
+   assert parse_stream(chunks, {}) == expected
+
+
+def test_entries_without_timestamp_are_kept(document):
+   data = json.loads(document)
+   pd = data["patientData"]
+   pd["sgs"][3]["timestamp"] = None
+   del pd["sgs"][5]["timestamp"]
+   pd["markers"][2]["timestamp"] = "not a time"
+   del pd["markers"][4]["timestamp"]
+   document = json.dumps(data).encode()
+
+   snapshot = Snapshot.from_data(parse_stream([document], SNAPSHOT_ROUTES))
+   assert len(snapshot.sgs) == len(pd["sgs"]) - 2
+   assert len(snapshot.markers) == len(pd["markers"]) - 2
+   result = snapshot.to_dict()["patientData"]
+   # Untimed entries are listed after the others
+   untimed_sgs = [pd["sgs"][3], pd["sgs"][5]]
+   untimed_markers = [pd["markers"][2], pd["markers"][4]]
+   assert result["sgs"] == [sg for sg in pd["sgs"] if sg not in untimed_sgs] + untimed_sgs
+   assert result["markers"] == [m for m in pd["markers"] if m not in untimed_markers] + untimed_markers